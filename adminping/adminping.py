@@ -0,0 +1,290 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A plugin that lets players ping the admins (e.g. on a Discord webhook) from in-game chat.
+#
+
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The chat command players use to ping the admins, e.g. "!admin someone is teamkilling at main".
+ADMIN_PING_COMMAND = '!admin'
+
+# A player can only ping the admins once in this duration (in seconds). Extra pings are dropped.
+DEFAULT_DEDUP_WINDOW_S = 60.0
+
+# The maximum number of events delivered in a single webhook request.
+DEFAULT_BATCH_SIZE = 10
+
+# How long to wait (in seconds) for the webhook to respond.
+DEFAULT_REQUEST_TIMEOUT_S = 10.0
+
+# How long the sender waits (in seconds) after its first failed delivery, and the most it ever waits between retries.
+# The wait doubles after each consecutive failure.
+DEFAULT_INITIAL_BACKOFF_S = 1.0
+DEFAULT_MAX_BACKOFF_S = 300.0
+
+# The most characters Discord accepts in the content of one webhook message.
+MAX_WEBHOOK_CONTENT_LENGTH = 2000
+
+# The strings to be formatted and sent to the player that pinged the admins.
+PING_SENT_MESSAGE = 'The admins have been pinged. Please be patient.'
+PING_DROPPED_MESSAGE = 'You have already pinged the admins recently. Please be patient.'
+# The string to be formatted for every ping event delivered to the webhook.
+PING_EVENT_TEMPLATE = '[{server}] {player_name} ({player_id}) on {current_map}: {message}'
+
+
+class EventQueue:
+    """
+    A persistent on-disk FIFO queue of JSON events (backed by SQLite), so that pings survive bot restarts and webhook
+    outages. Safe to use from the main loop and the sender thread at the same time.
+    """
+
+    def __init__(self, filepath):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(filepath), check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)')
+
+    def put(self, event):
+        """ Appends the given event (a JSON serializable dict) to the queue. """
+        with self.lock:
+            self.connection.execute('INSERT INTO events (payload) VALUES (?)', (json.dumps(event),))
+
+    def peek(self, limit):
+        """ Returns up to limit of the oldest events (without removing them) as a list of (event_id, event) tuples. """
+        with self.lock:
+            rows = self.connection.execute('SELECT id, payload FROM events ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(event_id, json.loads(payload)) for event_id, payload in rows]
+
+    def ack(self, event_ids):
+        """ Removes the given events from the queue (once they have been delivered). """
+        with self.lock:
+            self.connection.executemany('DELETE FROM events WHERE id = ?', [(event_id,) for event_id in event_ids])
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def format_event(event):
+    """ Returns the line of the given ping event (cut short if it alone does not fit in a webhook message). """
+    line = PING_EVENT_TEMPLATE.format(**event)
+    if len(line) > MAX_WEBHOOK_CONTENT_LENGTH:
+        line = line[:MAX_WEBHOOK_CONTENT_LENGTH - 3] + '...'
+    return line
+
+
+def count_fitting_events(events, max_length=MAX_WEBHOOK_CONTENT_LENGTH):
+    """
+    Returns how many of the leading events fit in a single webhook message (one line each). This is always at least
+    one for a non-empty list, since a single event is cut short to fit (see format_event).
+    """
+    # The first line has no newline before it.
+    content_length = -1
+    num_events = 0
+    for event in events:
+        content_length += 1 + len(format_event(event))
+        if num_events and content_length > max_length:
+            break
+        num_events += 1
+    return num_events
+
+
+def is_permanent_failure(error):
+    """
+    Returns True if the webhook rejected the request for good (any 4xx response other than 429 Too Many Requests),
+    i.e. retrying the same request would never succeed.
+    """
+    # Imported here for the same reason as in WebhookSender.post.
+    import urllib.error
+    return isinstance(error, urllib.error.HTTPError) and 400 <= error.code < 500 and error.code != 429
+
+
+def format_webhook_payload(events):
+    """
+    Returns the JSON body (bytes) of a Discord webhook message for the given batch of ping events (see
+    count_fitting_events for how many fit in one message).
+    """
+    content = '\n'.join(format_event(event) for event in events)
+    # The message is the players' free text, so never let it mention anyone (e.g. '!admin @everyone').
+    return json.dumps({'content': content, 'allowed_mentions': {'parse': []}}).encode('utf-8')
+
+
+class WebhookSender:
+    """
+    Delivers the events in an EventQueue to a webhook from a background thread, in batches. Failed deliveries are
+    retried with exponential backoff (and the events stay in the queue until they are delivered), so the main loop
+    never waits on the network. Batches the webhook rejects for good (see is_permanent_failure) are logged and dropped,
+    so they do not block the events behind them. Call notify() after putting events in the queue to deliver them right
+    away.
+    """
+
+    def __init__(self, event_queue, webhook_url, batch_size=DEFAULT_BATCH_SIZE,
+                 request_timeout_s=DEFAULT_REQUEST_TIMEOUT_S, initial_backoff_s=DEFAULT_INITIAL_BACKOFF_S,
+                 max_backoff_s=DEFAULT_MAX_BACKOFF_S):
+        self.event_queue = event_queue
+        self.webhook_url = webhook_url
+        self.batch_size = batch_size
+        self.request_timeout_s = request_timeout_s
+        self.initial_backoff_s = initial_backoff_s
+        self.max_backoff_s = max_backoff_s
+
+        # The number of consecutive failed deliveries (used to compute the backoff).
+        self.num_failures = 0
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='WebhookSender', daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout_s=None):
+        """ Stops the sender thread (undelivered events stay in the queue for next time). """
+        self.stopped.set()
+        self.wakeup.set()
+        self.thread.join(timeout_s)
+
+    def notify(self):
+        """ Wakes up the sender to deliver new events (does not block). """
+        self.wakeup.set()
+
+    def get_backoff_s(self):
+        """ Returns how long to wait before retrying after the latest failure (with some jitter). """
+        backoff_s = min(self.max_backoff_s, self.initial_backoff_s * 2 ** (self.num_failures - 1))
+        return backoff_s * random.uniform(0.5, 1.0)
+
+    def post(self, body):
+        """ Posts the given JSON body to the webhook. Raises on any failure. """
+        # Imported here since urllib.request (and http.client) is slow to import and only needed once pings are sent.
+        import urllib.request
+        request = urllib.request.Request(self.webhook_url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json', 'User-Agent': 'rconbot'})
+        with urllib.request.urlopen(request, timeout=self.request_timeout_s):
+            pass
+
+    def send_batch(self):
+        """
+        Delivers one batch of the oldest events in the queue (as many as fit in a single webhook message). Only the
+        events in the posted message are acked, the rest are delivered in the next batches.
+
+        :return: int The number of events delivered or dropped (zero if the queue is empty). Raises if the delivery
+                 failed and should be retried.
+        """
+        batch = self.event_queue.peek(self.batch_size)
+        if not batch:
+            return 0
+        batch = batch[:count_fitting_events([event for _, event in batch])]
+        events = [event for _, event in batch]
+        try:
+            self.post(format_webhook_payload(events))
+        except Exception as e:
+            if not is_permanent_failure(e):
+                raise
+            lines = '\n'.join(format_event(event) for event in events)
+            logger.error(f'Webhook rejected {len(batch)} admin pings ({e}), dropping them:\n{lines}')
+        self.event_queue.ack([event_id for event_id, _ in batch])
+        return len(batch)
+
+    def run(self):
+        """ The sender thread loop. Sends batches until the queue is empty, then sleeps until notified. """
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            try:
+                while self.send_batch() and not self.stopped.is_set():
+                    self.num_failures = 0
+                self.num_failures = 0
+                self.wakeup.wait()
+            except Exception as e:
+                # Any failure (e.g. urllib.error.URLError, http.client.HTTPException from a malformed response, or
+                # sqlite3.Error from the queue) is retried, since nothing restarts this thread if it dies.
+                self.num_failures += 1
+                backoff_s = self.get_backoff_s()
+                logger.warning(f'Failed to deliver admin pings ({self.num_failures} failures in a row): {e}. '
+                               f'Retrying in {backoff_s:.1f} seconds...')
+                self.stopped.wait(backoff_s)
+
+
+class AdminPing(plugin.Plugin):
+    """
+    A plugin that listens for the admin ping command in chat and queues a ping event for the WebhookSender to deliver.
+    Each player can only ping once per dedup window. This never blocks on the network.
+    """
+
+    def __init__(self, squad_rcon_client, event_queue, sender, server_name, dedup_window_s=DEFAULT_DEDUP_WINDOW_S,
+                 worker_pool=None):
+        """
+        The constructor for AdminPing.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param event_queue: EventQueue The queue to put ping events in.
+        :param sender: WebhookSender The sender that delivers the queued events (notified on every new event).
+        :param server_name: str The name of this server (included in each ping).
+        :param dedup_window_s: float How long (in seconds) a player has to wait in between pings.
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.event_queue = event_queue
+        self.sender = sender
+        self.server_name = server_name
+        self.dedup_window_s = dedup_window_s
+
+        # The time (since the epoch) of the latest ping from each player (keyed by player_id).
+        self.latest_ping_times = {}
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Queues a ping event for every admin ping command found in the recent player chat. """
+        now = time.time()
+        queued = False
+        for player_id, player_chat in recent_player_chat.items():
+            for message in player_chat.messages:
+                if not message.strip().lower().startswith(ADMIN_PING_COMMAND):
+                    continue
+                if now - self.latest_ping_times.get(player_id, -self.dedup_window_s) < self.dedup_window_s:
+                    self.squad_rcon_client.exec_command(f'AdminWarn "{player_id}" {PING_DROPPED_MESSAGE}')
+                    continue
+
+                self.latest_ping_times[player_id] = now
+                self.event_queue.put({
+                    'server': self.server_name,
+                    'player_id': player_id,
+                    'player_name': player_chat.player_name,
+                    'current_map': current_map,
+                    'message': message.strip()[len(ADMIN_PING_COMMAND):].strip(),
+                    'time': now,
+                })
+                queued = True
+                logger.info(f'Player {player_chat.player_name} ({player_id}) pinged the admins: {message}')
+                self.squad_rcon_client.exec_command(f'AdminWarn "{player_id}" {PING_SENT_MESSAGE}')
+
+        if queued:
+            self.sender.notify()
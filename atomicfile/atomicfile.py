@@ -0,0 +1,59 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Helpers to write files atomically, shared by the plugins and the bot's own state files (leases, snapshots, exports).
+#
+
+import os
+import stat
+import tempfile
+
+# The permissions of a new file (readable by everyone, e.g. a Squad server running as another user).
+DEFAULT_FILE_MODE = 0o644
+
+
+def fsync_directory(dirpath):
+    """ Flushes the given directory's entries to disk (so a rename in it survives a crash). """
+    fd = os.open(dirpath, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_file_atomically(filepath, contents):
+    """
+    Writes the contents to the given file atomically (to a temporary file in the same directory that then replaces
+    it), so readers never see a half-written file. The file keeps its permissions (or gets DEFAULT_FILE_MODE if it is
+    new), and both the file and the rename are flushed to disk.
+
+    :param filepath: Path The file to write.
+    :param contents: str The new contents of the file.
+    """
+    dirpath = os.path.dirname(os.path.abspath(filepath))
+    try:
+        mode = stat.S_IMODE(os.stat(filepath).st_mode)
+    except FileNotFoundError:
+        mode = DEFAULT_FILE_MODE
+    fd, temp_filepath = tempfile.mkstemp(dir=dirpath, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(contents)
+            f.flush()
+            # The temporary file is created as 0600, which os.replace would keep.
+            os.fchmod(f.fileno(), mode)
+            os.fsync(f.fileno())
+        os.replace(temp_filepath, filepath)
+    except BaseException:
+        os.unlink(temp_filepath)
+        raise
+    fsync_directory(dirpath)
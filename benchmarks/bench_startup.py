@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Benchmarks how long the bot takes to start up: importing rconbot (in a fresh interpreter each run) and loading the
+# map layers snapshot. Run from the repository root, e.g.: python3 benchmarks/bench_startup.py --runs 20
+#
+
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIRPATH = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+
+# The number of synthetic layers in the benchmarked snapshot (roughly the number of layers in Squad).
+NUM_FAKE_LAYERS = 500
+
+
+def time_import(module_name, runs):
+    """ Returns the wall times (in seconds) of starting a fresh interpreter that imports the given module. """
+    times_s = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module_name}'], cwd=REPO_DIRPATH, check=True)
+        times_s.append(time.perf_counter() - start_time)
+    return times_s
+
+
+def get_slowest_imports(module_name, top):
+    """ Returns the (cumulative microseconds, module) of the slowest imports (using python -X importtime). """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'], cwd=REPO_DIRPATH,
+                            check=True, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((int(fields[1]), fields[2].strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def time_snapshot_load(runs):
+    """ Returns the wall times (in seconds) of loading a map layers snapshot. """
+    sys.path.insert(0, str(REPO_DIRPATH))
+    from config import config
+
+    url = 'https://example.com/layers.json'
+    layers = [{'name': f'Layer_{i}', 'map': f'Map_{i % 30}', 'mode': 'RAAS'} for i in range(NUM_FAKE_LAYERS)]
+    with tempfile.TemporaryDirectory() as dirpath:
+        filepath = os.path.join(dirpath, 'map_layers.json')
+        config.save_layers_snapshot(filepath, url, layers)
+        times_s = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            config.load_layers_snapshot(filepath, url)
+            times_s.append(time.perf_counter() - start_time)
+    return times_s
+
+
+def format_times(times_s):
+    return (f'median {statistics.median(times_s) * 1000:.1f} ms, min {min(times_s) * 1000:.1f} ms, '
+            f'max {max(times_s) * 1000:.1f} ms ({len(times_s)} runs)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the startup time of the bot.')
+    parser.add_argument('--runs', type=int, default=10, help='The number of runs of each benchmark. Defaults to 10.')
+    parser.add_argument('--top', type=int, default=10,
+                        help='The number of slowest imports to show. Defaults to 10.')
+    args = parser.parse_args()
+
+    print(f'Fresh interpreter: {format_times(time_import("sys", args.runs))}')
+    print(f'Fresh interpreter importing rconbot: {format_times(time_import("rconbot", args.runs))}')
+    print(f'Loading a snapshot of {NUM_FAKE_LAYERS} layers: {format_times(time_snapshot_load(args.runs))}')
+    print('Slowest imports (cumulative):')
+    for cumulative_us, module_name in get_slowest_imports('rconbot', args.top):
+        print(f'  {cumulative_us / 1000:8.1f} ms  {module_name}')
+
+
+if __name__ == '__main__':
+    main()
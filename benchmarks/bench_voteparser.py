@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Benchmarks counting map votes from a busy server's chat: the old way (a regex search, int() and a logged warning per
+# invalid message) against the VoteParser. Run from the repository root, e.g.: python3 benchmarks/bench_voteparser.py
+#
+
+import argparse
+import collections
+import logging
+import os
+import pathlib
+import random
+import re
+import statistics
+import sys
+import time
+
+REPO_DIRPATH = pathlib.Path(os.path.dirname(os.path.abspath(__file__))).parent
+sys.path.insert(0, str(REPO_DIRPATH))
+
+from mapvoter import mapvoter  # noqa: E402
+from poll import poll  # noqa: E402
+
+logger = logging.getLogger('bench_voteparser')
+
+FAKE_CANDIDATE_MAPS = ['Narva', 'Gorodok', 'Yehorivka', 'Al Basrah', mapvoter.REDO_VOTE_OPTION]
+# Mixed chat during a vote: mostly plain ballots, then chatter, ballots in sentences and out of range numbers.
+FAKE_MESSAGES = ['0', '1', '2', '3', '4', ' 2 ', 'I vote 3', 'gg', 'lol this map again', 'no more narva pls',
+                 'where is the squad lead?', 'map2', '5', '12', 'anyone want to make a squad', '!mapvote']
+
+PlayerChat = collections.namedtuple('PlayerChat', ['player_name', 'messages'])
+
+
+def get_highest_map_vote_legacy(candidate_maps, player_messages):
+    """ The previous implementation of mapvoter.get_highest_map_vote, kept here for comparison. """
+    map_vote = poll.Poll('Next map', candidate_maps)
+    for player_id, player_chat in player_messages.items():
+        for message in reversed(player_chat.messages):
+            try:
+                vote_message = re.search(r'\w+$', message.strip()).group(0)
+                if not map_vote.add_ballot(player_id, int(vote_message)):
+                    raise IndexError('Vote is not one of the candidates!')
+                break
+            except (ValueError, IndexError, AttributeError):
+                logger.warning(f'Player with id {player_id} entered invalid mapvote message {message}. Skipping...')
+    return map_vote.get_winner()
+
+
+def get_fake_chat(num_players, messages_per_player, seed=0):
+    """ Returns the chat of the given number of players (dict of player_id -> PlayerChat) with random messages. """
+    rng = random.Random(seed)
+    return {f'7656119{index:010d}': PlayerChat(f'player{index}', [rng.choice(FAKE_MESSAGES)
+                                                                  for _ in range(messages_per_player)])
+            for index in range(num_players)}
+
+
+def time_function(function, player_messages, runs):
+    """ Returns the wall times (in seconds) of counting the votes in the given chat. """
+    times_s = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        function(FAKE_CANDIDATE_MAPS, player_messages)
+        times_s.append(time.perf_counter() - start_time)
+    return times_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks counting map votes in mixed chat.')
+    parser.add_argument('--runs', type=int, default=20, help='The number of runs of each benchmark. Defaults to 20.')
+    parser.add_argument('--players', type=int, default=100, help='The number of chatting players. Defaults to 100.')
+    parser.add_argument('--messages', type=int, default=50,
+                        help='The number of messages of each player. Defaults to 50.')
+    args = parser.parse_args()
+
+    # Log the warnings like the bot does (to a stream), but throw the output away.
+    with open(os.devnull, 'w') as devnull:
+        logging.basicConfig(level=logging.INFO, stream=devnull)
+        player_messages = get_fake_chat(args.players, args.messages)
+        assert get_highest_map_vote_legacy(FAKE_CANDIDATE_MAPS, player_messages) == mapvoter.get_highest_map_vote(
+            FAKE_CANDIDATE_MAPS, player_messages)
+
+        legacy_times_s = time_function(get_highest_map_vote_legacy, player_messages, args.runs)
+        parser_times_s = time_function(mapvoter.get_highest_map_vote, player_messages, args.runs)
+
+    num_messages = args.players * args.messages
+    legacy_median_s = statistics.median(legacy_times_s)
+    parser_median_s = statistics.median(parser_times_s)
+    print(f'Counting votes in {num_messages} messages from {args.players} players ({args.runs} runs):')
+    print(f'  legacy regex/int()/warning: median {legacy_median_s * 1000:.2f} ms '
+          f'({legacy_median_s / num_messages * 1e9:.0f} ns per message)')
+    print(f'  VoteParser:                 median {parser_median_s * 1000:.2f} ms '
+          f'({parser_median_s / num_messages * 1e9:.0f} ns per message)')
+    print(f'  speedup: {legacy_median_s / parser_median_s:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Drains the player chat from RCON once per tick and fans it out to every plugin.
+#
+
+import collections
+import collections.abc
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The most drained batches kept for subscribers that have not read them yet (older batches are dropped).
+DEFAULT_MAX_BATCHES = 100
+
+# The chat of a single player in a batch. Unlike the RCON client's PlayerChat, the messages are an immutable tuple.
+PlayerChat = collections.namedtuple('PlayerChat', ['player_name', 'messages'])
+
+
+class ChatBatch(collections.abc.Mapping):
+    """
+    An immutable batch of player chat (a read-only mapping of player id to PlayerChat), so a single batch can be shared
+    by every plugin without copying it. Used exactly like the dict returned by the RCON client's get_player_chat().
+    """
+
+    def __init__(self, seq, player_chats):
+        """
+        The constructor for ChatBatch.
+
+        :param seq: int The sequence number of the batch (increases by one for every drained batch).
+        :param player_chats: dict(str->PlayerChat) The chat of every player. Must not be modified afterwards.
+        """
+        self.seq = seq
+        self.player_chats = player_chats
+
+    @classmethod
+    def from_player_chat(cls, seq, raw_player_chat):
+        """ Returns a batch of the given chat (a dict of player id to the RCON client's PlayerChat objects). """
+        return cls(seq, {player_id: PlayerChat(getattr(player_chat, 'player_name', None), tuple(player_chat.messages))
+                         for player_id, player_chat in raw_player_chat.items()})
+
+    @classmethod
+    def merge(cls, batches):
+        """ Returns one batch with the chat of all the given batches (in order). Has the seq of the last batch. """
+        if len(batches) == 1:
+            return batches[0]
+        player_chats = {}
+        for batch in batches:
+            for player_id, player_chat in batch.items():
+                previous_chat = player_chats.get(player_id)
+                if previous_chat is None:
+                    player_chats[player_id] = player_chat
+                else:
+                    player_chats[player_id] = PlayerChat(player_chat.player_name or previous_chat.player_name,
+                                                         previous_chat.messages + player_chat.messages)
+        return cls(batches[-1].seq if batches else -1, player_chats)
+
+    def __getitem__(self, player_id):
+        return self.player_chats[player_id]
+
+    def __iter__(self):
+        return iter(self.player_chats)
+
+    def __len__(self):
+        return len(self.player_chats)
+
+    def get_num_messages(self):
+        return sum(len(player_chat.messages) for player_chat in self.player_chats.values())
+
+    def __repr__(self):
+        return f'ChatBatch(seq={self.seq}, {self.player_chats})'
+
+
+class ChatCursor:
+    """ A subscriber's position in a ChatFeed (the seq of the next batch it will read). """
+
+    def __init__(self, feed, name, position):
+        self.feed = feed
+        self.name = name
+        self.position = position
+
+    def read(self):
+        """ Returns all the chat drained since the previous read (as one batch), and moves past it. """
+        return self.feed.read(self)
+
+    def skip(self):
+        """ Moves past all the chat drained so far (without reading it). """
+        self.feed.skip(self)
+
+
+class ChatFeed:
+    """
+    Drains the player chat from the RCON client (call drain() once per tick), and keeps the drained batches until every
+    subscriber has read them. Each subscriber has its own cursor, so more subscribers do not cost more RCON commands,
+    and chat drained in the middle of a tick (e.g. during a map vote) is still delivered to everyone else.
+    """
+
+    def __init__(self, squad_rcon_client, max_batches=DEFAULT_MAX_BATCHES):
+        self.squad_rcon_client = squad_rcon_client
+        self.max_batches = max_batches
+        # The batches not yet read by every subscriber (oldest first), and the seq of the next batch to be drained.
+        self.batches = collections.deque()
+        self.next_seq = 0
+        self.cursors = []
+
+    def subscribe(self, name):
+        """ Returns a new cursor that will read all the chat drained from now on. """
+        cursor = ChatCursor(self, name, self.next_seq)
+        self.cursors.append(cursor)
+        return cursor
+
+    def unsubscribe(self, cursor):
+        self.cursors.remove(cursor)
+        self.trim()
+
+    def drain(self):
+        """
+        Gets (and clears) the player chat from the RCON client as a new batch for the subscribers.
+
+        :return: ChatBatch The drained batch.
+        """
+        batch = ChatBatch.from_player_chat(self.next_seq, self.squad_rcon_client.get_player_chat())
+        self.squad_rcon_client.clear_player_chat()
+        self.next_seq += 1
+        self.batches.append(batch)
+        self.trim()
+        return batch
+
+    def read(self, cursor):
+        """ Returns the batches the cursor has not read yet (merged into one batch), and moves it past them. """
+        first_seq = self.batches[0].seq if self.batches else self.next_seq
+        if cursor.position < first_seq:
+            logger.warning(f'Chat subscriber {cursor.name} fell behind and missed {first_seq - cursor.position} '
+                           'chat batches!')
+        unread_batches = [batch for batch in self.batches if batch.seq >= cursor.position]
+        cursor.position = self.next_seq
+        self.trim()
+        return ChatBatch.merge(unread_batches)
+
+    def skip(self, cursor):
+        cursor.position = self.next_seq
+        self.trim()
+
+    def trim(self):
+        """ Drops the batches every subscriber has read (and the oldest batches beyond max_batches). """
+        oldest_position = min((cursor.position for cursor in self.cursors), default=self.next_seq)
+        while self.batches and (self.batches[0].seq < oldest_position or len(self.batches) > self.max_batches):
+            self.batches.popleft()
@@ -0,0 +1,197 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A registry of clan tags, used to recognize clan members by name and to assign joining clan members to teams.
+#
+
+import collections
+import logging
+
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# A clan: its name, the tags that identify its members, the team its members are assigned to when they join (None to
+# not assign them), and whether its members can use the admin chat commands (e.g. forcing a map vote).
+Clan = collections.namedtuple('Clan', ['name', 'tags', 'team_id', 'is_admin'])
+
+
+class AhoCorasick:
+    """
+    An Aho-Corasick automaton that finds all occurrences of many literal patterns in a text in a single pass over the
+    text (instead of searching for each pattern separately).
+    """
+
+    def __init__(self, patterns):
+        """
+        The constructor for AhoCorasick.
+
+        :param patterns: list(str) The patterns to look for (empty patterns are ignored).
+        """
+        self.patterns = list(patterns)
+        # The trie transitions, the failure link, and the indices of the patterns that end at each state.
+        self.transitions = [{}]
+        self.failures = [0]
+        self.outputs = [[]]
+        for pattern_index, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            state = 0
+            for character in pattern:
+                if character not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.failures.append(0)
+                    self.outputs.append([])
+                    self.transitions[state][character] = len(self.transitions) - 1
+                state = self.transitions[state][character]
+            self.outputs[state].append(pattern_index)
+
+        # Breadth first, point each state's failure link to the longest proper suffix that is also in the trie.
+        states = collections.deque(self.transitions[0].values())
+        while states:
+            state = states.popleft()
+            for character, next_state in self.transitions[state].items():
+                states.append(next_state)
+                failure = self.failures[state]
+                while failure and character not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[next_state] = self.transitions[failure].get(character, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.failures[next_state]]
+
+    def find_all(self, text):
+        """ Yields a (start_index, pattern_index) tuple for every occurrence of every pattern in the text. """
+        state = 0
+        for index, character in enumerate(text):
+            while state and character not in self.transitions[state]:
+                state = self.failures[state]
+            state = self.transitions[state].get(character, 0)
+            for pattern_index in self.outputs[state]:
+                yield (index - len(self.patterns[pattern_index]) + 1, pattern_index)
+
+
+class ClanTagRegistry:
+    """
+    Recognizes the clan of a player from their name. All the tags of all the clans are compiled into one Aho-Corasick
+    matcher, and the result for each player is cached (on their PlayerRecord, or by player_id and name), so repeated
+    checks for the same player are a dict lookup.
+    """
+
+    def __init__(self, clans):
+        """
+        The constructor for ClanTagRegistry.
+
+        :param clans: list(Clan) The known clans.
+        """
+        self.clans = list(clans)
+        tags = []
+        self.tag_clans = []
+        for clan in self.clans:
+            for tag in clan.tags:
+                tags.append(tag)
+                self.tag_clans.append(clan)
+        self.matcher = AhoCorasick(tags)
+
+        # The cached clan of each player: player_id -> (player_name, Clan or None).
+        self.cache = {}
+
+    @classmethod
+    def from_tags(cls, tags):
+        """ Returns a registry with a single admin clan identified by the given tags (and no team assignment). """
+        return cls([Clan(name=tags[0] if tags else '', tags=list(tags), team_id=None, is_admin=True)])
+
+    @classmethod
+    def from_filepath(cls, filepath):
+        """
+        Returns a registry of the clans in the given YAML file, e.g.:
+            clans:
+              - name: FP
+                tags: ['[FP]', 'FP |']
+                team: 1
+                admin: true
+        """
+        import yaml  # Only needed when there is a clans file.
+        with open(filepath, 'r') as f:
+            raw_config = yaml.safe_load(f) or {}
+        clans = []
+        for raw_clan in raw_config.get('clans', []):
+            tags = raw_clan.get('tags')
+            team_id = raw_clan.get('team')
+            if not tags or not all(isinstance(tag, str) and tag for tag in tags):
+                raise ValueError(f'Clan {raw_clan} must have a list of non-empty tags!')
+            if team_id not in (None, 1, 2):
+                raise ValueError(f'Clan {raw_clan} has an invalid team {team_id}! Must be 1 or 2.')
+            clans.append(Clan(name=raw_clan.get('name', tags[0]), tags=list(tags), team_id=team_id,
+                              is_admin=bool(raw_clan.get('admin', False))))
+        return cls(clans)
+
+    def match(self, player_name):
+        """ Returns the Clan whose tag appears first (longest wins ties) in the player name, or None. """
+        best_match = min(((start, -len(self.matcher.patterns[tag_index]), tag_index)
+                          for start, tag_index in self.matcher.find_all(player_name or '')), default=None)
+        return self.tag_clans[best_match[2]] if best_match else None
+
+    def lookup(self, player_id, player_name):
+        """ Returns the Clan of the given player (cached by player_id until their name changes), or None. """
+        cached = self.cache.get(player_id)
+        if cached is not None and cached[0] == player_name:
+            return cached[1]
+        clan = self.match(player_name)
+        self.cache[player_id] = (player_name, clan)
+        return clan
+
+    def lookup_record(self, record):
+        """ Returns the Clan of the player with the given PlayerRecord (cached on the record), or None. """
+        if not record.clan_checked:
+            record.clan = self.match(record.player.name)
+            record.clan_checked = True
+        return record.clan
+
+    def is_clan_member(self, player_id, player_name):
+        """ Returns True if the given player is in any of the clans, and False otherwise. """
+        return self.lookup(player_id, player_name) is not None
+
+    def is_admin(self, player_id, player_name):
+        """ Returns True if the given player is in a clan that can use the admin chat commands, and False otherwise. """
+        clan = self.lookup(player_id, player_name)
+        return clan is not None and clan.is_admin
+
+
+class ClanTeamAssigner(plugin.Plugin):
+    """
+    A plugin that moves players who just joined to their clan's team (if their clan has one). Uses the PlayerTracker
+    snapshot, so the move is sent on the same tick the join is seen.
+    """
+
+    def __init__(self, squad_rcon_client, player_tracker, registry, dispatcher, worker_pool=None):
+        """
+        The constructor for ClanTeamAssigner.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param player_tracker: PlayerTracker The tracker of the players on the server (must run before this plugin).
+        :param registry: ClanTagRegistry The clans and their teams.
+        :param dispatcher: CommandDispatcher Sends the team change commands (as one burst).
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.player_tracker = player_tracker
+        self.registry = registry
+        self.dispatcher = dispatcher
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Moves the clan members that just joined to their clan's team. """
+        commands = []
+        for record in self.player_tracker.joined:
+            clan = self.registry.lookup_record(record)
+            if clan is not None and clan.team_id is not None and record.player.team_id != clan.team_id:
+                logger.info(f'Moving {record.player.name} to team {clan.team_id} (clan {clan.name}).')
+                commands.append(f'AdminForceTeamChange {record.player.steam_id}')
+        self.dispatcher.dispatch(commands)
@@ -0,0 +1,200 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A compact append-only columnar store for the data the bot collects (for later analysis).
+#
+
+import array
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+# The type of string columns. They are stored dictionary-encoded: an int32 code per row, plus a file of unique values.
+STRING_TYPE = 'str'
+
+# The array typecode used for the codes of string columns.
+STRING_CODE_TYPECODE = 'i'
+
+# The filenames inside a store's directory.
+SCHEMA_FILENAME = 'schema.json'
+COLUMN_FILE_SUFFIX = '.col'
+DICTIONARY_FILE_SUFFIX = '.dict'
+
+
+class ColumnarStore:
+    """
+    An append-only table stored as one raw binary file per column inside a directory. Numeric columns are stored as the
+    raw bytes of an array.array of the column's typecode (so they can be read back with array.fromfile() or
+    numpy.fromfile()), and string columns are dictionary-encoded. Rows are buffered in memory until flush() is called.
+    """
+
+    def __init__(self, dirpath, schema, read_only=False):
+        """
+        The constructor for ColumnarStore. Creates the store if it does not exist.
+
+        :param dirpath: Path The directory the column files are stored in.
+        :param schema: list(tuple(str, str)) The (name, type) of each column, where the type is an array.array typecode
+                       (e.g. 'd' or 'q') or STRING_TYPE.
+        :param read_only: bool If True, never writes to the store (e.g. to read it while another store appends to
+                          it). The rows are read up to the shortest column instead of repairing the column files, and
+                          rows cannot be appended.
+        """
+        if sys.byteorder != 'little':
+            raise RuntimeError('ColumnarStore only supports little-endian machines!')
+        self.dirpath = dirpath
+        self.schema = [(name, column_type) for name, column_type in schema]
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(dirpath, exist_ok=True)
+
+        schema_filepath = os.path.join(dirpath, SCHEMA_FILENAME)
+        if os.path.exists(schema_filepath):
+            with open(schema_filepath, 'r') as f:
+                saved_schema = [tuple(column) for column in json.load(f)]
+            if saved_schema != self.schema:
+                raise ValueError(f'Schema {self.schema} does not match the saved schema {saved_schema} in {dirpath}!')
+        elif not read_only:
+            with open(schema_filepath, 'w') as f:
+                json.dump(self.schema, f)
+
+        # The dictionaries are flushed before the columns, so counting the rows first guarantees that every code in
+        # them is in the dictionaries read below (even if the store is being flushed right now).
+        if read_only:
+            num_rows = min(self.get_column_lengths().values(), default=0)
+
+        # The values of each string column, and the code of each value (loaded from the dictionary files).
+        self.dictionaries = {}
+        self.dictionary_codes = {}
+        for name, column_type in self.schema:
+            if column_type == STRING_TYPE:
+                self.dictionaries[name] = self.read_dictionary(name)
+                self.dictionary_codes[name] = {value: code for code, value in enumerate(self.dictionaries[name])}
+        # The number of values in each dictionary that have already been written to disk.
+        self.num_saved_values = {name: len(values) for name, values in self.dictionaries.items()}
+
+        # The rows appended since the last flush, one array per column.
+        self.buffers = {name: array.array(self.get_typecode(name)) for name, _ in self.schema}
+        self.num_rows = num_rows if read_only else self.repair()
+
+    def get_typecode(self, name):
+        """ Returns the array.array typecode that the given column is stored as. """
+        column_type = dict(self.schema)[name]
+        return STRING_CODE_TYPECODE if column_type == STRING_TYPE else column_type
+
+    def get_column_filepath(self, name):
+        return os.path.join(self.dirpath, f'{name}{COLUMN_FILE_SUFFIX}')
+
+    def get_dictionary_filepath(self, name):
+        return os.path.join(self.dirpath, f'{name}{DICTIONARY_FILE_SUFFIX}')
+
+    def read_dictionary(self, name):
+        """ Returns the list of values of the given string column (each value's index is its code). """
+        try:
+            with open(self.get_dictionary_filepath(name), 'r', encoding='utf-8') as f:
+                # A line without a newline is still being written (only a read-only store can see one).
+                return [json.loads(line) for line in f if line.strip() and line.endswith('\n')]
+        except FileNotFoundError:
+            return []
+
+    def get_column_lengths(self):
+        """ Returns the number of (complete) values in each column file. """
+        lengths = {}
+        for name, _ in self.schema:
+            try:
+                size = os.path.getsize(self.get_column_filepath(name))
+            except FileNotFoundError:
+                size = 0
+            lengths[name] = size // array.array(self.get_typecode(name)).itemsize
+        return lengths
+
+    def repair(self):
+        """
+        Truncates all the column files to the length of the shortest one (in case the bot died in the middle of a
+        flush), and returns the number of rows in the store.
+        """
+        lengths = self.get_column_lengths()
+        num_rows = min(lengths.values()) if lengths else 0
+        for name, length in lengths.items():
+            if length != num_rows:
+                logger.warning(f'Truncating column {name} in {self.dirpath} from {length} to {num_rows} rows.')
+                with open(self.get_column_filepath(name), 'r+b') as f:
+                    f.truncate(num_rows * array.array(self.get_typecode(name)).itemsize)
+        return num_rows
+
+    def encode(self, name, value):
+        """ Returns the code of the given string value in the given column (adding it to the dictionary if needed). """
+        codes = self.dictionary_codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = len(self.dictionaries[name])
+            codes[value] = code
+            self.dictionaries[name].append(value)
+        return code
+
+    def append(self, row):
+        """
+        Appends the given row (a dict of column name to value, with every column) to the store's buffers. Raises (and
+        leaves the store untouched) if any value is missing or does not fit its column.
+        """
+        if self.read_only:
+            raise ValueError(f'Cannot append to the read-only store in {self.dirpath}!')
+        # Check (and convert) the whole row before touching any buffer, so a bad value never misaligns the columns.
+        values = []
+        for name, column_type in self.schema:
+            value = row[name]
+            if column_type == STRING_TYPE:
+                hash(value)
+            else:
+                value = array.array(column_type, [value])[0]
+            values.append(value)
+        for (name, column_type), value in zip(self.schema, values):
+            self.buffers[name].append(self.encode(name, value) if column_type == STRING_TYPE else value)
+        self.num_rows += 1
+
+    def flush(self):
+        """ Writes all the buffered rows to the column files. """
+        for name, values in self.dictionaries.items():
+            if len(values) > self.num_saved_values[name]:
+                with open(self.get_dictionary_filepath(name), 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps(value) + '\n' for value in values[self.num_saved_values[name]:])
+                self.num_saved_values[name] = len(values)
+        for name, buffer in self.buffers.items():
+            if buffer:
+                with open(self.get_column_filepath(name), 'ab') as f:
+                    buffer.tofile(f)
+                self.buffers[name] = array.array(buffer.typecode)
+
+    def read_codes(self, name):
+        """
+        Returns all the flushed raw values of the given column as an array.array (for string columns, these are the
+        codes of the values, see dictionaries). Supports the buffer protocol, so numpy.frombuffer() can wrap it.
+        """
+        values = array.array(self.get_typecode(name))
+        filepath = self.get_column_filepath(name)
+        if os.path.exists(filepath):
+            with open(filepath, 'rb') as f:
+                values.frombytes(f.read(values.itemsize * self.num_rows))
+        return values[:self.num_rows - len(self.buffers[name])]
+
+    def read_column(self, name):
+        """
+        Returns all the flushed values of the given column (an array.array for numeric columns, or a list of values
+        for string columns).
+        """
+        values = self.read_codes(name)
+        if dict(self.schema)[name] == STRING_TYPE:
+            dictionary = self.dictionaries[name]
+            return [dictionary[code] for code in values]
+        return values
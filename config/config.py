@@ -0,0 +1,217 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Watches the map rotation config and the bot settings files and reloads them into the running plugins on change.
+#
+
+import logging
+import json
+import os
+import time
+
+from atomicfile import atomicfile
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The keys allowed in the bot settings file, mapped to the minimum value each can take.
+BOT_SETTINGS_MINIMUMS = {
+    'voting_cooldown_s': 0.0,
+    'voting_duration_s': 1.0,
+}
+
+
+def parse_bot_settings(settings_filepath):
+    """
+    Reads and validates the bot settings YAML file. Every key is optional, e.g.:
+        voting_cooldown_s: 1800
+        voting_duration_s: 30
+
+    :param settings_filepath: Path The filepath to the bot settings file.
+    :return: dict(str->float) The validated settings (only includes the keys found in the file).
+    """
+    import yaml  # Only needed when there is a settings file.
+    with open(settings_filepath, 'r') as f:
+        raw_settings = yaml.safe_load(f) or {}
+
+    if not isinstance(raw_settings, dict):
+        raise ValueError(f'Bot settings file {settings_filepath} must contain a mapping of settings!')
+
+    settings = {}
+    for key, value in raw_settings.items():
+        if key not in BOT_SETTINGS_MINIMUMS:
+            raise ValueError(f'Unknown bot setting {key}! Must be one of {list(BOT_SETTINGS_MINIMUMS)}.')
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'Bot setting {key} must be a number, got {value}!')
+        if value < BOT_SETTINGS_MINIMUMS[key]:
+            raise ValueError(f'Bot setting {key} must be at least {BOT_SETTINGS_MINIMUMS[key]}, got {value}!')
+        settings[key] = float(value)
+    return settings
+
+
+def load_layers_snapshot(snapshot_filepath, map_layers_url):
+    """
+    Returns the map layers saved in the given snapshot file, or None if there is no snapshot (or it was taken from a
+    different URL or cannot be read).
+
+    :param snapshot_filepath: Path The filepath to the layers snapshot (written by save_layers_snapshot()).
+    :param map_layers_url: str The URL the layers should have been fetched from.
+    """
+    try:
+        with open(snapshot_filepath, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f'Ignoring unreadable map layers snapshot {snapshot_filepath}: {e}')
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('url') != map_layers_url or 'layers' not in snapshot:
+        logger.info(f'Ignoring map layers snapshot {snapshot_filepath} (it was not taken from {map_layers_url}).')
+        return None
+    return snapshot['layers']
+
+
+def save_layers_snapshot(snapshot_filepath, map_layers_url, all_map_layers):
+    """ Saves the given map layers (fetched from the given URL) to the snapshot file (atomically). """
+    snapshot = {'url': map_layers_url, 'fetched_at': time.time(), 'layers': all_map_layers}
+    os.makedirs(os.path.dirname(os.path.abspath(snapshot_filepath)), exist_ok=True)
+    atomicfile.write_file_atomically(snapshot_filepath, json.dumps(snapshot))
+    logger.info(f'Saved map layers snapshot to {snapshot_filepath}.')
+
+
+def fetch_map_layers(map_layers_url, snapshot_filepath=None):
+    """
+    Returns the map layers, loaded from the snapshot file if there is one. Otherwise, they are fetched from the URL
+    (and saved to the snapshot file, if given, so the next startup does not fetch them again).
+    """
+    if snapshot_filepath:
+        all_map_layers = load_layers_snapshot(snapshot_filepath, map_layers_url)
+        if all_map_layers is not None:
+            logger.info(f'Loaded map layers from snapshot {snapshot_filepath}.')
+            return all_map_layers
+
+    import squad_map_randomizer
+    NO_FILEPATH = None
+    all_map_layers = squad_map_randomizer.get_json_layers(NO_FILEPATH, map_layers_url)
+    if snapshot_filepath:
+        save_layers_snapshot(snapshot_filepath, map_layers_url, all_map_layers)
+    return all_map_layers
+
+
+class FileWatcher:
+    """
+    Cheaply detects changes to a single file by polling its mtime, size, and inode (a single os.stat() call), so it can
+    be checked on every tick. Editors that replace the file (write then rename) are detected too.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        # The stat signature of the file the last time we checked. The first check always counts as a change.
+        self.last_signature = None
+        self.checked = False
+
+    def get_signature(self):
+        """ Returns a tuple that changes whenever the file changes, or None if the file does not exist. """
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def has_changed(self):
+        """ Returns True if the file changed since the last call (or if this is the first call), and False otherwise. """
+        signature = self.get_signature()
+        changed = not self.checked or signature != self.last_signature
+        self.last_signature = signature
+        self.checked = True
+        return changed
+
+
+class ConfigWatcher(plugin.Plugin):
+    """
+    A plugin that watches the map rotation config and the bot settings files. When one of them changes, the new config
+    is validated and then swapped into the running MapVoter. If the new config is invalid, an error is logged and the
+    previous config is kept. Run it before the MapVoter on every tick (and call reload_if_changed() once on startup).
+    """
+
+    def __init__(self, squad_rcon_client, voter, config_filepath, map_layers_url, settings_filepath=None,
+                 layers_snapshot_filepath=None):
+        """
+        The constructor for ConfigWatcher.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param voter: MapVoter The map voter to swap the new configs into.
+        :param config_filepath: Path The filepath to the map rotation config.
+        :param map_layers_url: str The URL to the map layers JSON file.
+        :param settings_filepath: Path The filepath to the bot settings file. None means there is no settings file.
+        :param layers_snapshot_filepath: Path The filepath to the map layers snapshot (see fetch_map_layers()). None
+                                         means the layers are always fetched from map_layers_url.
+        """
+        super().__init__(squad_rcon_client)
+        self.voter = voter
+        self.map_layers_url = map_layers_url
+        self.config_watcher = FileWatcher(config_filepath)
+        self.settings_watcher = FileWatcher(settings_filepath) if settings_filepath else None
+        self.layers_snapshot_filepath = layers_snapshot_filepath
+
+        # The map layers are only loaded once (the first time the rotation config is loaded).
+        self.all_map_layers = None
+
+    def reload_map_config(self):
+        """ Loads the map rotation config and swaps it into the voter. Raises if the config is invalid. """
+        # Imported here (not at startup) since squad_map_randomizer pulls in its YAML and HTTP dependencies.
+        import squad_map_randomizer
+
+        if self.all_map_layers is None:
+            self.all_map_layers = fetch_map_layers(self.map_layers_url, self.layers_snapshot_filepath)
+        config = squad_map_randomizer.parse_config(self.config_watcher.filepath, self.all_map_layers)
+        self.voter.set_map_config(config, self.all_map_layers)
+        logger.info(f'Loaded map rotation config from {self.config_watcher.filepath}.')
+
+    def reload_settings(self):
+        """ Loads the bot settings and swaps them into the voter. Raises if the settings are invalid. """
+        settings = parse_bot_settings(self.settings_watcher.filepath)
+        self.voter.update_settings(
+            voting_cooldown_s=settings.get('voting_cooldown_s', self.voter.voting_cooldown_s),
+            voting_time_duration_s=settings.get('voting_duration_s', self.voter.voting_time_duration_s))
+        logger.info(f'Loaded bot settings from {self.settings_watcher.filepath}: {settings}.')
+
+    def reload_if_changed(self):
+        """
+        Reloads any of the watched files that changed since the last call. The very first load of the map rotation
+        config raises on failure (there is nothing to fall back to), but later failures are logged and ignored.
+
+        :return: bool True if any new config was swapped in, and False otherwise.
+        """
+        reloaded = False
+        if self.config_watcher.has_changed():
+            if self.voter.map_config is None:
+                self.reload_map_config()
+                reloaded = True
+            else:
+                try:
+                    self.reload_map_config()
+                    reloaded = True
+                except Exception as e:
+                    logger.error(f'Failed to reload map rotation config: {e}. Keeping the previous config.')
+
+        if self.settings_watcher and self.settings_watcher.has_changed():
+            try:
+                self.reload_settings()
+                reloaded = True
+            except Exception as e:
+                logger.error(f'Failed to reload bot settings: {e}. Keeping the previous settings.')
+        return reloaded
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Checks the watched files for changes (a couple of os.stat() calls when nothing changed). """
+        self.reload_if_changed()
@@ -0,0 +1,284 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A structured, append-only log of the bot's events (chat, commands sent, vote results, and map changes) for auditing
+# and offline analysis. Events are written as length-prefixed binary records into segment files that roll over by
+# size and age, and are read back by memory-mapping the segments.
+#
+# Segment layout: SEGMENT_MAGIC, then records of RECORD_HEADER (payload length, CRC32, timestamp, event type code)
+# followed by the payload (the event's fields as compact UTF-8 JSON). The CRC covers the timestamp, event type and
+# payload, so a torn write at the end of a segment (e.g. the bot was killed) is detected and skipped.
+#
+
+import collections
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The event types, and the codes they are stored as.
+CHAT_EVENT = 'chat'
+COMMAND_EVENT = 'command'
+VOTE_RESULT_EVENT = 'vote_result'
+MAP_CHANGE_EVENT = 'map_change'
+EVENT_TYPE_CODES = {CHAT_EVENT: 1, COMMAND_EVENT: 2, VOTE_RESULT_EVENT: 3, MAP_CHANGE_EVENT: 4}
+EVENT_TYPE_NAMES = {code: event_type for event_type, code in EVENT_TYPE_CODES.items()}
+
+# The first bytes of every segment file (the version is part of it).
+SEGMENT_MAGIC = b'RCONEVT1'
+# The header of every record: payload length, CRC32 (of everything after it), timestamp, and event type code.
+RECORD_HEADER = struct.Struct('<IIdB')
+# The part of the header that the CRC covers (the timestamp and event type code).
+RECORD_CRC_OFFSET = 8
+
+# The segment file names are the segment index (zero padded so they sort in order) with this suffix.
+SEGMENT_FILE_SUFFIX = '.evlog'
+
+# A new segment is started once the current one is this big (in bytes) or this old (in seconds).
+DEFAULT_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_SEGMENT_AGE_S = 60.0 * 60
+
+# An event read back from the log.
+Event = collections.namedtuple('Event', ['timestamp', 'event_type', 'fields'])
+
+
+def get_segment_filepaths(dirpath):
+    """ Returns the filepaths of the segments in the given directory (oldest first). """
+    try:
+        filenames = os.listdir(dirpath)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(dirpath, filename) for filename in sorted(filenames)
+            if filename.endswith(SEGMENT_FILE_SUFFIX) and filename[:-len(SEGMENT_FILE_SUFFIX)].isdigit()]
+
+
+def encode_record(event_type_code, timestamp, payload):
+    """ Returns the record (header and payload) of the given event. """
+    crc = zlib.crc32(payload, zlib.crc32(struct.pack('<dB', timestamp, event_type_code)))
+    return RECORD_HEADER.pack(len(payload), crc, timestamp, event_type_code) + payload
+
+
+class EventLog:
+    """
+    The writer of the event log. Events are buffered and written to the current segment (call flush() to push them to
+    the OS). Each EventLog starts a new segment (it never appends to an existing one), so only one writer should use a
+    directory at a time. Failing to write (e.g. the disk is full) is logged and the event dropped, so the log never
+    breaks the bot.
+    """
+
+    def __init__(self, dirpath, max_segment_bytes=DEFAULT_MAX_SEGMENT_BYTES,
+                 max_segment_age_s=DEFAULT_MAX_SEGMENT_AGE_S, clock=time.time):
+        """
+        The constructor for EventLog.
+
+        :param dirpath: Path The directory the segments are written to (created if needed).
+        :param max_segment_bytes: int Start a new segment once the current one is this big (in bytes).
+        :param max_segment_age_s: float Start a new segment once the current one is this old (in seconds).
+        :param clock: callable Returns the current time (since the epoch).
+        """
+        self.dirpath = dirpath
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age_s = max_segment_age_s
+        self.clock = clock
+        os.makedirs(dirpath, exist_ok=True)
+
+        # The index of the next segment (after the existing ones).
+        segment_filepaths = get_segment_filepaths(dirpath)
+        self.next_segment_index = (int(os.path.basename(segment_filepaths[-1])[:-len(SEGMENT_FILE_SUFFIX)]) + 1
+                                   if segment_filepaths else 0)
+        # The current segment (opened on the first event), its size, and when it was started.
+        self.segment_file = None
+        self.segment_size = 0
+        self.segment_started_at = None
+
+        # The number of events dropped because they could not be written.
+        self.num_dropped = 0
+        # Events are recorded from the main loop and from the RCON client (which may be called from worker threads).
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open_segment(self, now):
+        """ Closes the current segment (if any) and starts the next one. """
+        self.close_segment()
+        filepath = os.path.join(self.dirpath, f'{self.next_segment_index:08d}{SEGMENT_FILE_SUFFIX}')
+        self.segment_file = open(filepath, 'xb')
+        self.segment_file.write(SEGMENT_MAGIC)
+        self.segment_size = len(SEGMENT_MAGIC)
+        self.segment_started_at = now
+        self.next_segment_index += 1
+        logger.debug(f'Started event log segment {filepath}.')
+
+    def close_segment(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+
+    def should_roll_over(self, now):
+        return (self.segment_file is None or self.segment_size >= self.max_segment_bytes or
+                now - self.segment_started_at >= self.max_segment_age_s)
+
+    def record(self, event_type, timestamp=None, **fields):
+        """
+        Appends an event to the log.
+
+        :param event_type: str One of the event types (e.g. CHAT_EVENT).
+        :param timestamp: float When the event happened (since the epoch). Defaults to now.
+        :param fields: The fields of the event (anything JSON can encode, other values are stored as strings).
+        """
+        event_type_code = EVENT_TYPE_CODES.get(event_type)
+        if event_type_code is None:
+            raise ValueError(f'Unknown event type {event_type}!')
+        now = self.clock()
+        payload = json.dumps(fields, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+        record = encode_record(event_type_code, timestamp if timestamp is not None else now, payload)
+        with self.lock:
+            try:
+                if self.should_roll_over(now):
+                    self.open_segment(now)
+                self.segment_file.write(record)
+                self.segment_size += len(record)
+            except OSError as e:
+                self.num_dropped += 1
+                logger.error(f'Failed to write to the event log in {self.dirpath} ({self.num_dropped} events dropped '
+                             f'so far): {e}')
+
+    def flush(self):
+        """ Pushes the buffered events to the OS (so readers and crashes see them). """
+        with self.lock:
+            if self.segment_file is not None:
+                try:
+                    self.segment_file.flush()
+                except OSError as e:
+                    logger.error(f'Failed to flush the event log in {self.dirpath}: {e}')
+
+    def close(self):
+        with self.lock:
+            self.close_segment()
+
+
+def read_segment(filepath, event_types=None, since=None):
+    """
+    Reads the events in the given segment (memory-mapped). The events that are filtered out are skipped without
+    decoding their payload. Reading stops at the first torn or corrupt record (e.g. the end of a segment that was
+    being written when the bot was killed).
+
+    :param filepath: Path The segment file.
+    :param event_types: set(str) Only read these event types. Defaults to all of them.
+    :param since: float Only read the events at or after this time (since the epoch). Defaults to all of them.
+    :return: generator(Event) The events, in the order they were written.
+    """
+    event_type_codes = ({EVENT_TYPE_CODES[event_type] for event_type in event_types}
+                        if event_types is not None else None)
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(SEGMENT_MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+            if segment[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+                raise ValueError(f'{filepath} is not an event log segment!')
+            offset = len(SEGMENT_MAGIC)
+            while offset + RECORD_HEADER.size <= size:
+                payload_length, crc, timestamp, event_type_code = RECORD_HEADER.unpack_from(segment, offset)
+                payload_start = offset + RECORD_HEADER.size
+                payload_end = payload_start + payload_length
+                if payload_end > size or zlib.crc32(segment[offset + RECORD_CRC_OFFSET:payload_end]) != crc:
+                    logger.warning(f'Stopped reading {filepath} at a torn or corrupt record (offset {offset}).')
+                    return
+                offset = payload_end
+                if event_type_codes is not None and event_type_code not in event_type_codes:
+                    continue
+                if since is not None and timestamp < since:
+                    continue
+                yield Event(timestamp, EVENT_TYPE_NAMES.get(event_type_code, event_type_code),
+                            json.loads(segment[payload_start:payload_end].decode('utf-8')))
+            if offset != size:
+                logger.warning(f'Stopped reading {filepath} at a torn record header (offset {offset}).')
+
+
+def read_events(dirpath, event_types=None, since=None):
+    """ Reads the events in every segment of the given directory (oldest first). See read_segment. """
+    for filepath in get_segment_filepaths(dirpath):
+        yield from read_segment(filepath, event_types=event_types, since=since)
+
+
+class EventLogClient:
+    """ A proxy around an RCON client that records every command sent through exec_command in the event log. """
+
+    def __init__(self, client, event_log):
+        """
+        The constructor for EventLogClient.
+
+        :param client: RconConnection The RCON client to forward the calls to.
+        :param event_log: EventLog Where the commands are recorded.
+        """
+        self.client = client
+        self.event_log = event_log
+
+    def __getattr__(self, name):
+        """ Forwards any other attribute to the client. """
+        if name == 'client':
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def exec_command(self, command, *args, **kwargs):
+        """ Sends the command (see the client's exec_command), and records it (and whether it succeeded). """
+        succeeded = False
+        try:
+            result = self.client.exec_command(command, *args, **kwargs)
+            succeeded = True
+            return result
+        finally:
+            self.event_log.record(COMMAND_EVENT, command=command, succeeded=succeeded)
+
+
+class EventRecorder(plugin.Plugin):
+    """
+    A plugin that records the player chat and the map changes in the event log, and flushes the log once per tick (run
+    it last, so the events of the other plugins are flushed on the same tick).
+    """
+
+    def __init__(self, squad_rcon_client, event_log, worker_pool=None):
+        """
+        The constructor for EventRecorder.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param event_log: EventLog Where the events are recorded.
+        :param worker_pool: WorkerPool See Plugin.
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.event_log = event_log
+        # The current map as of the previous tick (None before the first one, which is recorded as a change too).
+        self.current_map = None
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Records the map change (if any) and the chat since the previous tick, then flushes the log. """
+        if current_map != self.current_map:
+            self.event_log.record(MAP_CHANGE_EVENT, previous_map=self.current_map, current_map=current_map,
+                                  next_map=next_map)
+            self.current_map = current_map
+        for player_id, player_chat in recent_player_chat.items():
+            self.event_log.record(CHAT_EVENT, player_id=player_id, player_name=player_chat.player_name,
+                                  messages=list(player_chat.messages))
+        self.event_log.flush()
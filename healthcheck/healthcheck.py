@@ -0,0 +1,321 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Enforces deadlines on RCON calls, measures their latency, and detects a stalled main loop.
+#
+
+import collections
+import concurrent.futures
+import functools
+import json
+import logging
+import queue
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from atomicfile import atomicfile
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# How long (in seconds) a single RCON call may take before it is considered hung.
+DEFAULT_RCON_DEADLINE_S = 10.0
+
+# The number of consecutive missed deadlines after which the connection is considered dead (and is reconnected).
+DEFAULT_MAX_MISSED_DEADLINES = 3
+
+# How long (in seconds) the main loop may go without a heartbeat before it is considered stalled. This has to be
+# longer than anything that legitimately blocks the loop (e.g. listening to map votes).
+DEFAULT_STALL_TIMEOUT_S = 5.0 * 60
+
+# How often (in seconds) the latency probe is sent, and how often the latency percentiles are exported.
+DEFAULT_PROBE_INTERVAL_S = 30.0
+DEFAULT_EXPORT_INTERVAL_S = 60.0
+
+# A cheap RCON command (with no side effects) used to probe the round-trip latency.
+PROBE_COMMAND = 'ShowNextMap'
+
+# The (private) attribute of pysrcds's RconConnection that holds its socket. There is no public way to interrupt a
+# call blocked on it (see DeadlineClient.shutdown_socket).
+RCON_SOCKET_ATTRIBUTE = '_sock'
+
+# The number of latest latency samples kept for each operation (the percentiles are computed over these).
+DEFAULT_MAX_LATENCY_SAMPLES = 1000
+
+# The latency percentiles that are exported.
+EXPORTED_PERCENTILES = (50, 90, 99)
+
+
+class RconDeadlineExceeded(Exception):
+    """ Raised when an RCON call does not finish before its deadline. """
+
+
+class RconStalled(Exception):
+    """ Raised when the RCON connection (or the main loop) is considered dead and should be reconnected. """
+
+
+class LatencyTracker:
+    """ Keeps the latest latency samples of every operation (e.g. each RCON method), and computes their percentiles. """
+
+    def __init__(self, max_samples=DEFAULT_MAX_LATENCY_SAMPLES):
+        self.lock = threading.Lock()
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=max_samples))
+
+    def record(self, operation, latency_s):
+        with self.lock:
+            self.samples[operation].append(latency_s)
+
+    def get_percentiles(self, percentiles=EXPORTED_PERCENTILES):
+        """
+        Returns the given latency percentiles (nearest-rank) of every operation.
+
+        :return: dict(str->dict) The operation name to a dict with the number of samples and each percentile (e.g.
+                 'p50_s').
+        """
+        with self.lock:
+            samples = {operation: sorted(latencies) for operation, latencies in self.samples.items()}
+        summary = {}
+        for operation, latencies in samples.items():
+            summary[operation] = {'num_samples': len(latencies)}
+            for percentile in percentiles:
+                rank = max(1, -(-percentile * len(latencies) // 100))
+                summary[operation][f'p{percentile}_s'] = latencies[rank - 1]
+        return summary
+
+
+class DeadlineClient:
+    """
+    A proxy around an RCON client that gives every call a deadline. The calls run on a single worker thread (so they
+    are still serialized like on a plain connection) while the caller waits up to the deadline. A call that misses its
+    deadline raises RconDeadlineExceeded (the hung call is abandoned), and once max_missed_deadlines calls in a row
+    miss theirs, every call raises RconStalled so the connection gets closed and reconnected.
+    """
+
+    def __init__(self, client, deadline_s=DEFAULT_RCON_DEADLINE_S, max_missed_deadlines=DEFAULT_MAX_MISSED_DEADLINES,
+                 latency_tracker=None):
+        """
+        The constructor for DeadlineClient.
+
+        :param client: RconConnection The RCON client to forward the calls to.
+        :param deadline_s: float How long each call may take (in seconds).
+        :param max_missed_deadlines: int The number of consecutive missed deadlines before the client is dead.
+        :param latency_tracker: LatencyTracker Where the latency of each call (by method name) is recorded.
+        """
+        self.client = client
+        self.deadline_s = deadline_s
+        self.max_missed_deadlines = max_missed_deadlines
+        self.latency_tracker = latency_tracker if latency_tracker is not None else LatencyTracker()
+        self.num_missed_deadlines = 0
+
+        # The calls waiting for the worker thread (None stops it), and the future of the latest call (the calls are
+        # serialized, so a call is still outstanding as long as the latest one is not done).
+        self.requests = queue.Queue()
+        self.latest_future = None
+        # A daemon thread (unlike the threads of a ThreadPoolExecutor), so a call that never returns cannot keep the bot
+        # from exiting.
+        self.thread = threading.Thread(target=self.work, name='rcon', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        """ Forwards any other attribute to the client (methods are wrapped with call()). """
+        if name == 'client':
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        return functools.partial(self.call, name) if callable(attribute) else attribute
+
+    def work(self):
+        """ The worker thread loop. Runs the submitted calls one at a time until close() is called. """
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            future, fn, args, kwargs = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, fn, *args, **kwargs):
+        """ Runs fn(*args, **kwargs) on the worker thread (after any earlier calls), and returns its future. """
+        future = concurrent.futures.Future()
+        self.latest_future = future
+        self.requests.put((future, fn, args, kwargs))
+        return future
+
+    def is_dead(self):
+        return self.num_missed_deadlines >= self.max_missed_deadlines
+
+    def call(self, method_name, *args, **kwargs):
+        """ Calls the given method of the client with a deadline, and returns its result. """
+        return self.call_as(method_name, method_name, *args, **kwargs)
+
+    def call_as(self, label, method_name, *args, **kwargs):
+        """ Same as call(), but the latency is recorded under the given label (instead of the method name). """
+        if self.is_dead():
+            raise RconStalled(f'RCON connection missed {self.num_missed_deadlines} deadlines in a row!')
+        start_time = time.monotonic()
+        future = self.submit(getattr(self.client, method_name), *args, **kwargs)
+        try:
+            result = future.result(timeout=self.deadline_s)
+        except concurrent.futures.TimeoutError:
+            self.num_missed_deadlines += 1
+            if self.is_dead():
+                raise RconStalled(f'RCON connection missed {self.num_missed_deadlines} deadlines in a row!')
+            raise RconDeadlineExceeded(f'RCON call {method_name} took longer than {self.deadline_s} seconds!')
+        self.num_missed_deadlines = 0
+        self.latency_tracker.record(label, time.monotonic() - start_time)
+        return result
+
+    def shutdown_socket(self):
+        """ Shuts down the socket of the client (safe to call from any thread), so a call hung on it fails at once. """
+        sock = getattr(self.client, RCON_SOCKET_ATTRIBUTE, None)
+        if not isinstance(sock, socket.socket):
+            logger.warning(f'Cannot shut down the socket of {type(self.client).__name__} (it has no '
+                           f'{RCON_SOCKET_ATTRIBUTE} socket), so a call hung on it stays blocked.')
+            return
+        # Closing the socket from another thread does not wake up a blocked recv(), but shutting it down does. It is
+        # closed too, since RconConnection retries a recv() that returns nothing (which now fails instead of spinning).
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError as e:
+            logger.warning(f'Could not shut down the RCON socket: {e}')
+        sock.close()
+
+    def interrupt(self):
+        """
+        Marks the connection as dead and shuts down its socket (safe to call from any thread), so a call hung on it
+        fails right away and every later call raises RconStalled (which makes the bot reconnect).
+        """
+        self.num_missed_deadlines = max(self.num_missed_deadlines, self.max_missed_deadlines)
+        self.shutdown_socket()
+
+    def close(self):
+        """
+        Stops the worker thread. If a call is still outstanding (e.g. it missed its deadline), the socket is shut down
+        so the hung call ends (and the worker thread with it) instead of staying blocked forever.
+        """
+        if self.latest_future is not None and not self.latest_future.done():
+            self.shutdown_socket()
+        self.requests.put(None)
+
+
+class HealthMonitor(plugin.Plugin):
+    """
+    A plugin that beats a heartbeat on every tick, probes the RCON round-trip latency, and exports the latency
+    percentiles. A background thread watches the heartbeat: if the main loop goes stall_timeout_s without a beat, it
+    logs where the main loop is stuck and marks it as stalled, which makes check() raise RconStalled (to reconnect).
+    """
+
+    def __init__(self, deadline_client, stall_timeout_s=DEFAULT_STALL_TIMEOUT_S,
+                 probe_interval_s=DEFAULT_PROBE_INTERVAL_S, export_interval_s=DEFAULT_EXPORT_INTERVAL_S,
+                 export_filepath=None, on_stall=None, worker_pool=None):
+        """
+        The constructor for HealthMonitor.
+
+        :param deadline_client: DeadlineClient The RCON client (its latency tracker is the one exported).
+        :param stall_timeout_s: float How long the main loop may go without a heartbeat (in seconds).
+        :param probe_interval_s: float How often to send the latency probe (in seconds).
+        :param export_interval_s: float How often to log (and write) the latency percentiles (in seconds).
+        :param export_filepath: Path The JSON file the latency percentiles are written to. None to only log them.
+        :param on_stall: callable Called (from the watchdog thread) when the main loop stalls. None to only log it.
+        :param worker_pool: WorkerPool See Plugin.
+        """
+        super().__init__(deadline_client, worker_pool)
+        self.stall_timeout_s = stall_timeout_s
+        self.probe_interval_s = probe_interval_s
+        self.export_interval_s = export_interval_s
+        self.export_filepath = export_filepath
+        self.on_stall = on_stall
+
+        self.last_heartbeat = time.monotonic()
+        self.last_probe_time = None
+        self.last_export_time = time.monotonic()
+        self.main_thread_id = threading.get_ident()
+        self.stalled = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, name='HealthMonitor', daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def beat(self):
+        """ Records that the main loop is alive (called on the main thread). """
+        self.main_thread_id = threading.get_ident()
+        self.last_heartbeat = time.monotonic()
+
+    def is_stalled(self, now=None):
+        now = now if now is not None else time.monotonic()
+        return now - self.last_heartbeat > self.stall_timeout_s
+
+    def watch(self):
+        """ The watchdog thread loop. Checks the heartbeat a few times per stall timeout. """
+        while not self.stopped.wait(self.stall_timeout_s / 4):
+            if self.is_stalled() and not self.stalled.is_set():
+                frame = sys._current_frames().get(self.main_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame else 'unknown'
+                logger.error(f'Main loop has not beat in {self.stall_timeout_s} seconds! It is stuck at:\n{stack}')
+                if self.on_stall:
+                    self.on_stall()
+                self.stalled.set()
+
+    def check(self):
+        """ Raises RconStalled if the main loop stalled or the RCON connection is dead (called on the main thread). """
+        if self.stalled.is_set():
+            raise RconStalled(f'Main loop stalled for more than {self.stall_timeout_s} seconds!')
+        if self.squad_rcon_client.is_dead():
+            raise RconStalled('RCON connection is dead!')
+
+    def probe(self):
+        """ Sends the latency probe (its latency is recorded by the client under PROBE_COMMAND only). """
+        self.squad_rcon_client.call_as(PROBE_COMMAND, 'exec_command', PROBE_COMMAND)
+
+    def export(self):
+        """ Logs the latency percentiles, and writes them to the export file (if any). """
+        percentiles = self.squad_rcon_client.latency_tracker.get_percentiles()
+        logger.info(f'RCON latency percentiles: {percentiles}')
+        if self.export_filepath:
+            atomicfile.write_file_atomically(self.export_filepath, json.dumps(percentiles, indent=2, sort_keys=True))
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Beats the heartbeat, and probes and exports the latency when they are due. """
+        self.beat()
+        now = time.monotonic()
+        if self.last_probe_time is None or now - self.last_probe_time >= self.probe_interval_s:
+            self.last_probe_time = now
+            self.probe()
+        if now - self.last_export_time >= self.export_interval_s:
+            self.last_export_time = now
+            self.export()
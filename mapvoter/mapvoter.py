@@ -13,13 +13,17 @@
 # A class that handles map voting mechanics to be used by a Squad RCON bot.
 #
 
-import collections
 import time
 import logging
 import random
-import re
 
-import squad_map_randomizer
+from chatfeed import chatfeed
+from clantag import clantag
+from eventlog import eventlog
+from mapvoter import votehistory
+from mapvoter import voteparser
+from plugin import plugin
+from poll import poll
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +57,9 @@ MAP_VOTE_COMMANDS = ['!mapvote', '!votemap', '!rtv']
 # The text to display for the last option in the map vote (runs the map vote again with random candidates).
 REDO_VOTE_OPTION = 'None of the above (do nothing)'
 
+# The most times the candidates are chosen again to avoid excluded layers (see get_map_candidates()).
+MAX_CANDIDATE_ATTEMPTS = 20
+
 
 def has_map_vote_command(message):
     """ Helper that returns True if the message contains any of the map vote commands and False otherwise. """
@@ -70,17 +77,32 @@ def get_rotation_from_filepath(map_rotation_filepath):
         return list(filter(None, [line.strip('\n') for line in f.readlines()]))
 
 
-def get_map_candidates(config, all_map_layers):
+def get_map_candidates(config, all_map_layers, excluded_layers=frozenset()):
     """
     Return the candidate map layers for a vote based on the filters provided in the config and the available map layers.
 
     :param config: dict The config that describes how to choose the rotation.
     :param all_map_layers: list(str) The list of map layers to choose candidates from.
+    :param excluded_layers: set(str) Layers to avoid (e.g. recently played ones). They are only chosen if the config
+                            keeps picking them (MAX_CANDIDATE_ATTEMPTS times).
     :return: list(str) The list of map candidates. The last choice is always a "redo" option.
     """
-    # Otherwise, just use random maps as candidates (and a redo option).
-    rotation = squad_map_randomizer.get_map_rotation(config, all_map_layers)
-    return squad_map_randomizer.get_layers(rotation) + [REDO_VOTE_OPTION]
+    # Imported here (not at startup) since squad_map_randomizer pulls in its YAML and HTTP dependencies.
+    import squad_map_randomizer
+
+    # Otherwise, just use random maps as candidates (and a redo option). Choosing a rotation is cheap, so choose again
+    # until none of the candidates are excluded, and keep the choice with the fewest excluded candidates.
+    best_layers, best_num_excluded = None, None
+    num_attempts = MAX_CANDIDATE_ATTEMPTS if excluded_layers else 1
+    for _ in range(num_attempts):
+        rotation = squad_map_randomizer.get_map_rotation(config, all_map_layers)
+        layers = squad_map_randomizer.get_layers(rotation)
+        num_excluded = sum(layer in excluded_layers for layer in layers)
+        if best_layers is None or num_excluded < best_num_excluded:
+            best_layers, best_num_excluded = layers, num_excluded
+        if not num_excluded:
+            break
+    return best_layers + [REDO_VOTE_OPTION]
 
 
 def format_candidate_maps(candidate_maps):
@@ -88,7 +110,7 @@ def format_candidate_maps(candidate_maps):
     return '\n'.join([f'{index}) {candidate}' for index, candidate in enumerate(candidate_maps)])
 
 
-def get_highest_map_vote(candidate_maps, player_messages):
+def get_highest_map_vote(candidate_maps, player_messages, map_vote=None):
     """
     Given a list of candidate maps and player messages (dict of player_id -> PlayerChat), return both the key
     and count for the highest map vote.
@@ -97,10 +119,14 @@ def get_highest_map_vote(candidate_maps, player_messages):
 
     :param candidate_maps: list(str) The list of candidate maps that are being voted on.
     :param player_messages: dict(str->PlayerChat) Contains the list of messages for each player (keyed by player_id).
+    :param map_vote: Poll The poll to count the votes in (e.g. to read the counts and ballots afterwards). Defaults to
+                     a new poll of the candidate maps.
     :return: tuple(str, int) The name of the winning map and the vote count it received. None if there are no votes.
     """
-    # This is a counter that keeps track of the count for each map (key).
-    map_votes = collections.Counter()
+    # This poll keeps track of the count for each map (and breaks ties).
+    map_vote = map_vote if map_vote is not None else poll.Poll('Next map', candidate_maps)
+
+    vote_parser = voteparser.VoteParser(len(candidate_maps))
 
     # Go over every message and count it towards a map if you can use it as an
     # index. Otherwise, skip it.
@@ -112,20 +138,18 @@ def get_highest_map_vote(candidate_maps, player_messages):
         # In order to avoid double-counting votes from a single voter, use their most recent valid vote and throw away
         # the rest of their votes.
         for message in reversed(player_chat.messages):
-            try:
-                # Grab the last word in the message and consider that the vote.
-                vote_message = re.search(r'\w+$', message.strip()).group(0)
-                map_votes.update([candidate_maps[int(vote_message)]])
+            option_index = vote_parser.parse(message)
+            if option_index is not None and map_vote.add_ballot(player_id, option_index):
                 # If we count this message as a vote, ignore the previous messages from this player (so we don't double
                 # count votes for this player).
                 break
-            except (ValueError, IndexError, AttributeError):
-                logger.warning(f'Player with id {player_id} entered invalid mapvote message {message}. Skipping...')
 
-    return map_votes.most_common(1)[0] if map_votes else None
+    # Log the invalid messages once (instead of once per message, which adds up on busy servers).
+    vote_parser.log_invalid_summary('mapvote')
+    return map_vote.get_winner()
 
 
-class MapVoter:
+class MapVoter(plugin.Plugin):
     """
     Instantiate this class and use it to send map voting instructions and listen to player responses (blocking).
     Whenever a new map starts, call reset_map_vote() and you can then poll should_start_map_vote() and then call
@@ -133,15 +157,33 @@ class MapVoter:
     """
 
     def __init__(self, squad_rcon_client,
-                 voting_cooldown_s=DEFAULT_VOTING_COOLDOWN_S, voting_time_duration_s=DEFAULT_VOTING_TIME_DURATION_S):
+                 voting_cooldown_s=DEFAULT_VOTING_COOLDOWN_S, voting_time_duration_s=DEFAULT_VOTING_TIME_DURATION_S,
+                 worker_pool=None, clan_registry=None, chat_feed=None, vote_history=None, event_log=None):
         """
         The constructor for MapVoter.
 
         :param squad_rcon_client: RconConnection The handle to the rcon client.
         :param voting_time_duration_s: float The duration of time to wait for players to vote on maps in seconds.
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        :param clan_registry: ClanTagRegistry The clans whose admin members can force a map vote. Defaults to CLAN_TAG.
+        :param chat_feed: ChatFeed The feed the votes are read from (drained during the vote, so the other subscribers
+                          still get the chat). Defaults to a feed of its own.
+        :param vote_history: VoteHistory Where every vote and played layer is recorded (and recently played or rejected
+                             layers are excluded from the candidates). None to not keep a history.
+        :param event_log: EventLog Where the result of every vote is recorded. None to not record them.
         """
-        # This stores the handle to the squad_rcon_client (so we can contact the squad server).
-        self.squad_rcon_client = squad_rcon_client
+        super().__init__(squad_rcon_client, worker_pool)
+
+        # The clans whose admin members can start a map vote by themselves.
+        self.clan_registry = (clan_registry if clan_registry is not None else
+                              clantag.ClanTagRegistry.from_tags([CLAN_TAG]))
+
+        self.chat_feed = chat_feed if chat_feed is not None else chatfeed.ChatFeed(squad_rcon_client)
+        self.vote_history = vote_history
+        self.event_log = event_log
+
+        # The layer currently being played (used to record every layer played in the vote history).
+        self.current_layer = None
 
         # How many seconds to wait for players to vote on a map.
         self.voting_time_duration_s = voting_time_duration_s
@@ -152,6 +194,10 @@ class MapVoter:
         # Flag to indicate that a map vote should be redone (with random maps) as soon as possible.
         self.redo_requested = False
 
+        # The map rotation config and all map layers as one tuple (config, all_map_layers), so that both are always
+        # swapped in together. None until set_map_config() is called.
+        self.map_config = None
+
         # Reset map vote timer since we just started. This sets self.time_since_map vote to time now.
         self.reset_map_vote()
 
@@ -165,6 +211,24 @@ class MapVoter:
         # The set of players currently requesting a map vote.
         self.players_requesting_map_vote = set()
 
+    def set_map_config(self, config, all_map_layers):
+        """
+        Swaps in a new map rotation config and the map layers to choose candidates from. Takes effect on the next call to
+        run_once().
+
+        :param config: dict The config that describes how to choose the rotation.
+        :param all_map_layers: list(str) The list of map layers to choose candidates from.
+        """
+        self.map_config = (config, all_map_layers)
+
+    def update_settings(self, voting_cooldown_s, voting_time_duration_s):
+        """
+        Updates the voting cooldown and duration (in seconds) of the running voter. The new cooldown applies to the
+        current cooldown period and the new duration applies to the next map vote.
+        """
+        self.voting_cooldown_s = voting_cooldown_s
+        self.voting_time_duration_s = voting_time_duration_s
+
     def get_duration_since_map_vote(self):
         """ Returns the duration of time (in seconds) since the map started. """
         return time.time() - self.time_since_map_vote
@@ -214,6 +278,8 @@ class MapVoter:
         Starts a map vote by sending candidate maps message and listening to chat for a specified duration. Blocks while
         the map vote is being done.
         """
+        vote_started_at = time.time()
+
         # Format the given list of map candidates.
         candidate_maps_formatted = format_candidate_maps(candidate_maps)
         logger.info(f'Starting a new map vote! Candidate maps:\n{candidate_maps_formatted}')
@@ -223,18 +289,26 @@ class MapVoter:
             candidate_maps=candidate_maps_formatted)
         self.squad_rcon_client.exec_command(f'AdminBroadcast {start_vote_message}')
 
-        # Clear the old player chat objects that might have accumulated before the vote started.
-        self.squad_rcon_client.clear_player_chat()
+        # Only the chat sent after the vote started counts as votes (the chat before it stays in the feed for the other
+        # subscribers).
+        self.chat_feed.drain()
+        vote_cursor = self.chat_feed.subscribe('MapVoter vote')
 
-        # Listen to the chat messages and collect them all as a dict of player_id -> PlayerChat where each player could
-        # have posted a list of messages.
-        self.listen_to_votes(self.voting_time_duration_s, start_vote_message)
-        vote_chat = self.squad_rcon_client.get_player_chat()
+        # Listen to the chat messages and collect them all as a mapping of player_id -> PlayerChat where each player
+        # could have posted a list of messages.
+        try:
+            self.listen_to_votes(self.voting_time_duration_s, start_vote_message)
+            self.chat_feed.drain()
+            vote_chat = vote_cursor.read()
+        finally:
+            self.chat_feed.unsubscribe(vote_cursor)
         logger.debug(f'The received player messages were:\n{vote_chat}\n')
 
         # Parse the chat messages into votes, and choose the map with the highest votes.
+        map_vote = poll.Poll('Next map', candidate_maps, started_at=vote_started_at)
         result = get_highest_map_vote(
-            candidate_maps, vote_chat)
+            candidate_maps, vote_chat, map_vote)
+        self.record_vote(map_vote, result)
         if result:
             winner_map, vote_count = result
             # If the voting was valid and was not a redo option, send a message with the results, then set next map.
@@ -262,6 +336,38 @@ class MapVoter:
             self.squad_rcon_client.exec_command(f'AdminBroadcast {vote_failed_message}')
             logger.warning(vote_failed_message)
 
+    def record_vote(self, map_vote, result):
+        """
+        Records the given finished map vote (a Poll) and its result in the vote history and the event log (if there are
+        any).
+        """
+        winner_map = result[0] if result else None
+        outcome = (votehistory.FAILED_OUTCOME if winner_map is None else
+                   votehistory.REDO_OUTCOME if winner_map == REDO_VOTE_OPTION else votehistory.WINNER_OUTCOME)
+        ballots = {player_id: option_index for player_id, (option_index, _, _) in map_vote.ballots.items()}
+        if self.event_log is not None:
+            self.event_log.record(eventlog.VOTE_RESULT_EVENT, options=map_vote.options, counts=map_vote.get_counts(),
+                                  ballots=ballots, outcome=outcome, winner_map=winner_map,
+                                  started_at=map_vote.started_at)
+        if self.vote_history is None:
+            return
+        try:
+            self.vote_history.record_vote(map_vote.options, map_vote.get_counts(), ballots, outcome,
+                                          winner_map=winner_map, started_at=map_vote.started_at)
+        except Exception as e:
+            # The history is nice to have, so never let it break the vote.
+            logger.error(f'Failed to record the map vote in the vote history: {e}')
+
+    def get_excluded_layers(self):
+        """ Returns the layers that should not be candidates (recently played or rejected, see VoteHistory). """
+        if self.vote_history is None:
+            return frozenset()
+        try:
+            return self.vote_history.get_excluded_layers()
+        except Exception as e:
+            logger.error(f'Failed to read the excluded layers from the vote history: {e}')
+            return frozenset()
+
     def did_enough_players_ask_for_map_vote(self, recent_player_chat):
         """
         Returns True if enough players (above threshold) have recently requested a mapvote, and returns False otherwise.
@@ -284,11 +390,12 @@ class MapVoter:
 
     def did_one_clan_member_ask_for_map_vote(self, recent_player_chat):
         """
-        Returns True if any clan members (see CLAN_TAG) recently requested a mapvote, and returns False otherwise.
+        Returns True if any admin clan members (see clan_registry) recently requested a mapvote, and returns False
+        otherwise.
         """
         for player_id, player_chat in recent_player_chat.items():
             for message in player_chat.messages:
-                if has_map_vote_command(message) and CLAN_TAG in player_chat.player_name:
+                if has_map_vote_command(message) and self.clan_registry.is_admin(player_id, player_chat.player_name):
                     return True
         return False
 
@@ -299,20 +406,20 @@ class MapVoter:
         listens to answers and then sets the new map.
         """
 
-        # Fetch the kwargs from the caller, and log a descriptive warning if it fails.
-        try:
-            config_filepath = kwargs['config_filepath']
-            map_layers_url = kwargs['map_layers_url']
-        except KeyError:
-            logger.error(f'Invalid arguments given to MapVoter run_once!')
-            raise
-
-        # Get the config and layers to choose from.
-        NO_FILEPATH = None
-        all_map_layers = squad_map_randomizer.get_json_layers(
-            NO_FILEPATH, map_layers_url)
-        config = squad_map_randomizer.parse_config(
-            config_filepath, all_map_layers)
+        # Use the most recently loaded config and layers (see set_map_config()). Skip if none are loaded yet.
+        if self.map_config is None:
+            logger.warning('No map rotation config has been loaded yet! Skipping MapVoter run_once.')
+            return
+        config, all_map_layers = self.map_config
+
+        # Record every new layer in the vote history (so it is not offered as a candidate again for a while).
+        if current_map != self.current_layer:
+            self.current_layer = current_map
+            if self.vote_history is not None:
+                try:
+                    self.vote_history.record_layer_played(current_map)
+                except Exception as e:
+                    logger.error(f'Failed to record the played layer in the vote history: {e}')
 
         # Print out how long until or since map vote.
         if self.get_duration_until_map_vote_available() > 0:
@@ -328,7 +435,7 @@ class MapVoter:
         # happening. We skip the last candidate (always a redo option).
         if current_map == next_map:
             random_map = random.choice(
-                get_map_candidates(config, all_map_layers)[:-1])
+                get_map_candidates(config, all_map_layers, self.get_excluded_layers())[:-1])
             logger.warning(f'Next map is same as current map! Setting to a random map: {random_map}')
             self.squad_rcon_client.exec_command(f'AdminSetNextMap "{random_map}"')
 
@@ -337,4 +444,4 @@ class MapVoter:
             # In the special case that a redo is requested, omit the rotation filepath so we pick random maps. Also
             # reset the redo flag.
             self.redo_requested = False
-            self.start_map_vote(get_map_candidates(config, all_map_layers))
+            self.start_map_vote(get_map_candidates(config, all_map_layers, self.get_excluded_layers()))
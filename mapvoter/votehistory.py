@@ -0,0 +1,157 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A persistent history of map votes and played layers, used to keep recently played or rejected layers out of votes.
+#
+
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# The outcomes of a map vote.
+WINNER_OUTCOME = 'winner'
+REDO_OUTCOME = 'redo'
+FAILED_OUTCOME = 'failed'
+
+# Layers played within this duration (in seconds) are not offered as candidates again.
+DEFAULT_RECENTLY_PLAYED_WINDOW_S = 4 * 60 * 60
+# Layers that lost a vote within this duration (in seconds) are not offered as candidates again.
+DEFAULT_RECENTLY_REJECTED_WINDOW_S = 2 * 60 * 60
+
+# How long (in seconds) to wait for another bot (e.g. of another server) that is writing to the same history file.
+DEFAULT_BUSY_TIMEOUT_S = 10.0
+
+# The tables and indexes of the history. Every query is scoped to one server and a time window, so the indexes lead
+# with the server and the time (and include the layer, so the recent layer queries only read the index).
+SCHEMA_STATEMENTS = [
+    'CREATE TABLE IF NOT EXISTS votes (id INTEGER PRIMARY KEY, server TEXT NOT NULL, started_at REAL NOT NULL, '
+    'ended_at REAL NOT NULL, outcome TEXT NOT NULL, winner_layer TEXT, num_voters INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS votes_server_ended_at ON votes (server, ended_at, outcome)',
+    'CREATE TABLE IF NOT EXISTS vote_options (vote_id INTEGER NOT NULL REFERENCES votes (id), '
+    'option_index INTEGER NOT NULL, server TEXT NOT NULL, ended_at REAL NOT NULL, layer TEXT NOT NULL, '
+    'num_votes INTEGER NOT NULL, won INTEGER NOT NULL, PRIMARY KEY (vote_id, option_index))',
+    'CREATE INDEX IF NOT EXISTS vote_options_server_ended_at ON vote_options (server, ended_at, won, layer)',
+    'CREATE INDEX IF NOT EXISTS vote_options_server_layer ON vote_options (server, layer, won, num_votes)',
+    'CREATE TABLE IF NOT EXISTS ballots (vote_id INTEGER NOT NULL REFERENCES votes (id), player_id TEXT NOT NULL, '
+    'option_index INTEGER NOT NULL, PRIMARY KEY (vote_id, player_id))',
+    'CREATE INDEX IF NOT EXISTS ballots_player_id ON ballots (player_id)',
+    'CREATE TABLE IF NOT EXISTS layers_played (server TEXT NOT NULL, started_at REAL NOT NULL, layer TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS layers_played_server_started_at ON layers_played (server, started_at, layer)',
+]
+
+
+class VoteHistory:
+    """
+    The history (backed by SQLite) of every map vote (candidates, vote counts, ballots and outcome) and every layer
+    played on a server. Several servers can share one history file (every row is tagged with its server).
+    """
+
+    def __init__(self, filepath, server_name, recently_played_window_s=DEFAULT_RECENTLY_PLAYED_WINDOW_S,
+                 recently_rejected_window_s=DEFAULT_RECENTLY_REJECTED_WINDOW_S):
+        """
+        The constructor for VoteHistory.
+
+        :param filepath: Path The filepath to the SQLite history file (created if it does not exist).
+        :param server_name: str The name of this bot's server (e.g. its address).
+        :param recently_played_window_s: float See get_excluded_layers().
+        :param recently_rejected_window_s: float See get_excluded_layers().
+        """
+        self.server_name = server_name
+        self.recently_played_window_s = recently_played_window_s
+        self.recently_rejected_window_s = recently_rejected_window_s
+        self.connection = sqlite3.connect(str(filepath), timeout=DEFAULT_BUSY_TIMEOUT_S)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            for statement in SCHEMA_STATEMENTS:
+                self.connection.execute(statement)
+
+    def record_vote(self, candidate_maps, counts, ballots, outcome, winner_map=None, started_at=None, ended_at=None):
+        """
+        Records a finished map vote (in one transaction).
+
+        :param candidate_maps: list(str) The candidates (options) of the vote.
+        :param counts: list(int) The vote count of each candidate.
+        :param ballots: dict(str->int) The option index each player voted for.
+        :param outcome: str One of WINNER_OUTCOME, REDO_OUTCOME or FAILED_OUTCOME.
+        :param winner_map: str The winning candidate (None if the vote failed).
+        :param started_at: float The time (since the epoch) the vote started. Defaults to ended_at.
+        :param ended_at: float The time (since the epoch) the vote ended. Defaults to now.
+        :return: int The id of the recorded vote.
+        """
+        ended_at = ended_at if ended_at is not None else time.time()
+        started_at = started_at if started_at is not None else ended_at
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO votes (server, started_at, ended_at, outcome, winner_layer, num_voters) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.server_name, started_at, ended_at, outcome, winner_map, len(ballots)))
+            vote_id = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO vote_options (vote_id, option_index, server, ended_at, layer, num_votes, won) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(vote_id, index, self.server_name, ended_at, layer, count, int(layer == winner_map))
+                 for index, (layer, count) in enumerate(zip(candidate_maps, counts))])
+            self.connection.executemany(
+                'INSERT INTO ballots (vote_id, player_id, option_index) VALUES (?, ?, ?)',
+                [(vote_id, player_id, option_index) for player_id, option_index in ballots.items()])
+        return vote_id
+
+    def record_layer_played(self, layer, started_at=None):
+        """ Records that the given layer started being played on the server. """
+        with self.connection:
+            self.connection.execute('INSERT INTO layers_played (server, started_at, layer) VALUES (?, ?, ?)',
+                                    (self.server_name, started_at if started_at is not None else time.time(), layer))
+
+    def get_recently_played_layers(self, since):
+        """ Returns the set of layers played on the server since the given time (since the epoch). """
+        rows = self.connection.execute(
+            'SELECT DISTINCT layer FROM layers_played WHERE server = ? AND started_at >= ?', (self.server_name, since))
+        return {layer for layer, in rows}
+
+    def get_recently_rejected_layers(self, since):
+        """ Returns the set of candidates that lost a (successful) vote on the server since the given time. """
+        rows = self.connection.execute(
+            'SELECT DISTINCT layer FROM vote_options WHERE server = ? AND ended_at >= ? AND won = 0 AND vote_id IN '
+            '(SELECT id FROM votes WHERE server = ? AND ended_at >= ? AND outcome = ?)',
+            (self.server_name, since, self.server_name, since, WINNER_OUTCOME))
+        return {layer for layer, in rows}
+
+    def get_excluded_layers(self, now=None):
+        """ Returns the set of layers that were recently played or rejected (and should not be candidates again). """
+        now = now if now is not None else time.time()
+        return (self.get_recently_played_layers(now - self.recently_played_window_s) |
+                self.get_recently_rejected_layers(now - self.recently_rejected_window_s))
+
+    def get_layer_statistics(self):
+        """
+        Returns how each layer did in the server's votes.
+
+        :return: dict(str->dict) The layer to the number of votes it was a candidate in, won, and the total votes it
+                 received.
+        """
+        rows = self.connection.execute(
+            'SELECT layer, COUNT(*), SUM(won), SUM(num_votes) FROM vote_options WHERE server = ? GROUP BY layer',
+            (self.server_name,))
+        return {layer: {'num_candidacies': num_candidacies, 'num_wins': num_wins, 'num_votes': num_votes}
+                for layer, num_candidacies, num_wins, num_votes in rows}
+
+    def get_outcome_counts(self, since=0.0):
+        """ Returns the number of the server's votes (since the given time) with each outcome. """
+        rows = self.connection.execute(
+            'SELECT outcome, COUNT(*) FROM votes WHERE server = ? AND ended_at >= ? GROUP BY outcome',
+            (self.server_name, since))
+        return dict(rows)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,98 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A parser that turns chat messages into map vote ballots (the index of the chosen option), built for busy servers.
+#
+
+import collections
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# A ballot is the last word of a message, made of digits only (e.g. '2', 'I vote 2', 'option: 2').
+# The lookbehind rejects words that merely end in digits (e.g. 'abc2'), like int() on the last word did.
+BALLOT_PATTERN = re.compile(r'(?<!\w)\d+$')
+
+# The reasons a message is not counted as a ballot.
+NOT_A_NUMBER = 'not a number'
+OUT_OF_RANGE = 'out of range'
+
+
+class VoteParser:
+    """
+    Parses chat messages into ballots for a vote on the given number of options. Parsing never raises or logs for
+    invalid messages (most chat during a vote is not a ballot); instead, the invalid messages are counted per reason
+    and can be logged once with log_invalid_summary().
+    """
+
+    def __init__(self, num_options):
+        """
+        The constructor for VoteParser.
+
+        :param num_options: int The number of options in the vote (valid ballots are 0 to num_options - 1).
+        """
+        self.num_options = num_options
+        # Ballots with more digits than this are out of range (checked before calling int() on untrusted digits).
+        self.max_num_digits = len(str(max(num_options - 1, 0)))
+
+        # The number of valid ballots parsed, and the number of invalid messages for each reason.
+        self.num_ballots = 0
+        self.invalid_counts = collections.Counter()
+
+    def parse(self, message):
+        """
+        Returns the option index of the ballot in the given message, or None if the message is not a valid ballot.
+
+        :param message: str The chat message.
+        :return: int The index of the chosen option, or None.
+        """
+        # Fast path: most ballots are just the number.
+        if message.isdecimal():
+            return self.get_option_index(message)
+
+        message = message.strip()
+        if message.isdecimal():
+            return self.get_option_index(message)
+        # Cheap rejection: most other chat does not end in a digit, so there is no need to search it.
+        if not message or not message[-1].isdecimal():
+            self.invalid_counts[NOT_A_NUMBER] += 1
+            return None
+
+        match = BALLOT_PATTERN.search(message)
+        if match is None:
+            self.invalid_counts[NOT_A_NUMBER] += 1
+            return None
+        return self.get_option_index(match.group(0))
+
+    def get_option_index(self, digits):
+        """ Returns the option index of the given (decimal) digits, or None if it is not one of the options. """
+        # Leading zeros do not count towards the number of digits (e.g. '01' is option 1).
+        digits = digits.lstrip('0') or '0'
+        if len(digits) <= self.max_num_digits:
+            option_index = int(digits)
+            if option_index < self.num_options:
+                self.num_ballots += 1
+                return option_index
+        self.invalid_counts[OUT_OF_RANGE] += 1
+        return None
+
+    def get_num_invalid(self):
+        return sum(self.invalid_counts.values())
+
+    def log_invalid_summary(self, vote_name):
+        """ Logs (once) how many messages were skipped as invalid ballots, if any. """
+        num_invalid = self.get_num_invalid()
+        if num_invalid:
+            reasons = ', '.join(f'{count} {reason}' for reason, count in sorted(self.invalid_counts.items()))
+            logger.warning(f'Skipped {num_invalid} invalid {vote_name} messages ({reasons}), and counted '
+                           f'{self.num_ballots} ballots.')
@@ -0,0 +1,120 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Vectorized (numpy) analysis of the match history, e.g. to decide when the teams should be shuffled.
+#
+
+import numpy as np
+
+from columnar import columnar
+from matchhistory import matchhistory
+
+# The round duration (in seconds) of a normal, balanced round. Shorter rounds count as more lopsided.
+DEFAULT_EXPECTED_DURATION_S = 60.0 * 60
+
+# The number of latest rounds averaged when deciding whether to shuffle.
+DEFAULT_SHUFFLE_WINDOW = 3
+
+# The average lopsidedness score of the latest rounds above which a shuffle is suggested.
+DEFAULT_SHUFFLE_THRESHOLD = 0.5
+
+# Rounds shorter than this (in seconds) were most likely skipped by an admin or cut short by a map change, so their
+# duration says nothing about how lopsided they were (and they are not scored).
+DEFAULT_MIN_TRUSTED_DURATION_S = 15.0 * 60
+
+# Rounds that ended with fewer players than this (on both teams) were most likely seeding rounds (not scored either).
+DEFAULT_MIN_TRUSTED_PLAYERS = 40
+
+
+def load_match_history(store):
+    """
+    Returns every column of the match history store as a numpy array (string columns are returned as their int codes,
+    see store.dictionaries).
+
+    :param store: ColumnarStore The match history store.
+    :return: dict(str->numpy.ndarray) The columns of the store.
+    """
+    columns = {}
+    for name, _ in matchhistory.MATCH_HISTORY_SCHEMA:
+        raw_values = store.read_codes(name)
+        columns[name] = np.frombuffer(raw_values, dtype=np.dtype(raw_values.typecode)) if raw_values else (
+            np.array([], dtype=np.dtype(raw_values.typecode)))
+    return columns
+
+
+def get_lopsidedness_scores(team1_tickets, team2_tickets, durations_s, expected_duration_s=DEFAULT_EXPECTED_DURATION_S):
+    """
+    Returns a lopsidedness score between 0 (balanced) and 1 (one-sided) for every round. The score is the larger of
+    the ticket difference (relative to the total tickets, only for rounds with known tickets) and how much shorter than
+    expected the round was.
+    """
+    team1_tickets = np.asarray(team1_tickets, dtype=float)
+    team2_tickets = np.asarray(team2_tickets, dtype=float)
+    known_tickets = (team1_tickets >= 0) & (team2_tickets >= 0)
+    total_tickets = np.maximum(team1_tickets + team2_tickets, 1.0)
+    ticket_scores = np.where(known_tickets, np.abs(team1_tickets - team2_tickets) / total_tickets, 0.0)
+    duration_scores = np.clip(1.0 - np.asarray(durations_s, dtype=float) / expected_duration_s, 0.0, 1.0)
+    return np.maximum(ticket_scores, duration_scores)
+
+
+def get_layer_statistics(layer_codes, num_layers, scores, durations_s):
+    """
+    Returns the number of rounds, the mean lopsidedness score, and the mean duration of every layer (indexed by layer
+    code). Layers without rounds have NaN means.
+    """
+    layer_codes = np.asarray(layer_codes, dtype=np.int64)
+    counts = np.bincount(layer_codes, minlength=num_layers).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_scores = np.bincount(layer_codes, weights=scores, minlength=num_layers) / counts
+        mean_durations_s = np.bincount(layer_codes, weights=durations_s, minlength=num_layers) / counts
+    return {'num_rounds': counts.astype(np.int64), 'mean_score': mean_scores, 'mean_duration_s': mean_durations_s}
+
+
+def get_trusted_rounds(durations_s, team1_players, team2_players, min_duration_s=DEFAULT_MIN_TRUSTED_DURATION_S,
+                       min_players=DEFAULT_MIN_TRUSTED_PLAYERS):
+    """ Returns a boolean mask of the rounds that were long and full enough for their score to be trusted. """
+    num_players = np.asarray(team1_players, dtype=float) + np.asarray(team2_players, dtype=float)
+    return (np.asarray(durations_s, dtype=float) >= min_duration_s) & (num_players >= min_players)
+
+
+def should_shuffle(scores, window=DEFAULT_SHUFFLE_WINDOW, threshold=DEFAULT_SHUFFLE_THRESHOLD):
+    """ Returns True if the mean score of the latest window rounds is above the threshold, and False otherwise. """
+    return len(scores) >= window and float(np.mean(scores[-window:])) > threshold
+
+
+def analyze_match_history(store_dirpath, window=DEFAULT_SHUFFLE_WINDOW, threshold=DEFAULT_SHUFFLE_THRESHOLD,
+                          expected_duration_s=DEFAULT_EXPECTED_DURATION_S,
+                          min_duration_s=DEFAULT_MIN_TRUSTED_DURATION_S, min_players=DEFAULT_MIN_TRUSTED_PLAYERS):
+    """
+    Analyzes the whole match history store in one batch (safe to run in a worker thread or process). Only the trusted
+    rounds (see get_trusted_rounds) count towards the shuffle suggestion.
+
+    :param store_dirpath: str The directory of the match history store.
+    :return: dict The number of (trusted) rounds scored, the mean score of the latest trusted rounds, whether to
+             shuffle, and the statistics of every layer (keyed by layer name, over all rounds).
+    """
+    # Read-only, since the main loop keeps appending to the same store.
+    store = columnar.ColumnarStore(store_dirpath, matchhistory.MATCH_HISTORY_SCHEMA, read_only=True)
+    columns = load_match_history(store)
+    scores = get_lopsidedness_scores(columns['team1_tickets'], columns['team2_tickets'], columns['duration_s'],
+                                     expected_duration_s)
+    trusted_scores = scores[get_trusted_rounds(columns['duration_s'], columns['team1_players'],
+                                               columns['team2_players'], min_duration_s, min_players)]
+    layer_names = store.dictionaries['layer']
+    layer_statistics = get_layer_statistics(columns['layer'], len(layer_names), scores, columns['duration_s'])
+    return {
+        'num_rounds': min(window, len(trusted_scores)),
+        'recent_score': float(np.mean(trusted_scores[-window:])) if len(trusted_scores) else 0.0,
+        'should_shuffle': should_shuffle(trusted_scores, window, threshold),
+        'layers': {name: {key: values[code].item() for key, values in layer_statistics.items()}
+                   for code, name in enumerate(layer_names)},
+    }
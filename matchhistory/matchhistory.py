@@ -0,0 +1,148 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A plugin that records a summary of every round into an append-only columnar match history.
+#
+
+import logging
+import time
+
+from columnar import columnar
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The value stored for tickets and the winner when they are not known (RCON does not report them).
+UNKNOWN = -1
+
+# The schema of the columnar store of match history (one row per round).
+MATCH_HISTORY_SCHEMA = [
+    ('layer', columnar.STRING_TYPE),
+    ('started_at', 'd'),
+    ('ended_at', 'd'),
+    ('duration_s', 'd'),
+    ('team1_players', 'i'),
+    ('team2_players', 'i'),
+    ('team1_clan_members', 'i'),
+    ('team2_clan_members', 'i'),
+    ('team1_tickets', 'i'),
+    ('team2_tickets', 'i'),
+    ('winner_team', 'i'),
+]
+
+# The string to be formatted and sent to the admins on the server (see MatchRecorder.on_analysis) when the latest
+# rounds were lopsided.
+SHUFFLE_SUGGESTION_MESSAGE_TEMPLATE = ('The last {num_rounds} rounds were lopsided (score {score:.2f}). '
+                                       'Consider a !shuffle.')
+
+
+def get_team_composition(player_tracker, clan_registry=None):
+    """
+    Returns the number of players and the number of clan members on each team, as of the latest player snapshot.
+
+    :return: dict(str->int) The team1_players, team2_players, team1_clan_members and team2_clan_members.
+    """
+    composition = {'team1_players': 0, 'team2_players': 0, 'team1_clan_members': 0, 'team2_clan_members': 0}
+    for record in player_tracker.records.values():
+        team = f'team{record.player.team_id}'
+        if f'{team}_players' not in composition:
+            continue
+        composition[f'{team}_players'] += 1
+        if clan_registry is not None and clan_registry.lookup_record(record) is not None:
+            composition[f'{team}_clan_members'] += 1
+    return composition
+
+
+class MatchRecorder(plugin.Plugin):
+    """
+    A plugin that appends a summary of every round (layer, duration and team compositions) to the match history store
+    whenever the map changes. The round that was already running when the bot started is not recorded (its start time
+    is unknown). After each round, the match history is analyzed in the worker pool (see analysis), and a shuffle is
+    suggested to the admins on the server (the players in an admin clan) when the latest rounds were lopsided.
+    """
+
+    def __init__(self, squad_rcon_client, store, player_tracker, clan_registry=None, worker_pool=None):
+        """
+        The constructor for MatchRecorder.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param store: ColumnarStore Where the rounds are recorded (with MATCH_HISTORY_SCHEMA).
+        :param player_tracker: PlayerTracker The tracker of the players on the server (must run before this plugin).
+        :param clan_registry: ClanTagRegistry Used to count the clan members on each team and to find the admins to
+                              suggest a shuffle to. None to not count them (and only log the suggestion).
+        :param worker_pool: WorkerPool The pool to run the analysis in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.store = store
+        self.player_tracker = player_tracker
+        self.clan_registry = clan_registry
+
+        # The layer being played and the time (since the epoch) it started (None if unknown).
+        self.current_layer = None
+        self.round_started_at = None
+        # The team compositions as of the latest tick (the snapshot after the map change has the new round's teams).
+        self.latest_composition = None
+
+    def record_round(self, layer, started_at, ended_at, composition, team1_tickets=UNKNOWN, team2_tickets=UNKNOWN,
+                     winner_team=UNKNOWN):
+        """ Appends the summary of a finished round to the store. """
+        row = {
+            'layer': layer,
+            'started_at': started_at,
+            'ended_at': ended_at,
+            'duration_s': ended_at - started_at,
+            'team1_tickets': team1_tickets,
+            'team2_tickets': team2_tickets,
+            'winner_team': winner_team,
+        }
+        row.update(composition)
+        self.store.append(row)
+        self.store.flush()
+        logger.info(f'Recorded round summary: {row}')
+
+    def on_analysis(self, result):
+        """ Called (on the main loop) with the result of the match history analysis. """
+        if result['should_shuffle']:
+            message = SHUFFLE_SUGGESTION_MESSAGE_TEMPLATE.format(num_rounds=result['num_rounds'],
+                                                                 score=result['recent_score'])
+            logger.info(message)
+            for admin_id in self.get_online_admin_ids():
+                self.squad_rcon_client.exec_command(f'AdminWarn "{admin_id}" {message}')
+
+    def get_online_admin_ids(self):
+        """ Returns the steam IDs of the admins on the server (as of the latest player snapshot). """
+        if self.clan_registry is None:
+            return []
+        admin_ids = []
+        for record in self.player_tracker.records.values():
+            clan = self.clan_registry.lookup_record(record)
+            if clan is not None and clan.is_admin:
+                admin_ids.append(record.player.steam_id)
+        return admin_ids
+
+    def on_analysis_error(self, error):
+        logger.error(f'Match history analysis failed: {error}')
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Records the previous round whenever the map changes. """
+        now = time.time()
+        if current_map != self.current_layer:
+            if self.current_layer is not None and self.round_started_at is not None and self.latest_composition:
+                self.record_round(self.current_layer, self.round_started_at, now, self.latest_composition)
+                # Import here so numpy is only loaded once there is something to analyze.
+                from matchhistory import analysis
+                self.run_in_worker(analysis.analyze_match_history, str(self.store.dirpath),
+                                   on_result=self.on_analysis, on_error=self.on_analysis_error)
+            # The very first layer we see was already running, so its start time is unknown.
+            self.round_started_at = now if self.current_layer is not None else None
+            self.current_layer = current_map
+        self.latest_composition = get_team_composition(self.player_tracker, self.clan_registry)
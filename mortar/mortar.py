@@ -0,0 +1,218 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A plugin that answers in-game mortar calculator requests (bearing and elevation between two grid references).
+#
+
+import collections
+import logging
+import math
+import re
+
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The chat command players use to ask for a firing solution, e.g. "!mortar C5-7-3 D6-1" or "!mortar C5-7 D6 hellcannon".
+MORTAR_COMMAND = '!mortar'
+
+# The size (in meters) of a major grid square on the Squad map. Each keypad level divides a square into 3x3.
+GRID_SQUARE_SIZE_M = 300.0
+
+# The (column, row from the top) offsets of each keypad number within its square (laid out like a numpad).
+KEYPAD_OFFSETS = {
+    7: (0, 0), 8: (1, 0), 9: (2, 0),
+    4: (0, 1), 5: (1, 1), 6: (2, 1),
+    1: (0, 2), 2: (1, 2), 3: (2, 2),
+}
+
+# Matches a grid reference like "C5", "C5-7", "C5-7-3", "c5k7k3" or "C5 7 3" (the keypads are optional). Chat commands
+# are split on whitespace, so the keypads of a spaced reference are joined back first (see join_keypad_arguments).
+GRID_REFERENCE_PATTERN = re.compile(r'^([a-z])(\d{1,2})((?:[-\s]*k?[1-9](?![0-9]))*)$', re.IGNORECASE)
+
+# Matches a command argument that is only a keypad number (e.g. the "7" in "C5 7 3"). Keypads with a "k" are not
+# matched, since e.g. "K7" is also a grid square.
+KEYPAD_ARGUMENT_PATTERN = re.compile(r'^-?[1-9]-?$')
+
+# The separation (in meters) between consecutive entries in the precomputed ballistic tables.
+TABLE_RESOLUTION_M = 0.25
+
+# The acceleration due to gravity (in m/s^2) used by the Squad projectile simulation.
+GRAVITY_MPS2 = 9.78
+
+# The number of milliradians in a full circle on Squad mortar sights (NATO mils).
+MILS_PER_CIRCLE = 6400.0
+
+# The ballistic properties of each mortar type (muzzle velocity in m/s, the minimum range in meters, and the unit the
+# elevation is displayed in on its sights).
+MortarType = collections.namedtuple('MortarType', ['velocity_mps', 'min_range_m', 'elevation_unit'])
+MORTAR_TYPES = {
+    'mortar': MortarType(velocity_mps=109.890938, min_range_m=50.0, elevation_unit='mil'),
+    'hellcannon': MortarType(velocity_mps=95.0, min_range_m=150.0, elevation_unit='deg'),
+}
+DEFAULT_MORTAR_TYPE = 'mortar'
+
+# The string to be formatted and sent to the player with the firing solution.
+FIRING_SOLUTION_MESSAGE_TEMPLATE = '{mortar_type}: bearing {bearing:.1f} deg, elevation {elevation}, range {range:.0f}m'
+# The string sent to the player when the command could not be understood.
+USAGE_MESSAGE = f'Usage: {MORTAR_COMMAND} <origin grid> <target grid> [{"|".join(MORTAR_TYPES)}], e.g. C5-7-3 D6-1'
+
+
+def join_keypad_arguments(arguments):
+    """
+    Returns the given command arguments with every keypad-only argument joined to the grid reference before it, e.g.
+    ['C5', '7', '3', 'D6'] becomes ['C5 7 3', 'D6'].
+    """
+    joined = []
+    for argument in arguments:
+        if joined and KEYPAD_ARGUMENT_PATTERN.match(argument):
+            joined[-1] = f'{joined[-1]} {argument}'
+        else:
+            joined.append(argument)
+    return joined
+
+
+def parse_grid_reference(grid_reference):
+    """
+    Returns the (x, y) position in meters of the center of the given grid reference, where x grows east from the left
+    edge of the map and y grows south from the top edge of the map. Raises ValueError if the reference is invalid.
+
+    :param grid_reference: str The grid reference, e.g. "C5-7-3" (column C, row 5, keypad 7, sub-keypad 3).
+    :return: tuple(float, float) The (x, y) position in meters.
+    """
+    match = GRID_REFERENCE_PATTERN.match(grid_reference.strip())
+    if not match or int(match.group(2)) < 1:
+        raise ValueError(f'Invalid grid reference {grid_reference}!')
+
+    column = ord(match.group(1).upper()) - ord('A')
+    row = int(match.group(2)) - 1
+    x = column * GRID_SQUARE_SIZE_M
+    y = row * GRID_SQUARE_SIZE_M
+    square_size = GRID_SQUARE_SIZE_M
+    for keypad in re.findall(r'[1-9]', match.group(3)):
+        square_size /= 3
+        keypad_column, keypad_row = KEYPAD_OFFSETS[int(keypad)]
+        x += keypad_column * square_size
+        y += keypad_row * square_size
+    return (x + square_size / 2, y + square_size / 2)
+
+
+def get_bearing_and_range(origin, target):
+    """ Returns the bearing (degrees clockwise from north) and the distance (meters) from the origin to the target. """
+    dx = target[0] - origin[0]
+    # North is towards the top of the map (y grows south).
+    dy_north = origin[1] - target[1]
+    return (math.degrees(math.atan2(dx, dy_north)) % 360.0, math.hypot(dx, dy_north))
+
+
+class BallisticTable:
+    """
+    A precomputed lookup table of the high-arc firing elevation for every range (on flat ground) of one mortar type.
+    Lookups interpolate the table instead of solving the ballistic equation, and accept whole arrays of ranges.
+    """
+
+    def __init__(self, mortar_type, resolution_m=TABLE_RESOLUTION_M):
+        # Imported here so numpy is only loaded once the first mortar command is answered (it is slow to import).
+        import numpy as np
+
+        self.mortar_type = mortar_type
+        self.min_range_m = mortar_type.min_range_m
+        self.max_range_m = mortar_type.velocity_mps ** 2 / GRAVITY_MPS2
+
+        # The high-arc solution of the projectile equation (for equal heights) is theta = (pi - asin(g x / v^2)) / 2.
+        self.ranges_m = np.append(np.arange(0.0, self.max_range_m, resolution_m), self.max_range_m)
+        ratios = np.clip(GRAVITY_MPS2 * self.ranges_m / mortar_type.velocity_mps ** 2, 0.0, 1.0)
+        elevations_rad = (np.pi - np.arcsin(ratios)) / 2
+        if mortar_type.elevation_unit == 'mil':
+            self.elevations = elevations_rad * MILS_PER_CIRCLE / (2 * np.pi)
+        else:
+            self.elevations = np.degrees(elevations_rad)
+
+    def lookup(self, ranges_m):
+        """
+        Returns the elevations for the given ranges (a scalar or an array). Ranges outside of the mortar's minimum and
+        maximum range have an elevation of NaN.
+        """
+        import numpy as np
+
+        ranges_m = np.asarray(ranges_m, dtype=float)
+        elevations = np.interp(ranges_m, self.ranges_m, self.elevations)
+        return np.where((ranges_m < self.min_range_m) | (ranges_m > self.max_range_m), np.nan, elevations)
+
+
+def format_elevation(elevation, elevation_unit):
+    """ Returns the elevation formatted the way it is shown on the sights of the mortar. """
+    if elevation_unit == 'mil':
+        return f'{elevation:.0f} mil'
+    return f'{elevation:.1f} deg'
+
+
+class MortarCalculator(plugin.Plugin):
+    """
+    A plugin that listens for the mortar command in chat and answers the player who asked with the bearing and elevation
+    from the origin grid reference to the target grid reference (as an admin warning so only they can see it).
+    """
+
+    def __init__(self, squad_rcon_client, worker_pool=None):
+        """
+        The constructor for MortarCalculator. The ballistic table of each mortar type is computed on first use.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.ballistic_tables = {}
+
+    def get_ballistic_table(self, mortar_type):
+        """ Returns the ballistic table of the given mortar type (computing it the first time). """
+        if mortar_type not in self.ballistic_tables:
+            self.ballistic_tables[mortar_type] = BallisticTable(MORTAR_TYPES[mortar_type])
+        return self.ballistic_tables[mortar_type]
+
+    def get_firing_solution_message(self, message):
+        """
+        Returns the message to send to a player that typed the given mortar command (either the firing solution, or an
+        explanation of what went wrong).
+        """
+        arguments = message.strip()[len(MORTAR_COMMAND):].split()
+        mortar_type = DEFAULT_MORTAR_TYPE
+        if arguments and arguments[-1].lower() in MORTAR_TYPES:
+            mortar_type = arguments.pop().lower()
+        arguments = join_keypad_arguments(arguments)
+        if len(arguments) != 2:
+            return USAGE_MESSAGE
+
+        try:
+            origin = parse_grid_reference(arguments[0])
+            target = parse_grid_reference(arguments[1])
+        except ValueError:
+            return USAGE_MESSAGE
+
+        bearing, target_range = get_bearing_and_range(origin, target)
+        table = self.get_ballistic_table(mortar_type)
+        elevation = float(table.lookup(target_range))
+        if math.isnan(elevation):
+            return (f'Target is out of range for the {mortar_type} ({target_range:.0f}m, must be between '
+                    f'{table.min_range_m:.0f}m and {table.max_range_m:.0f}m).')
+
+        return FIRING_SOLUTION_MESSAGE_TEMPLATE.format(
+            mortar_type=mortar_type, bearing=bearing,
+            elevation=format_elevation(elevation, MORTAR_TYPES[mortar_type].elevation_unit), range=target_range)
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Answers every mortar command found in the recent player chat. """
+        for player_id, player_chat in recent_player_chat.items():
+            for message in player_chat.messages:
+                if message.strip().lower().startswith(MORTAR_COMMAND):
+                    response = self.get_firing_solution_message(message)
+                    logger.debug(f'Answering mortar request "{message}" from player {player_id} with: {response}')
+                    self.squad_rcon_client.exec_command(f'AdminWarn "{player_id}" {response}')
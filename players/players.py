@@ -0,0 +1,118 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Helpers to get the list of players on a Squad server through RCON.
+#
+
+import collections
+import logging
+import re
+import time
+
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The team IDs used by Squad.
+TEAM_IDS = (1, 2)
+
+# Matches an active player line in the output of the ListPlayers command, e.g.:
+# ID: 3 | SteamID: 76561198000000000 | Name: [FP] player | Team ID: 1 | Squad ID: N/A
+# (Recently disconnected players have no Team ID, so they are not matched).
+ACTIVE_PLAYER_PATTERN = re.compile(
+    r'^ID: (\d+) \| SteamID: (\d+) \| Name: (.*?) \| Team ID: (\d+) \| Squad ID: ([^|\s]+)', re.MULTILINE)
+
+# A player on the server. The squad_id is None if the player is not in a squad.
+Player = collections.namedtuple('Player', ['player_id', 'steam_id', 'name', 'team_id', 'squad_id'])
+
+
+def parse_list_players(response):
+    """
+    Returns the active players in the given response to the ListPlayers command.
+
+    :param response: str The response of the ListPlayers command.
+    :return: list(Player) The active players (recently disconnected players are not included).
+    """
+    return [Player(int(player_id), steam_id, name, int(team_id), None if squad_id == 'N/A' else int(squad_id))
+            for player_id, steam_id, name, team_id, squad_id in ACTIVE_PLAYER_PATTERN.findall(response or '')]
+
+
+def list_players(squad_rcon_client):
+    """ Sends the ListPlayers command and returns the list of active players. """
+    return parse_list_players(squad_rcon_client.exec_command('ListPlayers'))
+
+
+class PlayerRecord:
+    """ What the bot knows about a player currently on the server. Plugins can cache per-player results on it. """
+
+    def __init__(self, player, joined_at):
+        # The latest Player info from ListPlayers.
+        self.player = player
+        # The time (since the epoch) the player was first seen on the server.
+        self.joined_at = joined_at
+        # The player's Clan (see clantag), cached the first time it is looked up.
+        self.clan = None
+        self.clan_checked = False
+
+
+class PlayerTracker(plugin.Plugin):
+    """
+    A plugin that takes one ListPlayers snapshot per tick and keeps a record of every player on the server. Run it
+    before the other plugins, which can then use its snapshot (instead of sending their own ListPlayers) and its list
+    of players that joined since the previous tick.
+    """
+
+    def __init__(self, squad_rcon_client, worker_pool=None):
+        """
+        The constructor for PlayerTracker.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        # The records of the players on the server (keyed by steam_id), as of the latest snapshot.
+        self.records = {}
+        # The records of the players that joined since the previous snapshot.
+        self.joined = []
+        # The time (since the epoch) of the latest snapshot (None before the first one).
+        self.snapshot_time = None
+
+    def get_num_players(self):
+        """ Returns the number of players on the server as of the latest snapshot. """
+        return len(self.records)
+
+    def update(self, active_players, now=None):
+        """
+        Updates the records with a new snapshot of the active players. The players in the very first snapshot are not
+        counted as joining (they were already on the server when the bot started).
+        """
+        now = now if now is not None else time.time()
+        is_first_snapshot = self.snapshot_time is None
+        records = {}
+        self.joined = []
+        for player in active_players:
+            record = self.records.get(player.steam_id)
+            if record is None:
+                record = PlayerRecord(player, now)
+                if not is_first_snapshot:
+                    self.joined.append(record)
+            else:
+                record.player = player
+            records[player.steam_id] = record
+        self.records = records
+        self.snapshot_time = now
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Takes a new snapshot of the players on the server. """
+        self.update(list_players(self.squad_rcon_client))
+        if self.joined:
+            logger.debug(f'Players joined: {[record.player.name for record in self.joined]}')
@@ -0,0 +1,204 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Sends bursts of RCON commands concurrently (over several connections) with a rate limit.
+#
+
+import contextlib
+from concurrent import futures
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The default number of RCON connections used to send a burst of commands (including the main connection).
+DEFAULT_NUM_CONNECTIONS = 8
+
+# The default maximum number of commands per second sent to the server (across all connections).
+DEFAULT_MAX_COMMANDS_PER_S = 50.0
+
+# How long to wait (in seconds) before trying to open extra connections again after opening one failed.
+DEFAULT_REOPEN_INTERVAL_S = 60.0
+
+# Bursts with fewer commands than this are sent over the main connection only (not worth opening extra connections).
+DEFAULT_MIN_BURST_SIZE = 4
+
+# How long (in seconds) the extra connections are kept open after the last burst that used them.
+DEFAULT_IDLE_TIMEOUT_S = 5.0 * 60
+
+
+class RateLimiter:
+    """ A thread-safe token bucket that allows up to max_per_s acquisitions per second (with bursts up to burst). """
+
+    def __init__(self, max_per_s, burst=None):
+        self.max_per_s = max_per_s
+        self.burst = burst if burst is not None else max(1.0, max_per_s)
+        self.tokens = self.burst
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a token is available, then takes it. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.max_per_s)
+                self.last_refill = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait_s = (1.0 - self.tokens) / self.max_per_s
+            time.sleep(wait_s)
+
+
+class CommandDispatcher:
+    """
+    Sends a burst of RCON commands over several connections at once, so a burst of N commands takes about
+    N / num_connections round trips instead of N. Each connection is only used by one thread at a time. Small bursts
+    (under min_burst_size commands) only use the main connection. The extra connections are opened by the first large
+    burst, and closed by close_idle_clients() (call it once per tick) once no burst used them for idle_timeout_s. An
+    extra connection that fails a command is closed and dropped (the rest of the burst goes over the other
+    connections), and is reopened on a later burst. The connection factory should give each connection a deadline
+    (see healthcheck.DeadlineClient), so a hung connection fails instead of blocking the burst forever.
+    """
+
+    def __init__(self, squad_rcon_client, connection_factory=None, num_connections=DEFAULT_NUM_CONNECTIONS,
+                 max_commands_per_s=DEFAULT_MAX_COMMANDS_PER_S, reopen_interval_s=DEFAULT_REOPEN_INTERVAL_S,
+                 min_burst_size=DEFAULT_MIN_BURST_SIZE, idle_timeout_s=DEFAULT_IDLE_TIMEOUT_S):
+        """
+        The constructor for CommandDispatcher.
+
+        :param squad_rcon_client: RconConnection The main handle to the rcon client (always used).
+        :param connection_factory: callable Returns a context manager that opens a new RconConnection. None means only
+                                   the main connection is used.
+        :param num_connections: int The most connections to use (including the main connection).
+        :param max_commands_per_s: float The most commands per second sent to the server (across all connections).
+        :param reopen_interval_s: float How long to wait before opening extra connections again after a failed open.
+        :param min_burst_size: int The fewest commands in a burst for it to use the extra connections.
+        :param idle_timeout_s: float How long to keep the extra connections open after the last burst that used them.
+        """
+        self.squad_rcon_client = squad_rcon_client
+        self.connection_factory = connection_factory
+        self.num_connections = num_connections if connection_factory else 1
+        self.rate_limiter = RateLimiter(max_commands_per_s)
+        self.reopen_interval_s = reopen_interval_s
+        self.min_burst_size = min_burst_size
+        self.idle_timeout_s = idle_timeout_s
+
+        # The time (monotonic) of the latest burst that used the extra connections.
+        self.last_burst_time = 0.0
+        # The extra connections that are open, as (client, exit_stack) tuples (the stack closes the connection).
+        self.extra_clients = []
+        # The earliest time (monotonic) to try opening extra connections again.
+        self.next_open_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open_extra_clients(self, num_extra_clients):
+        """ Opens extra connections up to the given number (unless opening one failed recently). """
+        if len(self.extra_clients) >= num_extra_clients or time.monotonic() < self.next_open_time:
+            return
+        while len(self.extra_clients) < num_extra_clients:
+            exit_stack = contextlib.ExitStack()
+            try:
+                client = exit_stack.enter_context(self.connection_factory())
+            except Exception as e:
+                exit_stack.close()
+                logger.warning(f'Could not open an extra RCON connection for dispatching commands: {e}')
+                self.next_open_time = time.monotonic() + self.reopen_interval_s
+                return
+            self.extra_clients.append((client, exit_stack))
+
+    def get_clients(self, num_commands):
+        """ Returns the connections to use for a burst of the given size (opens the missing extra ones). """
+        if not self.connection_factory or num_commands < self.min_burst_size:
+            return [self.squad_rcon_client]
+        self.last_burst_time = time.monotonic()
+        num_extra_clients = min(self.num_connections, num_commands) - 1
+        self.open_extra_clients(num_extra_clients)
+        return [self.squad_rcon_client] + [client for client, _ in self.extra_clients[:num_extra_clients]]
+
+    def close_idle_clients(self):
+        """ Closes the extra connections if no burst used them for idle_timeout_s. """
+        if self.extra_clients and time.monotonic() - self.last_burst_time > self.idle_timeout_s:
+            logger.info(f'Closing {len(self.extra_clients)} idle extra RCON connections.')
+            self.close()
+
+    def drop_client(self, client):
+        """ Closes the given extra connection and stops using it (it is replaced on a later burst). """
+        for index, (extra_client, exit_stack) in enumerate(self.extra_clients):
+            if extra_client is client:
+                del self.extra_clients[index]
+                try:
+                    exit_stack.close()
+                except Exception as e:
+                    logger.warning(f'Failed to close a dropped RCON connection: {e}')
+                return
+
+    def close(self):
+        """ Closes the extra connections. """
+        while self.extra_clients:
+            self.drop_client(self.extra_clients[0][0])
+
+    def send_all(self, client, pending_commands, results, failed_clients):
+        """
+        Sends commands from the shared queue over the given client until the queue is empty. An extra client stops at
+        its first failure (and is added to failed_clients), leaving the rest of the commands to the other clients.
+        """
+        while True:
+            try:
+                index, command = pending_commands.get_nowait()
+            except queue.Empty:
+                return
+            self.rate_limiter.acquire()
+            try:
+                results[index] = client.exec_command(command)
+            except Exception as e:
+                logger.error(f'Failed to send command {command}: {e}')
+                results[index] = e
+                if client is not self.squad_rcon_client:
+                    failed_clients.append(client)
+                    return
+
+    def dispatch(self, commands):
+        """
+        Sends all the given commands (blocks until all of them are answered).
+
+        :param commands: list(str) The commands to send. They may be sent in any order.
+        :return: list The response to each command (in the same order as the commands), or the exception it raised.
+        """
+        if not commands:
+            return []
+        pending_commands = queue.Queue()
+        for index, command in enumerate(commands):
+            pending_commands.put((index, command))
+        results = [None] * len(commands)
+
+        clients = self.get_clients(len(commands))
+        failed_clients = []
+        if len(clients) == 1:
+            self.send_all(clients[0], pending_commands, results, failed_clients)
+            return results
+        with futures.ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            for client in clients:
+                executor.submit(self.send_all, client, pending_commands, results, failed_clients)
+        # The main client never stops early, so the commands the failed clients left in the queue were still sent.
+        for client in failed_clients:
+            logger.warning('Dropping an extra RCON connection that failed a command.')
+            self.drop_client(client)
+        return results
@@ -0,0 +1,70 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# The base class that all Squad RCON bot plugins implement.
+#
+
+import abc
+import logging
+
+from plugin import workerpool
+
+logger = logging.getLogger(__name__)
+
+
+class Plugin(abc.ABC):
+    """
+    Base class for all the plugins run by the rconbot. The bot calls run_once() on every plugin once per tick, so
+    run_once() must return quickly. Any heavy work should be handed to run_in_worker() so it runs in the worker pool
+    and its result is delivered back to the main loop on a later tick.
+    """
+
+    def __init__(self, squad_rcon_client, worker_pool=None):
+        """
+        The constructor for Plugin.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param worker_pool: WorkerPool The pool to run heavy work in. If None, heavy work is run inline (blocking).
+        """
+        # This stores the handle to the squad_rcon_client (so we can contact the squad server).
+        self.squad_rcon_client = squad_rcon_client
+
+        # The pool that heavy work is offloaded to (None means run it inline).
+        self.worker_pool = worker_pool
+
+    def run_in_worker(self, fn, *args, deadline_s=workerpool.DEFAULT_TASK_DEADLINE_S, on_result=None, on_error=None,
+                      **kwargs):
+        """
+        Run fn(*args, **kwargs) in the worker pool. The on_result (or on_error) callback is called from the main loop
+        once the work is done (or fails or misses its deadline). If this plugin has no worker pool, the work is run
+        inline and the callback is called before this returns.
+
+        :return: WorkerTask The handle to the submitted task, or None if the work was run inline.
+        """
+        if self.worker_pool is not None:
+            return self.worker_pool.submit(fn, *args, deadline_s=deadline_s, on_result=on_result, on_error=on_error,
+                                           **kwargs)
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            workerpool.deliver(on_error, e)
+        else:
+            workerpool.deliver(on_result, result)
+        return None
+
+    @abc.abstractmethod
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """
+        Runs the plugin logic once. Called by the rconbot once per tick with the current and next maps and the player
+        chat received since the previous tick.
+        """
@@ -0,0 +1,135 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A hashed timer wheel that plugins use to schedule (many) recurring events at O(1) cost per tick.
+#
+
+import math
+import time
+
+# The default duration (in seconds) of one tick of the wheel, i.e. the resolution of the timers.
+DEFAULT_TICK_S = 1.0
+# The default number of slots in the wheel. Timers further out than one turn of the wheel wait extra rounds.
+DEFAULT_NUM_SLOTS = 512
+
+
+class Timer:
+    """ A handle to a scheduled timer (returned by TimerWheel.schedule and used to cancel it). """
+    __slots__ = ['payload', 'interval_ticks', 'rounds', 'cancelled']
+
+    def __init__(self, payload, interval_ticks):
+        # What advance() returns when the timer fires.
+        self.payload = payload
+        # How many ticks between firings (None for a one-shot timer).
+        self.interval_ticks = interval_ticks
+        # How many more turns of the wheel to wait before firing when the wheel reaches this timer's slot.
+        self.rounds = 0
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    A hashed timer wheel: each timer sits in the slot of the tick it fires on (modulo the number of slots), so
+    scheduling and cancelling are O(1), and each tick only visits the timers of a single slot (O(1) on average when
+    the timers are spread over the slots). The wheel is driven by calling advance() (e.g. once per bot tick), which
+    catches up on all the ticks that passed since the previous call.
+    """
+
+    def __init__(self, tick_s=DEFAULT_TICK_S, num_slots=DEFAULT_NUM_SLOTS, clock=time.monotonic):
+        """
+        The constructor for TimerWheel.
+
+        :param tick_s: float The duration (in seconds) of one tick, i.e. the resolution of the timers.
+        :param num_slots: int The number of slots in the wheel.
+        :param clock: callable Returns the current time in seconds. Defaults to a monotonic clock, so changes to the
+                      system time do not fire or delay the timers.
+        """
+        self.tick_s = tick_s
+        self.slots = [[] for _ in range(num_slots)]
+        self.clock = clock
+
+        # The time of tick 0, and the latest tick the wheel processed.
+        self.start_time = clock()
+        self.current_tick = 0
+        # The number of scheduled (not cancelled) timers.
+        self.num_timers = 0
+
+    def __len__(self):
+        return self.num_timers
+
+    def get_ticks(self, duration_s):
+        """ Returns the number of ticks (at least one) that covers the given duration. """
+        return max(int(math.ceil(duration_s / self.tick_s)), 1)
+
+    def add(self, timer, delay_ticks):
+        target_tick = self.current_tick + delay_ticks
+        timer.rounds = (delay_ticks - 1) // len(self.slots)
+        self.slots[target_tick % len(self.slots)].append(timer)
+
+    def schedule(self, payload, delay_s, interval_s=None):
+        """
+        Schedules a timer that fires once after the given delay, and then every interval (if given).
+
+        :param payload: object What advance() returns when the timer fires.
+        :param delay_s: float The delay (in seconds) before the first firing (rounded up to whole ticks).
+        :param interval_s: float The interval (in seconds) between firings, or None for a one-shot timer.
+        :return: Timer The handle to the timer (to cancel it).
+        """
+        timer = Timer(payload, self.get_ticks(interval_s) if interval_s is not None else None)
+        self.add(timer, self.get_ticks(delay_s))
+        self.num_timers += 1
+        return timer
+
+    def cancel(self, timer):
+        """ Cancels the given timer (it is dropped from its slot the next time the wheel reaches it). """
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.num_timers -= 1
+
+    def advance(self, now=None):
+        """
+        Processes every tick up to the given time, and returns the payloads of the timers that fired (in order).
+        Recurring timers are rescheduled. A timer fires at most once per call even if the wheel fell behind by more
+        than its interval (e.g. after the bot stalled), so a backlog of firings is never replayed.
+
+        :param now: float The current time (as returned by the clock). Defaults to the clock.
+        :return: list(object) The payloads of the timers that fired.
+        """
+        now = now if now is not None else self.clock()
+        latest_tick = int((now - self.start_time) / self.tick_s)
+        fired = []
+        rescheduled = []
+        while self.current_tick < latest_tick:
+            self.current_tick += 1
+            slot_index = self.current_tick % len(self.slots)
+            remaining = []
+            for timer in self.slots[slot_index]:
+                if timer.cancelled:
+                    continue
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                    remaining.append(timer)
+                    continue
+                fired.append(timer.payload)
+                if timer.interval_ticks is None:
+                    self.num_timers -= 1
+                else:
+                    rescheduled.append((timer, self.current_tick + timer.interval_ticks))
+            self.slots[slot_index] = remaining
+        # Reschedule after catching up. Firings that were missed while the wheel was behind are skipped (keeping each
+        # timer's phase), so a late wheel does not fire the same timer several times in a row.
+        for timer, next_tick in rescheduled:
+            if next_tick <= self.current_tick:
+                num_missed = (self.current_tick - next_tick) // timer.interval_ticks + 1
+                next_tick += num_missed * timer.interval_ticks
+            self.add(timer, next_tick - self.current_tick)
+        return fired
@@ -0,0 +1,208 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A pool of workers that plugins use to run heavy work off of the main RCON loop.
+#
+
+from concurrent import futures
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The supported worker modes. Threads are cheap but share the GIL, processes are for pure CPU-bound work (the work
+# function and its arguments must be picklable).
+THREAD_MODE = 'thread'
+PROCESS_MODE = 'process'
+WORKER_MODES = [THREAD_MODE, PROCESS_MODE]
+
+# The default number of workers in the pool.
+DEFAULT_MAX_WORKERS = 4
+
+# The default duration (in seconds) a task is allowed to take before it is cancelled.
+DEFAULT_TASK_DEADLINE_S = 5.0
+
+
+class TaskDeadlineExceeded(Exception):
+    """ Raised (passed to the on_error callback) when a task did not finish before its deadline. """
+
+
+class WorkerPoolSaturated(Exception):
+    """
+    Raised (passed to the on_error callback) when a task is refused because every worker is still busy with a task
+    that was cancelled but could not be interrupted (so the task would never run).
+    """
+
+
+def deliver(callback, value):
+    """ Helper that calls the given callback with the given value (if there is a callback), and logs any errors. """
+    if callback is None:
+        return
+    try:
+        callback(value)
+    except Exception as e:
+        logger.error(f'Worker task callback {callback} failed with error: {e}')
+
+
+class WorkerTask:
+    """ A handle to a single piece of work submitted to the WorkerPool. """
+
+    def __init__(self, task_id, future, deadline, on_result, on_error, cancel_event):
+        self.task_id = task_id
+        self.future = future
+        # The time (from time.monotonic()) after which this task is cancelled. None means no deadline.
+        self.deadline = deadline
+        self.on_result = on_result
+        self.on_error = on_error
+        # Set when the task is cancelled. Thread tasks that accept a cancel_event can check it to stop early.
+        self.cancel_event = cancel_event
+
+    def is_overdue(self, now):
+        """ Returns True if the task is past its deadline and False otherwise. """
+        return self.deadline is not None and now > self.deadline
+
+    def cancel(self):
+        """
+        Cancels the task. A task that has not started will never run. A task that is already running cannot be
+        interrupted, but its result will be thrown away (and thread tasks can check cancel_event to stop early). Until
+        it stops, it keeps its worker busy (see WorkerPool.get_num_abandoned_tasks).
+        """
+        self.cancel_event.set()
+        self.future.cancel()
+
+
+class WorkerPool:
+    """
+    Runs work in a thread or process pool and delivers the results back to the main loop. Submit work with submit(),
+    and call poll() from the main loop (once per tick) to run the callbacks of finished tasks and to cancel tasks
+    that missed their deadlines. Callbacks are only ever called from poll(), so plugins never need locks.
+    """
+
+    def __init__(self, mode=THREAD_MODE, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        The constructor for WorkerPool.
+
+        :param mode: str One of WORKER_MODES.
+        :param max_workers: int The number of threads or processes in the pool.
+        """
+        if mode == THREAD_MODE:
+            self.executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        elif mode == PROCESS_MODE:
+            self.executor = futures.ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f'Invalid worker mode {mode}! Must be one of {WORKER_MODES}.')
+        self.mode = mode
+        self.max_workers = max_workers
+
+        # The tasks that have been submitted but whose results have not been delivered yet (keyed by task_id).
+        self.pending_tasks = {}
+        # The tasks that were cancelled while already running, and still hold on to their worker.
+        self.abandoned_tasks = []
+        self._task_ids = itertools.count()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, fn, *args, deadline_s=DEFAULT_TASK_DEADLINE_S, on_result=None, on_error=None,
+               cancellable=False, **kwargs):
+        """
+        Submits fn(*args, **kwargs) to run in the pool.
+
+        :param deadline_s: float How long (in seconds) the task may take before it is cancelled. None means forever.
+        :param on_result: callable Called with the return value of fn once it finishes.
+        :param on_error: callable Called with the exception if fn raises, is cancelled, or misses its deadline.
+        :param cancellable: bool If True, fn is also given a cancel_event keyword argument (a threading.Event) that is
+                            set when the task is cancelled. Only supported in thread mode.
+        :return: WorkerTask The handle to the submitted task. If every worker is still busy with an abandoned task (see
+                 get_num_abandoned_tasks), the task is refused and a WorkerPoolSaturated error is delivered to on_error
+                 on the next poll().
+        """
+        cancel_event = threading.Event()
+        if cancellable:
+            if self.mode != THREAD_MODE:
+                raise ValueError('Cancellable tasks are only supported in thread mode!')
+            kwargs['cancel_event'] = cancel_event
+
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+        task_id = next(self._task_ids)
+        num_abandoned_tasks = self.get_num_abandoned_tasks()
+        if num_abandoned_tasks >= self.max_workers:
+            logger.warning(f'Refusing worker task {task_id}: all {num_abandoned_tasks} workers are stuck on cancelled '
+                           'tasks.')
+            future = futures.Future()
+            future.set_exception(WorkerPoolSaturated(
+                f'Task {task_id} was refused because all workers are stuck on cancelled tasks.'))
+        else:
+            future = self.executor.submit(fn, *args, **kwargs)
+        task = WorkerTask(task_id, future, deadline, on_result, on_error, cancel_event)
+        self.pending_tasks[task.task_id] = task
+        return task
+
+    def get_num_abandoned_tasks(self):
+        """ Returns the number of cancelled tasks that are still running (and holding on to a worker). """
+        self.abandoned_tasks = [task for task in self.abandoned_tasks if not task.future.done()]
+        return len(self.abandoned_tasks)
+
+    def abandon(self, task):
+        """ Cancels the given task, and keeps track of it if it was already running (it keeps its worker busy). """
+        task.cancel()
+        if not task.future.done():
+            self.abandoned_tasks.append(task)
+
+    def cancel(self, task):
+        """ Cancels the given task and delivers a CancelledError to its on_error callback. """
+        if self.pending_tasks.pop(task.task_id, None) is None:
+            return
+        self.abandon(task)
+        deliver(task.on_error, futures.CancelledError(f'Task {task.task_id} was cancelled.'))
+
+    def cancel_all(self):
+        """ Cancels all pending tasks. """
+        for task in list(self.pending_tasks.values()):
+            self.cancel(task)
+
+    def poll(self):
+        """
+        Delivers the results of all finished tasks and cancels all tasks that missed their deadline. This never
+        blocks, and should be called from the main loop.
+
+        :return: int The number of tasks that were delivered (finished, failed, or cancelled).
+        """
+        now = time.monotonic()
+        num_delivered = 0
+        for task_id, task in list(self.pending_tasks.items()):
+            if task.future.done():
+                del self.pending_tasks[task_id]
+                num_delivered += 1
+                if task.future.cancelled():
+                    deliver(task.on_error, futures.CancelledError(f'Task {task_id} was cancelled.'))
+                elif task.future.exception() is not None:
+                    deliver(task.on_error, task.future.exception())
+                else:
+                    deliver(task.on_result, task.future.result())
+            elif task.is_overdue(now):
+                del self.pending_tasks[task_id]
+                num_delivered += 1
+                self.abandon(task)
+                logger.warning(f'Worker task {task_id} missed its deadline and was cancelled.')
+                deliver(task.on_error, TaskDeadlineExceeded(f'Task {task_id} missed its deadline.'))
+        return num_delivered
+
+    def shutdown(self):
+        """ Cancels all pending tasks and shuts down the pool without waiting for running tasks. """
+        self.cancel_all()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,319 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A general in-game poll engine (used by the poll plugin and the map voter).
+#
+
+import logging
+import re
+import string
+import time
+
+from columnar import columnar
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The chat command used to start a poll, e.g. "!poll Should we play more invasion? | yes | no".
+POLL_COMMAND = '!poll'
+
+# The separator between the question and the options in the poll command.
+POLL_OPTION_SEPARATOR = '|'
+
+# How long each poll stays open (in seconds).
+DEFAULT_POLL_DURATION_S = 120.0
+
+# Players with at least this many hours played on the server are considered regulars.
+REGULAR_HOURS_THRESHOLD = 50.0
+
+# The segments players are sliced into when looking at poll results.
+REGULAR_SEGMENT = 'regular'
+RANDOM_SEGMENT = 'random'
+
+# The ids given to concurrent polls (a poll's id is freed up once it closes).
+POLL_IDS = string.ascii_uppercase
+
+# Matches a ballot for a specific poll, e.g. "B 2" or "b2".
+POLL_BALLOT_PATTERN = re.compile(r'^\s*([a-z])\s*(\d+)\s*$', re.IGNORECASE)
+
+# Matches the last word of a message (a bare ballot when only one poll is open uses the last word, like map votes).
+LAST_WORD_PATTERN = re.compile(r'\w+$')
+
+# The strings to be formatted and sent to the server when a poll starts and ends.
+POLL_STARTED_MESSAGE_TEMPLATE = 'Poll {poll_id}: {question}\n{options}\nVote by typing "{poll_id} <number>" in AllChat.'
+POLL_RESULTS_MESSAGE_TEMPLATE = 'Poll {poll_id} results: {question}\n{results}'
+
+# The schema of the columnar store of poll ballots (one row per ballot).
+POLL_STORE_SCHEMA = [
+    ('poll_started_at', 'd'),
+    ('question', columnar.STRING_TYPE),
+    ('option_index', 'i'),
+    ('option', columnar.STRING_TYPE),
+    ('player_id', columnar.STRING_TYPE),
+    ('segment', columnar.STRING_TYPE),
+    ('hours_played', 'd'),
+    ('timestamp', 'd'),
+]
+
+
+def get_segment_by_hours_played(metadata):
+    """ The default segmenter: players with at least REGULAR_HOURS_THRESHOLD hours played are regulars. """
+    return REGULAR_SEGMENT if metadata.get('hours_played', 0.0) >= REGULAR_HOURS_THRESHOLD else RANDOM_SEGMENT
+
+
+class PlayerMetadataIndex:
+    """
+    An in-memory index of metadata about players (e.g. hours played), and the segment each player belongs to. The
+    segment of each player is computed once when their metadata changes, so looking it up per ballot is a dict lookup.
+    The metadata of a player is loaded with the loader (if there is one) the first time it is needed, and again after
+    expire_loaded() is called (PollEngine calls it at the start of every poll, so e.g. hours played stay up to date).
+    """
+
+    def __init__(self, segmenter=get_segment_by_hours_played, loader=None):
+        """
+        The constructor for PlayerMetadataIndex.
+
+        :param segmenter: callable Returns the segment (str) of a player given their metadata (dict).
+        :param loader: callable Returns the metadata (dict) of the given player_id (e.g. their hours played from the
+                       HoursStore). None means unknown players have empty metadata.
+        """
+        self.segmenter = segmenter
+        self.loader = loader
+        self.metadata = {}
+        self.segments = {}
+        # The players whose metadata was loaded with the loader (and has not expired since).
+        self.loaded_player_ids = set()
+
+    def load(self, player_id):
+        """ Loads the metadata of the given player with the loader, unless it was already loaded (and not expired). """
+        if self.loader is not None and player_id not in self.loaded_player_ids:
+            self.update(player_id, **self.loader(player_id))
+            self.loaded_player_ids.add(player_id)
+
+    def expire_loaded(self):
+        """ Makes the metadata of every player be loaded again the next time it is needed. """
+        self.loaded_player_ids.clear()
+
+    def update(self, player_id, **metadata):
+        """ Updates the metadata of the given player (the given keys are updated and the rest are kept). """
+        player_metadata = self.metadata.setdefault(player_id, {})
+        player_metadata.update(metadata)
+        self.segments[player_id] = self.segmenter(player_metadata)
+
+    def get(self, player_id):
+        """ Returns the metadata of the given player (empty if unknown). """
+        self.load(player_id)
+        return self.metadata.get(player_id, {})
+
+    def get_segment(self, player_id):
+        """ Returns the segment of the given player. Unknown players are in the segment of empty metadata. """
+        self.load(player_id)
+        segment = self.segments.get(player_id)
+        return segment if segment is not None else self.segmenter({})
+
+
+class Poll:
+    """
+    A single poll (question and options). Ballots are aggregated as they stream in: the counts per option (overall and
+    per player segment) are updated on every ballot, so results never rescan the ballots. Each player only has one
+    ballot, so a newer ballot replaces their previous one.
+    """
+
+    def __init__(self, question, options, metadata_index=None, poll_id=None, started_at=None):
+        """
+        The constructor for Poll.
+
+        :param question: str The question being asked.
+        :param options: list(str) The options players can vote for (by index).
+        :param metadata_index: PlayerMetadataIndex The player metadata used to slice the results by segment.
+        :param poll_id: str The short id players use to vote in this poll when several polls are open.
+        :param started_at: float The time (since the epoch) the poll started. Defaults to now.
+        """
+        self.question = question
+        self.options = options
+        self.metadata_index = metadata_index if metadata_index is not None else PlayerMetadataIndex()
+        self.poll_id = poll_id
+        self.started_at = started_at if started_at is not None else time.time()
+
+        # The latest ballot of each player: player_id -> (option_index, segment, timestamp).
+        self.ballots = {}
+        # The vote count of each option, overall and per segment.
+        self.counts = [0] * len(options)
+        self.segment_counts = {}
+        # The order in which options first received a vote (used to break ties).
+        self.first_vote_order = {}
+
+    def add_ballot(self, player_id, option_index, timestamp=None):
+        """
+        Adds (or replaces) the ballot of the given player.
+
+        :return: bool True if the ballot was valid (and counted), and False otherwise.
+        """
+        if not 0 <= option_index < len(self.options):
+            return False
+
+        previous_ballot = self.ballots.get(player_id)
+        if previous_ballot is not None:
+            previous_option_index, previous_segment, _ = previous_ballot
+            self.counts[previous_option_index] -= 1
+            self.segment_counts[previous_segment][previous_option_index] -= 1
+
+        segment = self.metadata_index.get_segment(player_id)
+        self.ballots[player_id] = (option_index, segment, timestamp if timestamp is not None else time.time())
+        self.counts[option_index] += 1
+        self.segment_counts.setdefault(segment, [0] * len(self.options))[option_index] += 1
+        self.first_vote_order.setdefault(option_index, len(self.first_vote_order))
+        return True
+
+    def get_counts(self, segment=None):
+        """ Returns the vote count of each option, either overall or for the given segment only. """
+        if segment is None:
+            return list(self.counts)
+        return list(self.segment_counts.get(segment, [0] * len(self.options)))
+
+    def get_winner(self):
+        """
+        Returns the winning option and its vote count, or None if there are no votes. Ties are broken by choosing the
+        option that received a vote first.
+        """
+        voted_options = [index for index, count in enumerate(self.counts) if count > 0]
+        if not voted_options:
+            return None
+        winner_index = min(voted_options, key=lambda index: (-self.counts[index], self.first_vote_order[index]))
+        return (self.options[winner_index], self.counts[winner_index])
+
+    def format_results(self):
+        """ Returns a formatted string of the results (overall and per segment) to be displayed to players in chat. """
+        lines = []
+        for index, option in enumerate(self.options):
+            segment_results = ', '.join(f'{segment}: {counts[index]}'
+                                        for segment, counts in sorted(self.segment_counts.items()))
+            lines.append(f'{index}) {option}: {self.counts[index]}' +
+                         (f' ({segment_results})' if segment_results else ''))
+        return '\n'.join(lines)
+
+    def get_rows(self):
+        """ Returns one row (dict) per ballot, in the format of POLL_STORE_SCHEMA. """
+        for player_id, (option_index, segment, timestamp) in self.ballots.items():
+            yield {
+                'poll_started_at': self.started_at,
+                'question': self.question,
+                'option_index': option_index,
+                'option': self.options[option_index],
+                'player_id': player_id,
+                'segment': segment,
+                'hours_played': float(self.metadata_index.get(player_id).get('hours_played', 0.0)),
+                'timestamp': timestamp,
+            }
+
+
+def parse_poll_command(message):
+    """
+    Returns the (question, options) given in the poll command message, or None if the command is invalid (it needs a
+    question and at least two options).
+    """
+    fields = [field.strip() for field in message.strip()[len(POLL_COMMAND):].split(POLL_OPTION_SEPARATOR)]
+    if len(fields) < 3 or not all(fields):
+        return None
+    return (fields[0], fields[1:])
+
+
+class PollEngine(plugin.Plugin):
+    """
+    A plugin that runs several concurrent in-game polls. Allowed players start polls with POLL_COMMAND, and everyone
+    votes in chat. When a poll closes, its results are broadcast (sliced by player segment) and its ballots are
+    appended to the columnar store for later analysis.
+    """
+
+    def __init__(self, squad_rcon_client, can_start_polls, store=None, metadata_index=None,
+                 poll_duration_s=DEFAULT_POLL_DURATION_S, worker_pool=None):
+        """
+        The constructor for PollEngine.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param can_start_polls: callable Returns True if the player (given player_id and player_name) can start polls.
+        :param store: ColumnarStore Where the ballots of closed polls are stored (with POLL_STORE_SCHEMA). None means
+                      they are not stored.
+        :param metadata_index: PlayerMetadataIndex The player metadata used to slice the results.
+        :param poll_duration_s: float How long each poll stays open (in seconds).
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.can_start_polls = can_start_polls
+        self.store = store
+        self.metadata_index = metadata_index if metadata_index is not None else PlayerMetadataIndex()
+        self.poll_duration_s = poll_duration_s
+
+        # The open polls keyed by poll_id (in the order they were started).
+        self.polls = {}
+
+    def start_poll(self, question, options):
+        """ Starts a new poll and announces it. Returns the Poll, or None if too many polls are open. """
+        poll_id = next((poll_id for poll_id in POLL_IDS if poll_id not in self.polls), None)
+        if poll_id is None:
+            logger.warning(f'Too many polls are open! Not starting poll: {question}')
+            return None
+        # Reload the player metadata (e.g. hours played) so the new poll is segmented with fresh data. Ballots keep the
+        # segment they were counted in, so the polls that are still open are not affected.
+        self.metadata_index.expire_loaded()
+        new_poll = Poll(question, options, self.metadata_index, poll_id=poll_id)
+        self.polls[poll_id] = new_poll
+        formatted_options = '\n'.join(f'{index}) {option}' for index, option in enumerate(options))
+        self.squad_rcon_client.exec_command('AdminBroadcast ' + POLL_STARTED_MESSAGE_TEMPLATE.format(
+            poll_id=poll_id, question=question, options=formatted_options))
+        logger.info(f'Started poll {poll_id}: {question} {options}')
+        return new_poll
+
+    def close_poll(self, poll_id):
+        """ Closes the given poll, broadcasts its results, and stores its ballots. """
+        closed_poll = self.polls.pop(poll_id)
+        results_message = POLL_RESULTS_MESSAGE_TEMPLATE.format(
+            poll_id=poll_id, question=closed_poll.question, results=closed_poll.format_results())
+        self.squad_rcon_client.exec_command(f'AdminBroadcast {results_message}')
+        logger.info(results_message)
+        if self.store is not None:
+            for row in closed_poll.get_rows():
+                self.store.append(row)
+            self.store.flush()
+
+    def parse_ballot(self, message):
+        """ Returns the (Poll, option_index) the message votes for, or None if the message is not a ballot. """
+        match = POLL_BALLOT_PATTERN.match(message)
+        if match:
+            target_poll = self.polls.get(match.group(1).upper())
+            return (target_poll, int(match.group(2))) if target_poll else None
+        # With only one open poll, a number at the end of the message is enough.
+        if len(self.polls) == 1:
+            last_word = LAST_WORD_PATTERN.search(message.strip())
+            if last_word and last_word.group(0).isdecimal():
+                return (next(iter(self.polls.values())), int(last_word.group(0)))
+        return None
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Starts requested polls, counts ballots in the recent chat, and closes polls that are over. """
+        now = time.time()
+        for player_id, player_chat in recent_player_chat.items():
+            for message in player_chat.messages:
+                if message.strip().lower().startswith(POLL_COMMAND):
+                    parsed_command = parse_poll_command(message)
+                    if parsed_command and self.can_start_polls(player_id, player_chat.player_name):
+                        self.start_poll(*parsed_command)
+                    continue
+                if self.polls:
+                    ballot = self.parse_ballot(message)
+                    if ballot:
+                        target_poll, option_index = ballot
+                        target_poll.add_ballot(player_id, option_index, now)
+
+        for poll_id, open_poll in list(self.polls.items()):
+            if now - open_poll.started_at >= self.poll_duration_s:
+                self.close_poll(poll_id)
@@ -15,14 +15,35 @@
 #
 
 import argparse
+import contextlib
 from datetime import datetime
+import importlib.util
 import pathlib
-import time
 import logging
 import os
+import socket
+import threading
 
-from srcds import rcon
+from adminping import adminping
+from chatfeed import chatfeed
+from clantag import clantag
+from columnar import columnar
+from config import config
+from eventlog import eventlog
+from healthcheck import healthcheck
 from mapvoter import mapvoter
+from mapvoter import votehistory
+from matchhistory import matchhistory
+from mortar import mortar
+from players import players
+from plugin import dispatcher
+from plugin import workerpool
+from poll import poll
+from seeding import seeding
+from sharding import sharding
+from teamshuffle import teamshuffle
+from trivia import trivia
+from whitelist import whitelist
 
 logger = logging.getLogger()
 
@@ -32,20 +53,34 @@ DEFAULT_PORT = 21114
 # How long to sleep in between each "has the map changed" check (in seconds).
 SLEEP_BETWEEN_MAP_CHECKS_S = 10.0
 
-# The default filepath for the map rotation config (defines what filters to use when choosing candidates).
-DEFAULT_CONFIG_FILEPATH = (pathlib.Path(os.path.dirname(mapvoter.squad_map_randomizer.__file__)) /
+# The default filepath for the map rotation config (defines what filters to use when choosing candidates). Found
+# without importing squad_map_randomizer, which is slow to import and only needed once the config is loaded.
+DEFAULT_CONFIG_FILEPATH = (pathlib.Path(os.path.dirname(importlib.util.find_spec('squad_map_randomizer').origin)) /
                            'configs/default_config.yml')
 
+# The default directory that the data collected by the plugins (e.g. poll results and match history) is stored in.
+DEFAULT_DATA_DIRPATH = pathlib.Path(os.path.dirname(__file__)) / 'data'
+
+# The default filepath for the snapshot of the map layers (so they are not fetched on every startup).
+DEFAULT_LAYERS_SNAPSHOT_FILEPATH = DEFAULT_DATA_DIRPATH / 'map_layers.json'
+
+# The default filepath for the history of map votes and played layers.
+DEFAULT_VOTE_HISTORY_FILEPATH = DEFAULT_DATA_DIRPATH / 'vote_history.sqlite3'
+
+# The default filepath for the queue of undelivered admin pings.
+DEFAULT_ADMIN_PING_QUEUE_FILEPATH = pathlib.Path(os.path.dirname(__file__)) / 'admin_ping_queue.sqlite3'
+
 
 def parse_cli():
     """ Parses sys.argv (commandline args) and returns a parser with the arguments. """
     parser = argparse.ArgumentParser()
-    parser.add_argument('--rcon-address', required=True,
-                        help='The address to the RCON server (IP or URL).')
+    parser.add_argument('--rcon-address',
+                        help=('The address to the RCON server (IP or URL). Required unless --manifest-filepath is '
+                              'given.'))
     parser.add_argument('--rcon-port', type=int, help=f'The port for the RCON server. Defaults to {DEFAULT_PORT}.',
                         default=DEFAULT_PORT)
-    parser.add_argument('--rcon-password', required=True,
-                        help='The password for the RCON server.')
+    parser.add_argument('--rcon-password',
+                        help='The password for the RCON server. Required unless --manifest-filepath is given.')
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
                         help='Verbose flag to indicate that DEBUG level output should be logged.')
 
@@ -59,20 +94,140 @@ def parse_cli():
                         default=mapvoter.DEFAULT_VOTING_TIME_DURATION_S)
     parser.add_argument('-c', '--config-filepath', default=DEFAULT_CONFIG_FILEPATH, type=pathlib.Path,
                         help=('Filepath to read map rotation config from. Defines what filters to use when choosing'
-                              f' candidates. Defaults to {DEFAULT_CONFIG_FILEPATH}.'))
+                              f' candidates. Reloaded whenever it changes. Defaults to {DEFAULT_CONFIG_FILEPATH}.'))
+    parser.add_argument('--settings-filepath', type=pathlib.Path,
+                        help=('Filepath to read bot settings (voting_cooldown_s and voting_duration_s) from. Overrides '
+                              'the matching CLI arguments and is reloaded whenever it changes.'))
     parser.add_argument('--map-layers-url', default=mapvoter.DEFAULT_LAYERS_URL,
                         help=('The URL to the map layers JSON file containing all map layers to use for the map vote '
                               'choices if a map rotation is not provided/used.'))
-    return parser.parse_args()
+    parser.add_argument('--vote-history-filepath', type=pathlib.Path, default=DEFAULT_VOTE_HISTORY_FILEPATH,
+                        help=('Filepath to the history of map votes and played layers (used to keep recently played '
+                              'or rejected layers out of map votes). Can be shared by the bots of several servers. '
+                              f'Defaults to {DEFAULT_VOTE_HISTORY_FILEPATH}.'))
+    parser.add_argument('--map-layers-snapshot-filepath', type=pathlib.Path, default=DEFAULT_LAYERS_SNAPSHOT_FILEPATH,
+                        help=('Filepath to the snapshot of the map layers. The layers are loaded from it instead of '
+                              'fetched from --map-layers-url (it is written the first time they are fetched). Defaults '
+                              f'to {DEFAULT_LAYERS_SNAPSHOT_FILEPATH}.'))
+    parser.add_argument('--refresh-map-layers-snapshot', action='store_true',
+                        help=('Fetch the map layers from --map-layers-url, save them to the snapshot, and exit (e.g. '
+                              'to build the snapshot before starting many bots).'))
+
+    parser.add_argument('--clan-tags-filepath', type=pathlib.Path,
+                        help=('Filepath to a YAML file of clans (their tags, team, and whether they are admins). '
+                              f'Defaults to a single admin clan with the tag {mapvoter.CLAN_TAG}.'))
+    parser.add_argument('--data-dirpath', type=pathlib.Path, default=DEFAULT_DATA_DIRPATH,
+                        help=('The directory to store the data collected by the plugins (e.g. poll results) in. '
+                              f'Defaults to {DEFAULT_DATA_DIRPATH}.'))
+
+    # Trivia-specific CLI arguments.
+    parser.add_argument('--trivia-question-bank', type=pathlib.Path,
+                        help=('Filepath to the trivia question bank (one "question|answer|other answer" per line). '
+                              'Trivia is disabled if not given.'))
+    parser.add_argument('--trivia-interval', type=float, default=trivia.DEFAULT_QUESTION_INTERVAL_S,
+                        help=('How long to wait (in seconds) in between trivia questions. Defaults to '
+                              f'{trivia.DEFAULT_QUESTION_INTERVAL_S}.'))
+
+    # Admin ping CLI arguments.
+    parser.add_argument('--admin-ping-webhook-url',
+                        help=(f'The webhook URL (e.g. a Discord webhook) that "{adminping.ADMIN_PING_COMMAND}" pings are '
+                              'sent to. Admin pings are disabled if not given.'))
+    parser.add_argument('--admin-ping-queue-filepath', type=pathlib.Path, default=DEFAULT_ADMIN_PING_QUEUE_FILEPATH,
+                        help=('Filepath to the on-disk queue of admin pings that have not been delivered yet. Defaults '
+                              f'to {DEFAULT_ADMIN_PING_QUEUE_FILEPATH}.'))
+
+    # Whitelist CLI arguments.
+    parser.add_argument('--whitelist-filepath', type=pathlib.Path,
+                        help=('The admins file (Admins.cfg format) that seeders and regulars are whitelisted in. It is '
+                              'rewritten by the bot, so it should only be used for the whitelist (and every server '
+                              'in a manifest needs its own). Automatic whitelisting is disabled if not given.'))
+    parser.add_argument('--whitelist-seeding-hours', type=float, default=whitelist.DEFAULT_SEEDING_HOURS_THRESHOLD,
+                        help=('The hours a player has to play while the server is seeding to be whitelisted. Defaults '
+                              f'to {whitelist.DEFAULT_SEEDING_HOURS_THRESHOLD}.'))
+    parser.add_argument('--whitelist-total-hours', type=float, default=whitelist.DEFAULT_TOTAL_HOURS_THRESHOLD,
+                        help=('The hours a player has to play in total to be whitelisted. Defaults to '
+                              f'{whitelist.DEFAULT_TOTAL_HOURS_THRESHOLD}.'))
+
+    # Seeding CLI arguments.
+    parser.add_argument('--seeding-broadcasts-filepath', type=pathlib.Path,
+                        help=('A YAML file of messages (e.g. the rules) to broadcast every so often, and by default '
+                              'only while the server is seeding. The seeding announcer (which also announces when the '
+                              'server goes live) is disabled if not given.'))
+    parser.add_argument('--live-player-threshold', type=int, default=seeding.DEFAULT_LIVE_PLAYER_THRESHOLD,
+                        help=('The number of players at which the server is announced live. Defaults to '
+                              f'{seeding.DEFAULT_LIVE_PLAYER_THRESHOLD}.'))
+    parser.add_argument('--live-player-hysteresis', type=int, default=seeding.DEFAULT_LIVE_PLAYER_HYSTERESIS,
+                        help=('How many players below the live threshold the server has to drop to before it is '
+                              'considered seeding again (and can be announced live again). Defaults to '
+                              f'{seeding.DEFAULT_LIVE_PLAYER_HYSTERESIS}.'))
+
+    # Event log CLI arguments.
+    parser.add_argument('--event-log-dirpath', type=pathlib.Path,
+                        help=('The directory to record the chat, commands sent, vote results, and map changes in (as '
+                              'binary event log segments, see eventlog). Disabled if not given.'))
+    parser.add_argument('--event-log-segment-mb', type=float, default=eventlog.DEFAULT_MAX_SEGMENT_BYTES / 1024 ** 2,
+                        help=('Start a new event log segment once the current one is this big (in MiB). Defaults to '
+                              f'{eventlog.DEFAULT_MAX_SEGMENT_BYTES // 1024 ** 2}.'))
+    parser.add_argument('--event-log-segment-minutes', type=float,
+                        default=eventlog.DEFAULT_MAX_SEGMENT_AGE_S / 60,
+                        help=('Start a new event log segment once the current one is this old (in minutes). Defaults '
+                              f'to {eventlog.DEFAULT_MAX_SEGMENT_AGE_S / 60:g}.'))
+
+    # Health check CLI arguments.
+    parser.add_argument('--rcon-deadline', type=float, default=healthcheck.DEFAULT_RCON_DEADLINE_S,
+                        help=('How long (in seconds) a single RCON command may take before it is considered hung. '
+                              f'Defaults to {healthcheck.DEFAULT_RCON_DEADLINE_S}.'))
+    parser.add_argument('--rcon-max-missed-deadlines', type=int, default=healthcheck.DEFAULT_MAX_MISSED_DEADLINES,
+                        help=('The number of RCON commands in a row that can miss their deadline before reconnecting. '
+                              f'Defaults to {healthcheck.DEFAULT_MAX_MISSED_DEADLINES}.'))
+    parser.add_argument('--stall-timeout', type=float, default=healthcheck.DEFAULT_STALL_TIMEOUT_S,
+                        help=('How long (in seconds) the bot can go without finishing a check before it is considered '
+                              f'stalled (and reconnects). Defaults to {healthcheck.DEFAULT_STALL_TIMEOUT_S}.'))
+
+    # Sharding CLI arguments (to run the servers in a manifest on several bot nodes).
+    parser.add_argument('--manifest-filepath', type=pathlib.Path,
+                        help=('Filepath to a YAML manifest of servers (each with a name and any of these arguments, '
+                              'e.g. rcon_address, rcon_port and rcon_password). The servers are divided among all the '
+                              'bots started with the same manifest and --lease-dirpath.'))
+    parser.add_argument('--lease-dirpath', type=pathlib.Path,
+                        help=('The shared directory of the server leases (required with --manifest-filepath). All the '
+                              'bot nodes must see the same directory (e.g. on one machine or a shared filesystem).'))
+    parser.add_argument('--node-id', default=f'{socket.gethostname()}-{os.getpid()}',
+                        help='The unique id of this bot node. Defaults to the hostname and process id.')
+    parser.add_argument('--lease-timeout', type=float, default=sharding.DEFAULT_LEASE_TIMEOUT_S,
+                        help=('How long (in seconds) a dead node keeps its servers before other nodes take them over. '
+                              f'Defaults to {sharding.DEFAULT_LEASE_TIMEOUT_S}.'))
+
+    # Worker pool CLI arguments (used by plugins to run heavy work off of the main loop).
+    parser.add_argument('--worker-mode', choices=workerpool.WORKER_MODES, default=workerpool.THREAD_MODE,
+                        help=('Whether plugins run their heavy work in a thread pool or a process pool. Defaults to '
+                              f'{workerpool.THREAD_MODE}.'))
+    parser.add_argument('--worker-count', type=int, default=workerpool.DEFAULT_MAX_WORKERS,
+                        help=f'The number of workers in the pool. Defaults to {workerpool.DEFAULT_MAX_WORKERS}.')
+    parser.add_argument('--dispatch-connections', type=int, default=dispatcher.DEFAULT_NUM_CONNECTIONS,
+                        help=('The number of RCON connections used to send bursts of commands (e.g. team shuffles). '
+                              f'Defaults to {dispatcher.DEFAULT_NUM_CONNECTIONS}.'))
+    args = parser.parse_args()
+    if args.manifest_filepath:
+        if not args.lease_dirpath:
+            parser.error('--lease-dirpath is required with --manifest-filepath!')
+    # Refreshing the map layers snapshot does not connect to any server.
+    elif not args.refresh_map_layers_snapshot and (not args.rcon_address or not args.rcon_password):
+        parser.error('--rcon-address and --rcon-password are required (unless --manifest-filepath or '
+                     '--refresh-map-layers-snapshot is given)!')
+    if args.live_player_hysteresis < 1:
+        parser.error('--live-player-hysteresis must be at least 1!')
+    return args
 
 
 def setup_logger(verbose):
     """ Sets up the logger based on the verbosity level. """
     level = logging.DEBUG if verbose else logging.INFO
 
+    # The thread name tells apart the servers run by a sharded node (see run_node).
+    formatter = logging.Formatter('%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s')
     ch = logging.StreamHandler()
-    ch.setFormatter(logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    ch.setFormatter(formatter)
     ch.setLevel(level)
 
     # Create a directory to store the log files in.
@@ -81,19 +236,133 @@ def setup_logger(verbose):
     log_filename = log_dir / datetime.now().isoformat().replace('.',
                                                                 '_').replace(':', '_')
     fh = logging.FileHandler(log_filename)
+    fh.setFormatter(formatter)
 
     logger.setLevel(level)
     logger.addHandler(ch)
     logger.addHandler(fh)
 
 
-# TODO(bsubei): create a plugin abstract class that voter (and more stuff I make) implement and get called here.
-def connect_and_run_plugins(args):
-    # Set up the connection to RCON using a managed context (socket is closed automatically once we leave this context).
-    with rcon.get_managed_rcon_connection(args.rcon_address, port=args.rcon_port, password=args.rcon_password) as conn:
-        # Initialize the mapvoter.
-        voter = mapvoter.MapVoter(
-            conn, args.voting_cooldown, args.voting_duration)
+@contextlib.contextmanager
+def open_extra_rcon_client(args, event_log=None):
+    """
+    Opens an extra RCON connection (e.g. for the command dispatcher) with a deadline on every call, and every command
+    recorded in the event log (if there is one).
+    """
+    from srcds import rcon
+    with rcon.get_managed_rcon_connection(
+            args.rcon_address, port=args.rcon_port, password=args.rcon_password) as raw_conn:
+        with healthcheck.DeadlineClient(raw_conn, deadline_s=args.rcon_deadline,
+                                        max_missed_deadlines=args.rcon_max_missed_deadlines) as conn:
+            yield eventlog.EventLogClient(conn, event_log) if event_log is not None else conn
+
+
+def connect_and_run_plugins(args, stop_event):
+    # Imported here so the startup work (parsing args, setting up logging) does not wait on it.
+    from srcds import rcon
+
+    # Everything entered into this stack (the RCON connection, worker pool, etc.) is closed once we leave this context.
+    with contextlib.ExitStack() as stack:
+        # Set up the connection to RCON using a managed context (socket is closed automatically once we leave this
+        # context).
+        raw_conn = stack.enter_context(rcon.get_managed_rcon_connection(
+            args.rcon_address, port=args.rcon_port, password=args.rcon_password))
+        # Every RCON command goes through this proxy so a hung socket cannot block the bot forever.
+        conn = stack.enter_context(healthcheck.DeadlineClient(
+            raw_conn, deadline_s=args.rcon_deadline, max_missed_deadlines=args.rcon_max_missed_deadlines))
+        os.makedirs(args.data_dirpath, exist_ok=True)
+        # If the main loop stalls (e.g. stuck on a hung RCON socket), the connection is interrupted so the loop fails
+        # and the bot reconnects.
+        health_monitor = stack.enter_context(healthcheck.HealthMonitor(
+            conn, stall_timeout_s=args.stall_timeout, export_filepath=args.data_dirpath / 'rcon_latency.json',
+            on_stall=conn.interrupt))
+        pool = stack.enter_context(workerpool.WorkerPool(args.worker_mode, args.worker_count))
+        # Record every command sent by the plugins in the event log (if enabled).
+        event_log = None
+        if args.event_log_dirpath:
+            event_log = stack.enter_context(eventlog.EventLog(
+                args.event_log_dirpath, max_segment_bytes=int(args.event_log_segment_mb * 1024 ** 2),
+                max_segment_age_s=args.event_log_segment_minutes * 60))
+            conn = eventlog.EventLogClient(conn, event_log)
+        command_dispatcher = stack.enter_context(dispatcher.CommandDispatcher(
+            conn, lambda: open_extra_rcon_client(args, event_log), num_connections=args.dispatch_connections))
+
+        # Load the clans (used to recognize the players that can use the admin chat commands).
+        if args.clan_tags_filepath:
+            clan_registry = clantag.ClanTagRegistry.from_filepath(args.clan_tags_filepath)
+        else:
+            clan_registry = clantag.ClanTagRegistry.from_tags([mapvoter.CLAN_TAG])
+
+        # The player chat is drained once per tick and shared by all the plugins.
+        chat_feed = chatfeed.ChatFeed(conn)
+
+        # Initialize the mapvoter (with the history of votes and played layers, which can be shared by many servers).
+        vote_history = votehistory.VoteHistory(args.vote_history_filepath, f'{args.rcon_address}:{args.rcon_port}')
+        stack.callback(vote_history.close)
+        voter = mapvoter.MapVoter(conn, args.voting_cooldown, args.voting_duration, worker_pool=pool,
+                                  clan_registry=clan_registry, chat_feed=chat_feed, vote_history=vote_history,
+                                  event_log=event_log)
+
+        # Initialize the config watcher and load the initial configs (fails if the map rotation config is invalid).
+        config_watcher = config.ConfigWatcher(
+            conn, voter, args.config_filepath, args.map_layers_url, settings_filepath=args.settings_filepath,
+            layers_snapshot_filepath=args.map_layers_snapshot_filepath)
+        config_watcher.reload_if_changed()
+
+        # The plugins to run on every tick (in order). The health monitor runs first to beat the heartbeat, the config
+        # watcher runs next so new configs apply right away, and then the player tracker so the other plugins can use
+        # its player snapshot.
+        player_tracker = players.PlayerTracker(conn, worker_pool=pool)
+        plugins = [
+            health_monitor,
+            config_watcher,
+            player_tracker,
+            clantag.ClanTeamAssigner(conn, player_tracker, clan_registry, command_dispatcher, worker_pool=pool),
+            voter,
+            mortar.MortarCalculator(conn, worker_pool=pool),
+        ]
+        if args.trivia_question_bank:
+            trivia_scores = trivia.ScoreStore(args.data_dirpath / 'trivia_scores.sqlite3')
+            stack.callback(trivia_scores.close)
+            question_bank = stack.enter_context(trivia.QuestionBank(args.trivia_question_bank))
+            plugins.append(trivia.Trivia(conn, question_bank, question_interval_s=args.trivia_interval,
+                                         score_store=trivia_scores, worker_pool=pool))
+        # The hours played by every player are always credited (they slice the poll results into regulars and
+        # randoms), but players are only whitelisted if there is a whitelist file.
+        hours_store = whitelist.HoursStore(args.data_dirpath / 'player_hours.sqlite3')
+        stack.callback(hours_store.close)
+        plugins.append(whitelist.Whitelister(
+            conn, player_tracker, hours_store, args.whitelist_filepath,
+            seeding_hours_threshold=args.whitelist_seeding_hours,
+            total_hours_threshold=args.whitelist_total_hours, worker_pool=pool))
+        metadata_index = poll.PlayerMetadataIndex(
+            loader=lambda player_id: {'hours_played': hours_store.get_hours(player_id)[1]})
+        plugins.append(poll.PollEngine(
+            conn, clan_registry.is_admin,
+            store=columnar.ColumnarStore(args.data_dirpath / 'polls', poll.POLL_STORE_SCHEMA),
+            metadata_index=metadata_index, worker_pool=pool))
+        plugins.append(matchhistory.MatchRecorder(
+            conn, columnar.ColumnarStore(args.data_dirpath / 'match_history', matchhistory.MATCH_HISTORY_SCHEMA),
+            player_tracker, clan_registry, worker_pool=pool))
+        plugins.append(teamshuffle.TeamShuffler(conn, command_dispatcher, clan_registry.is_admin, worker_pool=pool))
+        if args.seeding_broadcasts_filepath:
+            plugins.append(seeding.SeedingAnnouncer(
+                conn, player_tracker, seeding.load_broadcasts(args.seeding_broadcasts_filepath),
+                live_player_threshold=args.live_player_threshold,
+                live_player_hysteresis=args.live_player_hysteresis, worker_pool=pool))
+        if args.admin_ping_webhook_url:
+            event_queue = adminping.EventQueue(args.admin_ping_queue_filepath)
+            stack.callback(event_queue.close)
+            sender = stack.enter_context(adminping.WebhookSender(event_queue, args.admin_ping_webhook_url))
+            plugins.append(adminping.AdminPing(conn, event_queue, sender, f'{args.rcon_address}:{args.rcon_port}',
+                                               worker_pool=pool))
+        # The event recorder runs last, so it flushes the events of the other plugins on the same tick.
+        if event_log is not None:
+            plugins.append(eventlog.EventRecorder(conn, event_log, worker_pool=pool))
+
+        # Every plugin reads the chat through its own cursor, so a plugin that was skipped (e.g. after a missed
+        # deadline) gets the chat it missed on the next tick.
+        chat_cursors = [chat_feed.subscribe(type(plugin).__name__) for plugin in plugins]
 
         logger.info(f'Will start checking for new map every {SLEEP_BETWEEN_MAP_CHECKS_S} seconds and waiting to start '
                     'a map vote...')
@@ -102,21 +371,90 @@ def connect_and_run_plugins(args):
         current_map, next_map = conn.get_current_and_next_map()
 
         # Spin until we're done, but do it slowly.
-        while True:
-            current_map, next_map = conn.get_current_and_next_map()
-            logger.debug(f'Current map: {current_map}, next map: {next_map}')
+        while not stop_event.is_set():
+            try:
+                current_map, next_map = conn.get_current_and_next_map()
+                logger.debug(f'Current map: {current_map}, next map: {next_map}')
+
+                # Get most recent player messages since we last asked for the current map.
+                chat_feed.drain()
+
+                for plugin, chat_cursor in zip(plugins, chat_cursors):
+                    plugin.run_once(current_map, next_map, chat_cursor.read())
+            except healthcheck.RconDeadlineExceeded as e:
+                # Skip the rest of this check. After too many missed deadlines, RconStalled is raised to reconnect.
+                logger.warning(f'{e} Skipping this check.')
+            health_monitor.check()
+
+            # Deliver the results of any heavy plugin work that finished (and cancel work that missed its deadline).
+            pool.poll()
+            # Close the extra RCON connections once no burst of commands used them for a while.
+            command_dispatcher.close_idle_clients()
+
+            stop_event.wait(SLEEP_BETWEEN_MAP_CHECKS_S)
+
+
+def run_bot(args, stop_event):
+    """ Connects to the RCON server and runs the plugins until stop_event is set, reconnecting after any error. """
+    while not stop_event.is_set():
+        try:
+            connect_and_run_plugins(args, stop_event)
+        except Exception as e:
+            logger.error(f'Encountered error: {e}. Retrying...')
+        stop_event.wait(10.0)
+
 
-            # Get most recent player messages since we last asked for the current map.
-            recent_player_chat = conn.get_player_chat()
-            conn.clear_player_chat()
+def get_server_args(args, server):
+    """
+    Returns the args to run the bot for the given server of the manifest: the CLI args overridden by the server's
+    settings, with the server's data (and admin ping queue) kept in its own directory.
+    """
+    server_args = argparse.Namespace(**vars(args))
+    server_args.data_dirpath = args.data_dirpath / server.name
+    server_args.admin_ping_queue_filepath = server_args.data_dirpath / DEFAULT_ADMIN_PING_QUEUE_FILEPATH.name
+    if args.event_log_dirpath:
+        server_args.event_log_dirpath = args.event_log_dirpath / server.name
+    for key, value in server.settings.items():
+        if not hasattr(args, key):
+            raise ValueError(f'Unknown setting {key} for server {server.name} in the manifest!')
+        is_path = isinstance(getattr(args, key), pathlib.Path) or key.endswith(('_filepath', '_dirpath'))
+        setattr(server_args, key, pathlib.Path(value) if is_path and value is not None else value)
+    return server_args
 
-            voter.run_once(
-                current_map, next_map, recent_player_chat,
-                config_filepath=args.config_filepath,
-                map_layers_url=args.map_layers_url
-            )
 
-            time.sleep(SLEEP_BETWEEN_MAP_CHECKS_S)
+def check_whitelist_filepaths(server_args):
+    """
+    Raises ValueError if any two servers share a whitelist file (each bot rewrites the whole file with only its own
+    players, so they would keep overwriting each other).
+
+    :param server_args: dict(str->Namespace) The args of each server (by server name).
+    """
+    whitelist_servers = {}
+    for name, args in server_args.items():
+        if args.whitelist_filepath is None:
+            continue
+        filepath = args.whitelist_filepath.resolve()
+        if filepath in whitelist_servers:
+            raise ValueError(f'Servers {whitelist_servers[filepath]} and {name} share the whitelist file {filepath}! '
+                             'Set a whitelist_filepath for each server in the manifest instead.')
+        whitelist_servers[filepath] = name
+
+
+def run_node(args):
+    """ Runs this bot as one node of a sharded deployment: runs the servers of the manifest it owns a lease on. """
+    servers = sharding.load_manifest(args.manifest_filepath)
+    server_args = {server.name: get_server_args(args, server) for server in servers}
+    check_whitelist_filepaths(server_args)
+    lease_manager = sharding.LeaseManager(args.lease_dirpath, args.node_id, list(server_args),
+                                          lease_timeout_s=args.lease_timeout)
+
+    def run_server(server, stop_event):
+        run_bot(server_args[server.name], stop_event)
+
+    node = sharding.ShardNode(lease_manager, servers, run_server, heartbeat_interval_s=args.lease_timeout / 5)
+    logger.info(f'Running as node {args.node_id} of {len(servers)} servers (leases in {args.lease_dirpath}).')
+    # Runs until interrupted, then stops the server tasks and releases the leases so other nodes take over right away.
+    node.run()
 
 
 def main():
@@ -127,13 +465,17 @@ def main():
     # Set up the logger.
     setup_logger(args.verbose)
 
+    if args.refresh_map_layers_snapshot:
+        all_map_layers = config.fetch_map_layers(args.map_layers_url)
+        config.save_layers_snapshot(args.map_layers_snapshot_filepath, args.map_layers_url, all_map_layers)
+        return
+
+    if args.manifest_filepath:
+        run_node(args)
+        return
+
     # Connect to RCON server and run plugins, and if you fail keep retrying (does not swallow keyboard interrupts).
-    while True:
-        try:
-            connect_and_run_plugins(args)
-        except Exception as e:
-            logger.error(f'Encountered error: {e}. Retrying...')
-        time.sleep(10.0)
+    run_bot(args, threading.Event())
 
 
 if __name__ == '__main__':
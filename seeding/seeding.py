@@ -0,0 +1,166 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A plugin that helps seed the server: it broadcasts scheduled messages (e.g. the rules) and announces when the server
+# goes live.
+#
+
+import collections
+import logging
+
+from plugin import plugin
+from plugin import timerwheel
+
+logger = logging.getLogger(__name__)
+
+# The server is live once it has at least this many players.
+DEFAULT_LIVE_PLAYER_THRESHOLD = 50
+# The server goes back to seeding only once it drops this many players below the live threshold (so a player count
+# hovering around the threshold does not announce the server live over and over).
+DEFAULT_LIVE_PLAYER_HYSTERESIS = 5
+
+# The events of the ThresholdDetector.
+LIVE_EVENT = 'live'
+SEEDING_EVENT = 'seeding'
+
+# The string to be sent to the server when it goes live.
+LIVE_MESSAGE = 'The server is live! Thanks to everyone who helped seed it.'
+
+# A message broadcast every interval_s seconds, either always or only while the server is seeding.
+Broadcast = collections.namedtuple('Broadcast', ['message', 'interval_s', 'seeding_only'])
+
+
+def load_broadcasts(filepath):
+    """
+    Loads the scheduled broadcasts from a YAML file like:
+    broadcasts:
+      - message: 'Rule 1: no teamkilling.'
+        interval_minutes: 10
+        seeding_only: true  # Optional, defaults to true.
+
+    :param filepath: Path The broadcasts file.
+    :return: list(Broadcast) The broadcasts, in the file's order.
+    """
+    import yaml  # Only needed when the seeding announcer is enabled.
+    with open(filepath, 'r') as f:
+        raw_broadcasts = (yaml.safe_load(f) or {}).get('broadcasts', [])
+    broadcasts = []
+    for raw_broadcast in raw_broadcasts:
+        message = raw_broadcast.get('message')
+        interval_minutes = raw_broadcast.get('interval_minutes')
+        if not message or not isinstance(message, str):
+            raise ValueError(f'Every broadcast in {filepath} needs a message!')
+        if not isinstance(interval_minutes, (int, float)) or interval_minutes <= 0:
+            raise ValueError(f'The broadcast "{message}" in {filepath} needs a positive interval_minutes!')
+        broadcasts.append(Broadcast(message, interval_minutes * 60.0, bool(raw_broadcast.get('seeding_only', True))))
+    return broadcasts
+
+
+class ThresholdDetector:
+    """
+    Detects when a value (e.g. the player count) crosses a threshold, with hysteresis: it rises once the value reaches
+    the rise threshold, and only falls again once the value drops to the fall threshold. Each crossing is reported
+    exactly once. The first value only sets the state (nothing crossed, e.g. the server was already live when the bot
+    started).
+    """
+
+    def __init__(self, rise_threshold, fall_threshold):
+        """
+        The constructor for ThresholdDetector.
+
+        :param rise_threshold: float The value at (or above) which the detector rises.
+        :param fall_threshold: float The value at (or below) which the detector falls. Must be below rise_threshold.
+        """
+        if fall_threshold >= rise_threshold:
+            raise ValueError(f'The fall threshold {fall_threshold} must be below the rise threshold {rise_threshold}!')
+        self.rise_threshold = rise_threshold
+        self.fall_threshold = fall_threshold
+        # Whether the detector is above the threshold (None before the first value).
+        self.is_above = None
+
+    def update(self, value):
+        """
+        Updates the detector with a new value.
+
+        :return: str LIVE_EVENT if the value crossed up, SEEDING_EVENT if it crossed down, and None otherwise.
+        """
+        if self.is_above is None:
+            self.is_above = value >= self.rise_threshold
+            return None
+        if not self.is_above and value >= self.rise_threshold:
+            self.is_above = True
+            return LIVE_EVENT
+        if self.is_above and value <= self.fall_threshold:
+            self.is_above = False
+            return SEEDING_EVENT
+        return None
+
+
+class SeedingAnnouncer(plugin.Plugin):
+    """
+    A plugin that broadcasts the scheduled messages (seeding only ones are skipped while the server is live), and
+    announces when the server goes live. The player count comes from the PlayerTracker snapshot (no extra RCON
+    commands), and the broadcasts are kept in a timer wheel so each tick only looks at the broadcasts that are due.
+    """
+
+    def __init__(self, squad_rcon_client, player_tracker, broadcasts,
+                 live_player_threshold=DEFAULT_LIVE_PLAYER_THRESHOLD,
+                 live_player_hysteresis=DEFAULT_LIVE_PLAYER_HYSTERESIS, timer_wheel=None, worker_pool=None):
+        """
+        The constructor for SeedingAnnouncer.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param player_tracker: PlayerTracker The tracker of the players on the server (must run before this plugin).
+        :param broadcasts: list(Broadcast) The scheduled broadcasts. Each is first sent one interval from now.
+        :param live_player_threshold: int The server is live once it has at least this many players.
+        :param live_player_hysteresis: int How many players below the live threshold the server goes back to seeding.
+        :param timer_wheel: TimerWheel The wheel to schedule the broadcasts in. Defaults to a new one.
+        :param worker_pool: WorkerPool See Plugin.
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.player_tracker = player_tracker
+        self.live_detector = ThresholdDetector(live_player_threshold, live_player_threshold - live_player_hysteresis)
+        self.timer_wheel = timer_wheel if timer_wheel is not None else timerwheel.TimerWheel()
+        for broadcast in broadcasts:
+            self.timer_wheel.schedule(broadcast, broadcast.interval_s, interval_s=broadcast.interval_s)
+
+        # The time of the latest player snapshot that was checked (so each snapshot is only checked once).
+        self.checked_snapshot_time = None
+
+    def is_live(self):
+        """ Returns True if the server is live (False while seeding, or before the first player snapshot). """
+        return bool(self.live_detector.is_above)
+
+    def broadcast(self, message):
+        self.squad_rcon_client.exec_command(f'AdminBroadcast {message}')
+
+    def check_player_count(self):
+        """ Checks the latest player snapshot (if it is new), and announces when the server goes live. """
+        snapshot_time = self.player_tracker.snapshot_time
+        if snapshot_time is None or snapshot_time == self.checked_snapshot_time:
+            return
+        self.checked_snapshot_time = snapshot_time
+        num_players = self.player_tracker.get_num_players()
+        event = self.live_detector.update(num_players)
+        if event == LIVE_EVENT:
+            logger.info(f'Server is live with {num_players} players.')
+            self.broadcast(LIVE_MESSAGE)
+        elif event == SEEDING_EVENT:
+            logger.info(f'Server is seeding again with {num_players} players.')
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Announces the server going live, and sends the broadcasts that are due. """
+        self.check_player_count()
+        for broadcast in self.timer_wheel.advance():
+            if broadcast.seeding_only and self.is_live():
+                continue
+            self.broadcast(broadcast.message)
@@ -0,0 +1,318 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# Divides the servers in a shared manifest among several bot nodes using lease files on a shared filesystem.
+#
+
+import collections
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from atomicfile import atomicfile
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) a node renews its leases and rebalances the servers.
+DEFAULT_HEARTBEAT_INTERVAL_S = 2.0
+
+# How long (in seconds) a lease (or a node) lives without a heartbeat. A dead node's servers are taken over by the other
+# nodes after this long.
+DEFAULT_LEASE_TIMEOUT_S = 10.0
+
+# How long (in seconds) to wait for a server's task to stop before its lease is released to another node.
+DEFAULT_STOP_TIMEOUT_S = 30.0
+
+# The names of the files in the lease directory.
+LOCK_FILENAME = '.lock'
+LEASE_FILE_SUFFIX = '.lease'
+NODES_DIRNAME = 'nodes'
+
+# A server in the manifest: its unique name, and the bot settings for it (CLI argument names to values, e.g.
+# rcon_address, rcon_port and rcon_password).
+ServerSpec = collections.namedtuple('ServerSpec', ['name', 'settings'])
+
+
+def load_manifest(filepath):
+    """
+    Returns the servers in the given YAML manifest, e.g.:
+        servers:
+          - name: eu1
+            rcon_address: 192.168.1.77
+            rcon_port: 21114
+            rcon_password: randompass
+
+    :return: list(ServerSpec) The servers, in the manifest's order.
+    """
+    import yaml  # Only needed when running as a node.
+    with open(filepath, 'r') as f:
+        raw_manifest = yaml.safe_load(f) or {}
+    servers = []
+    for raw_server in raw_manifest.get('servers', []):
+        settings = dict(raw_server)
+        name = settings.pop('name', None)
+        if not name or not isinstance(name, str):
+            raise ValueError(f'Every server in the manifest {filepath} needs a name!')
+        if any(server.name == name for server in servers):
+            raise ValueError(f'Server name {name} appears more than once in the manifest {filepath}!')
+        servers.append(ServerSpec(name, settings))
+    return servers
+
+
+def get_rendezvous_rank(node_id, server_name):
+    """ Returns the (stable, pseudo-random) preference of the given node for the given server (higher is preferred). """
+    return hashlib.sha1(f'{node_id}/{server_name}'.encode('utf-8')).hexdigest()
+
+
+class LeaseManager:
+    """
+    Manages the leases of one node. Every node heartbeats its own file (so the live nodes are known) and renews the
+    leases of the servers it owns. A server is owned by the node holding an unexpired lease on it. All reads and writes
+    happen while holding an exclusive lock (flock) on the lease directory, so each server has exactly one owner. The
+    clocks of all nodes are assumed to be in sync (e.g. all nodes on one machine, or NTP).
+    """
+
+    def __init__(self, lease_dirpath, node_id, server_names, lease_timeout_s=DEFAULT_LEASE_TIMEOUT_S, clock=time.time):
+        """
+        The constructor for LeaseManager.
+
+        :param lease_dirpath: Path The (shared) directory the lease files are kept in.
+        :param node_id: str The unique id of this node.
+        :param server_names: list(str) The names of all the servers in the manifest.
+        :param lease_timeout_s: float How long a lease or node heartbeat lives without being renewed.
+        :param clock: callable Returns the current time (since the epoch).
+        """
+        self.lease_dirpath = lease_dirpath
+        self.node_id = node_id
+        self.server_names = list(server_names)
+        self.lease_timeout_s = lease_timeout_s
+        self.clock = clock
+        os.makedirs(os.path.join(lease_dirpath, NODES_DIRNAME), exist_ok=True)
+
+        # The servers this node owns (as of the latest rebalance).
+        self.owned = set()
+
+    @contextlib.contextmanager
+    def locked(self):
+        """ Holds the exclusive lock on the lease directory (blocks until the other nodes release it). """
+        with open(os.path.join(self.lease_dirpath, LOCK_FILENAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_lease_filepath(self, server_name):
+        return os.path.join(self.lease_dirpath, f'{server_name}{LEASE_FILE_SUFFIX}')
+
+    def get_node_filepath(self, node_id):
+        return os.path.join(self.lease_dirpath, NODES_DIRNAME, f'{node_id}.json')
+
+    @staticmethod
+    def read_json(filepath):
+        """ Returns the JSON in the given file, or None if it does not exist (or is unreadable). """
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable lease file {filepath}: {e}')
+            return None
+
+    def read_owner(self, server_name, now):
+        """ Returns the node id that holds an unexpired lease on the given server, or None. """
+        lease = self.read_json(self.get_lease_filepath(server_name))
+        if lease and lease.get('expires_at', 0.0) > now:
+            return lease.get('node_id')
+        return None
+
+    def write_lease(self, server_name, now):
+        atomicfile.write_file_atomically(self.get_lease_filepath(server_name), json.dumps(
+            {'node_id': self.node_id, 'renewed_at': now, 'expires_at': now + self.lease_timeout_s}))
+
+    def get_live_nodes(self, now):
+        """ Returns the sorted ids of the nodes that heartbeat recently (including this one). """
+        live_nodes = {self.node_id}
+        nodes_dirpath = os.path.join(self.lease_dirpath, NODES_DIRNAME)
+        for filename in os.listdir(nodes_dirpath):
+            if not filename.endswith('.json'):
+                continue
+            node = self.read_json(os.path.join(nodes_dirpath, filename))
+            if node and now - node.get('heartbeat_at', 0.0) <= self.lease_timeout_s:
+                live_nodes.add(node.get('node_id'))
+        return sorted(live_nodes)
+
+    def get_fair_share(self, num_live_nodes):
+        return math.ceil(len(self.server_names) / max(num_live_nodes, 1))
+
+    def rebalance(self, releasable=None):
+        """
+        Heartbeats this node, renews its leases, gives up servers beyond its fair share (so new nodes get some), and
+        takes free servers (unowned or with expired leases) up to its fair share.
+
+        :param releasable: callable(str)->bool Whether an owned server can be given up right now (e.g. its task
+                           stopped). Defaults to always.
+        :return: set(str) The servers this node owns now.
+        """
+        with self.locked():
+            now = self.clock()
+            atomicfile.write_file_atomically(self.get_node_filepath(self.node_id),
+                                            json.dumps({'node_id': self.node_id, 'heartbeat_at': now}))
+            live_nodes = self.get_live_nodes(now)
+            fair_share = self.get_fair_share(len(live_nodes))
+            owners = {server_name: self.read_owner(server_name, now) for server_name in self.server_names}
+
+            # Keep the servers that are still ours (another node may have taken over a lease that expired).
+            lost = {server_name for server_name in self.owned if owners[server_name] != self.node_id}
+            if lost:
+                logger.warning(f'Node {self.node_id} lost the leases of servers {sorted(lost)}!')
+            owned = {server_name for server_name, owner in owners.items() if owner == self.node_id}
+
+            # Give up the servers we like the least when we own more than our fair share.
+            by_preference = sorted(self.server_names, key=lambda name: get_rendezvous_rank(self.node_id, name),
+                                   reverse=True)
+            excess = [server_name for server_name in reversed(by_preference) if server_name in owned]
+            for server_name in excess[:max(len(owned) - fair_share, 0)]:
+                if releasable is None or releasable(server_name):
+                    owned.discard(server_name)
+                    os.unlink(self.get_lease_filepath(server_name))
+                    logger.info(f'Node {self.node_id} released server {server_name} to rebalance.')
+
+            # Take free servers (in order of preference) up to our fair share.
+            for server_name in by_preference:
+                if len(owned) >= fair_share:
+                    break
+                if owners[server_name] is None:
+                    owned.add(server_name)
+                    logger.info(f'Node {self.node_id} took server {server_name}.')
+
+            for server_name in owned:
+                self.write_lease(server_name, now)
+            self.owned = owned
+        return set(owned)
+
+    def release_all(self):
+        """ Releases every lease of this node and removes its heartbeat (so other nodes take over right away). """
+        with self.locked():
+            now = self.clock()
+            for server_name in self.server_names:
+                if self.read_owner(server_name, now) == self.node_id:
+                    os.unlink(self.get_lease_filepath(server_name))
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.get_node_filepath(self.node_id))
+            self.owned = set()
+
+
+class ShardNode:
+    """
+    A bot node that runs one task (thread) per server it owns. Every heartbeat interval it rebalances its leases,
+    starts the tasks of the servers it took, and stops the tasks of the servers it gave up or lost. A task that died is
+    restarted. Each task is called as run_server(server_spec, stop_event), and should return soon after the event is
+    set.
+    """
+
+    def __init__(self, lease_manager, servers, run_server, heartbeat_interval_s=DEFAULT_HEARTBEAT_INTERVAL_S,
+                 stop_timeout_s=DEFAULT_STOP_TIMEOUT_S):
+        """
+        The constructor for ShardNode.
+
+        :param lease_manager: LeaseManager The leases of this node.
+        :param servers: list(ServerSpec) The servers in the manifest.
+        :param run_server: callable(ServerSpec, threading.Event) Runs the bot for one server until the event is set.
+        :param heartbeat_interval_s: float How often to rebalance (must be well below the lease timeout).
+        :param stop_timeout_s: float How long to wait for a task to stop when shutting down.
+        """
+        self.lease_manager = lease_manager
+        self.servers = {server.name: server for server in servers}
+        self.run_server = run_server
+        self.heartbeat_interval_s = heartbeat_interval_s
+        self.stop_timeout_s = stop_timeout_s
+
+        # The task of every server being run: server name -> (thread, stop_event).
+        self.tasks = {}
+        # The servers whose tasks are being stopped so their leases can be given up (as of the latest rebalance).
+        self.releasing = set()
+        self.stopped = threading.Event()
+
+    def start_task(self, server_name):
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self.run_server, args=(self.servers[server_name], stop_event),
+                                  name=f'server-{server_name}', daemon=True)
+        thread.start()
+        self.tasks[server_name] = (thread, stop_event)
+
+    def is_task_stopped(self, server_name):
+        """ Stops the task of the given server (without waiting), and returns True if it is not running anymore. """
+        task = self.tasks.get(server_name)
+        if task is None:
+            return True
+        thread, stop_event = task
+        stop_event.set()
+        return not thread.is_alive()
+
+    def run_once(self):
+        """ Rebalances the leases, and starts and stops the server tasks to match. """
+        self.releasing = set()
+        owned = self.lease_manager.rebalance(releasable=self.is_task_stopped_unless_needed)
+        for server_name in list(self.tasks):
+            if server_name not in owned:
+                thread, stop_event = self.tasks.pop(server_name)
+                stop_event.set()
+        for server_name in owned:
+            # Leave the stopping tasks alone until their leases are given up (in one of the next rebalances).
+            if server_name in self.releasing:
+                continue
+            task = self.tasks.get(server_name)
+            if task is None or not task[0].is_alive():
+                if task is not None and not task[1].is_set():
+                    logger.error(f'Task of server {server_name} died! Restarting it.')
+                self.start_task(server_name)
+        return owned
+
+    def is_task_stopped_unless_needed(self, server_name):
+        """
+        Called for the servers the node wants to give up: asks their task to stop, and only lets the lease go once the
+        task stopped (so two nodes never run the same server).
+        """
+        stopped = self.is_task_stopped(server_name)
+        if stopped:
+            self.tasks.pop(server_name, None)
+        else:
+            self.releasing.add(server_name)
+        return stopped
+
+    def run(self):
+        """ Runs the node until stop() is called, then stops all the tasks and releases all the leases. """
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.run_once()
+                except OSError as e:
+                    logger.error(f'Failed to rebalance leases: {e}')
+                self.stopped.wait(self.heartbeat_interval_s)
+        finally:
+            for thread, stop_event in self.tasks.values():
+                stop_event.set()
+            for thread, _ in self.tasks.values():
+                thread.join(self.stop_timeout_s)
+            self.tasks = {}
+            self.lease_manager.release_all()
+
+    def stop(self):
+        self.stopped.set()
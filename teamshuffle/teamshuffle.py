@@ -0,0 +1,141 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A plugin that shuffles or swaps the teams on command.
+#
+
+import collections
+import logging
+import random
+
+from players import players
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The chat commands used to shuffle the teams (keeping squads together) or swap both teams completely.
+SHUFFLE_COMMAND = '!shuffle'
+SWAP_COMMAND = '!swap'
+
+# The strings to be formatted and sent to the server when the teams are shuffled or swapped.
+SHUFFLE_MESSAGE = 'Shuffling the teams!'
+SWAP_MESSAGE = 'Swapping the teams!'
+RESULT_MESSAGE_TEMPLATE = 'Done! Moved {num_moved} players ({num_failed} could not be moved).'
+
+
+def get_shuffled_teams(active_players):
+    """
+    Returns a new random team for every player, keeping squads together and keeping the teams as even as possible.
+
+    :param active_players: list(Player) The players on the server.
+    :return: dict(str->int) The new team_id of each player (keyed by steam_id).
+    """
+    # Squads are moved as a group, and players without a squad are groups of one.
+    groups = collections.defaultdict(list)
+    for player in active_players:
+        key = (player.team_id, player.squad_id) if player.squad_id is not None else (player.team_id, player.steam_id)
+        groups[key].append(player)
+
+    # Shuffle, then place the biggest groups first (the sort is stable so equal sizes stay shuffled), always on the team
+    # with fewer players.
+    shuffled_groups = list(groups.values())
+    random.shuffle(shuffled_groups)
+    shuffled_groups.sort(key=len, reverse=True)
+    team_sizes = {team_id: 0 for team_id in players.TEAM_IDS}
+    assignments = {}
+    for group in shuffled_groups:
+        team_id = min(players.TEAM_IDS, key=lambda team_id: (team_sizes[team_id], random.random()))
+        team_sizes[team_id] += len(group)
+        for player in group:
+            assignments[player.steam_id] = team_id
+    return assignments
+
+
+def get_swapped_teams(active_players):
+    """ Returns the other team for every player (keyed by steam_id). """
+    return {player.steam_id: players.TEAM_IDS[1] if player.team_id == players.TEAM_IDS[0] else players.TEAM_IDS[0]
+            for player in active_players}
+
+
+def get_moves(active_players, assignments):
+    """ Returns the steam_ids of the players whose assigned team is not their current team. """
+    return [player.steam_id for player in active_players if assignments[player.steam_id] != player.team_id]
+
+
+def get_failed_moves(final_players, assignments, moves):
+    """
+    Returns the steam_ids of the moved players that are still on the wrong team (players that left are ignored, and so
+    are players that were not moved, even if they switched teams since).
+    """
+    moves = set(moves)
+    return [player.steam_id for player in final_players
+            if player.steam_id in moves and assignments[player.steam_id] != player.team_id]
+
+
+class TeamShuffler(plugin.Plugin):
+    """
+    A plugin that shuffles or swaps the teams when an allowed player asks for it. The new teams are computed in one
+    pass over a single ListPlayers, the moves are sent as one concurrent burst through the CommandDispatcher, and the
+    result is checked with one final ListPlayers.
+    """
+
+    def __init__(self, squad_rcon_client, dispatcher, can_change_teams, worker_pool=None):
+        """
+        The constructor for TeamShuffler.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param dispatcher: CommandDispatcher Sends the burst of team change commands.
+        :param can_change_teams: callable Returns True if the player (given player_id and player_name) can shuffle or
+                                 swap the teams.
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.dispatcher = dispatcher
+        self.can_change_teams = can_change_teams
+
+    def change_teams(self, get_assignments, message):
+        """
+        Moves the players to the teams given by get_assignments (called with the current players), and broadcasts the
+        given message first.
+
+        :return: tuple(int, int) The number of players moved and the number of players that could not be moved.
+        """
+        active_players = players.list_players(self.squad_rcon_client)
+        assignments = get_assignments(active_players)
+        moves = get_moves(active_players, assignments)
+        self.squad_rcon_client.exec_command(f'AdminBroadcast {message}')
+        logger.info(f'{message} Moving {len(moves)} of {len(active_players)} players.')
+
+        self.dispatcher.dispatch([f'AdminForceTeamChange {steam_id}' for steam_id in moves])
+
+        failed_moves = get_failed_moves(players.list_players(self.squad_rcon_client), assignments, moves)
+        if failed_moves:
+            logger.warning(f'Failed to move players: {failed_moves}')
+        result_message = RESULT_MESSAGE_TEMPLATE.format(num_moved=len(moves) - len(failed_moves),
+                                                        num_failed=len(failed_moves))
+        self.squad_rcon_client.exec_command(f'AdminBroadcast {result_message}')
+        logger.info(result_message)
+        return (len(moves) - len(failed_moves), len(failed_moves))
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Shuffles or swaps the teams (at most once) if an allowed player asked for it in the recent chat. """
+        for player_id, player_chat in recent_player_chat.items():
+            if not self.can_change_teams(player_id, player_chat.player_name):
+                continue
+            for message in player_chat.messages:
+                command = message.strip().lower()
+                if command.startswith(SHUFFLE_COMMAND):
+                    self.change_teams(get_shuffled_teams, SHUFFLE_MESSAGE)
+                    return
+                if command.startswith(SWAP_COMMAND):
+                    self.change_teams(get_swapped_teams, SWAP_MESSAGE)
+                    return
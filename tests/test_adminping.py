@@ -0,0 +1,235 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the AdminPing functionality (against a local HTTP server standing in for the webhook).
+#
+
+import http.server
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from adminping import adminping
+
+# How long to wait for the sender to deliver events in the tests.
+WAIT_TIMEOUT_S = 5.0
+TIME_NOW = 1000.0
+# The status code that makes the fake webhook reply with a malformed (non HTTP) response.
+MALFORMED_RESPONSE = -1
+
+
+class MockPlayerChat(object):
+    def __init__(self, messages, player_name=None):
+        self.player_name = player_name
+        self.messages = messages
+
+
+class FakeWebhookHandler(http.server.BaseHTTPRequestHandler):
+    """ Records every posted body, and replies with the next status code in the server's status_codes list. """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        status_code = self.server.status_codes.pop(0) if self.server.status_codes else 204
+        if status_code == MALFORMED_RESPONSE:
+            self.wfile.write(b'garbage status line\r\n\r\n')
+            self.close_connection = True
+            return
+        if status_code < 300:
+            self.server.received_bodies.append(json.loads(body))
+        self.send_response(status_code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def make_event(message, player_id='id1'):
+    """ Helper that returns a ping event with the given message. """
+    return {'server': 'test server', 'player_id': player_id, 'player_name': 'player', 'current_map': 'some map',
+            'message': message, 'time': TIME_NOW}
+
+
+def wait_until(condition):
+    """ Helper that waits until the given condition is True (or the wait times out). """
+    end_time = time.monotonic() + WAIT_TIMEOUT_S
+    while not condition() and time.monotonic() < end_time:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestAdminPing:
+    """ Test class (uses pytest) for the adminping module. """
+
+    @pytest.fixture
+    def webhook_server(self):
+        """ The fixture function to return a local HTTP server that stands in for the webhook. """
+        server = http.server.HTTPServer(('127.0.0.1', 0), FakeWebhookHandler)
+        server.status_codes = []
+        server.received_bodies = []
+        server.url = f'http://127.0.0.1:{server.server_address[1]}/webhook'
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    @pytest.fixture
+    def event_queue(self, tmp_path):
+        """ The fixture function to return an event queue. """
+        event_queue = adminping.EventQueue(tmp_path / 'queue.sqlite3')
+        yield event_queue
+        event_queue.close()
+
+    def test_event_queue(self, event_queue, tmp_path):
+        """ Tests for EventQueue. """
+        # Case 1: events come out in the order they were put in, and stay until they are acked.
+        for i in range(3):
+            event_queue.put(make_event(f'message {i}'))
+        assert len(event_queue) == 3
+        batch = event_queue.peek(2)
+        assert [event['message'] for _, event in batch] == ['message 0', 'message 1']
+        assert len(event_queue) == 3
+        event_queue.ack([event_id for event_id, _ in batch])
+        assert [event['message'] for _, event in event_queue.peek(10)] == ['message 2']
+
+        # Case 2: events are persisted on disk.
+        event_queue.close()
+        reopened_queue = adminping.EventQueue(tmp_path / 'queue.sqlite3')
+        assert [event['message'] for _, event in reopened_queue.peek(10)] == ['message 2']
+        reopened_queue.close()
+
+    def test_format_webhook_payload(self):
+        """ Tests for format_webhook_payload. """
+        # Case 1: every event in the batch is one line.
+        payload = json.loads(adminping.format_webhook_payload([make_event('help'), make_event('hacker', 'id2')]))
+        assert payload == {'content': ('[test server] player (id1) on some map: help\n'
+                                       '[test server] player (id2) on some map: hacker'),
+                           'allowed_mentions': {'parse': []}}
+
+        # Case 2: a single event that is too long is cut short to fit in a webhook message.
+        payload = json.loads(adminping.format_webhook_payload([make_event('x' * 3000)]))
+        assert len(payload['content']) == adminping.MAX_WEBHOOK_CONTENT_LENGTH
+        assert payload['content'].endswith('...')
+
+        # Case 3: mentions typed by players (e.g. @everyone or a role) never ping anyone.
+        payload = json.loads(adminping.format_webhook_payload([make_event('@everyone <@&1234> help')]))
+        assert '@everyone <@&1234> help' in payload['content']
+        assert payload['allowed_mentions'] == {'parse': []}
+
+    def test_count_fitting_events(self):
+        """ Tests for count_fitting_events. """
+        line_length = len(adminping.format_event(make_event('')))
+
+        # Case 1: events are counted until the next one does not fit (including the newlines in between).
+        events = [make_event('x' * (1000 - line_length)) for _ in range(3)]
+        assert adminping.count_fitting_events(events) == 1
+        events = [make_event('x' * (999 - line_length)) for _ in range(3)]
+        assert adminping.count_fitting_events(events) == 2
+
+        # Case 2: a single event that is too long still counts (it is cut short), and no events count as zero.
+        assert adminping.count_fitting_events([make_event('x' * 3000), make_event('next')]) == 1
+        assert adminping.count_fitting_events([]) == 0
+
+    def test_sender_splits_long_batches(self, webhook_server, event_queue):
+        """ Tests that a batch that does not fit in one webhook message is split, and no event is lost. """
+        for i in range(3):
+            event_queue.put(make_event(f'{i}' * 900))
+        with adminping.WebhookSender(event_queue, webhook_server.url):
+            assert wait_until(lambda: len(event_queue) == 0)
+        assert len(webhook_server.received_bodies) == 2
+        contents = '\n'.join(body['content'] for body in webhook_server.received_bodies)
+        assert '...' not in contents
+        for i in range(3):
+            assert f'{i}' * 900 in contents
+
+    def test_sender_drops_rejected_batches(self, webhook_server, event_queue):
+        """ Tests that a batch the webhook rejects for good is dropped instead of blocking the events behind it. """
+        webhook_server.status_codes = [400]
+        event_queue.put(make_event('rejected'))
+        event_queue.put(make_event('x' * 3000))
+        event_queue.put(make_event('delivered'))
+        with adminping.WebhookSender(event_queue, webhook_server.url, initial_backoff_s=0.01) as sender:
+            assert wait_until(lambda: len(event_queue) == 0)
+            assert sender.num_failures == 0
+        assert len(webhook_server.received_bodies) == 2
+        assert 'delivered' in webhook_server.received_bodies[1]['content']
+
+    def test_sender_batches(self, webhook_server, event_queue):
+        """ Tests that the sender delivers all queued events in batches. """
+        for i in range(5):
+            event_queue.put(make_event(f'message {i}'))
+        with adminping.WebhookSender(event_queue, webhook_server.url, batch_size=2):
+            assert wait_until(lambda: len(event_queue) == 0)
+        assert len(webhook_server.received_bodies) == 3
+        assert webhook_server.received_bodies[0]['content'].count('\n') == 1
+        assert 'message 4' in webhook_server.received_bodies[2]['content']
+
+    def test_sender_retries(self, webhook_server, event_queue):
+        """ Tests that failed deliveries are retried with backoff, and the events are kept until delivered. """
+        webhook_server.status_codes = [500, 429]
+        event_queue.put(make_event('retry me'))
+        with adminping.WebhookSender(event_queue, webhook_server.url, initial_backoff_s=0.01) as sender:
+            assert wait_until(lambda: len(event_queue) == 0)
+            assert sender.num_failures == 0
+        assert len(webhook_server.received_bodies) == 1
+        assert 'retry me' in webhook_server.received_bodies[0]['content']
+
+    def test_sender_survives_malformed_response(self, webhook_server, event_queue):
+        """ Tests that a malformed webhook response (which raises http.client.BadStatusLine) is retried. """
+        webhook_server.status_codes = [MALFORMED_RESPONSE]
+        event_queue.put(make_event('retry me'))
+        with adminping.WebhookSender(event_queue, webhook_server.url, initial_backoff_s=0.01) as sender:
+            assert wait_until(lambda: len(event_queue) == 0)
+            assert sender.thread.is_alive()
+        assert len(webhook_server.received_bodies) == 1
+
+    def test_sender_backoff(self, event_queue):
+        """ Tests that the backoff doubles after every failure, up to the max. """
+        sender = adminping.WebhookSender(event_queue, 'http://unused', initial_backoff_s=1.0, max_backoff_s=5.0)
+        for num_failures, max_expected_backoff_s in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 5.0), (10, 5.0)]:
+            sender.num_failures = num_failures
+            assert max_expected_backoff_s / 2 <= sender.get_backoff_s() <= max_expected_backoff_s
+
+    def test_run_once(self, event_queue):
+        """ Tests that run_once queues pings and drops repeated pings within the dedup window. """
+        sender = mock.MagicMock()
+        ping = adminping.AdminPing(mock.MagicMock(), event_queue, sender, 'test server', dedup_window_s=60.0)
+        exec_command = ping.squad_rcon_client.exec_command
+
+        # Case 1: chat without the command does nothing.
+        ping.run_once('some map', 'next map', {'id1': MockPlayerChat(['need an admin'], player_name='player')})
+        assert len(event_queue) == 0
+        assert sender.notify.call_count == 0
+
+        # Case 2: a ping is queued, the sender is notified, and the player is told.
+        with mock.patch('adminping.adminping.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW
+            ping.run_once('some map', 'next map',
+                          {'id1': MockPlayerChat(['!ADMIN hacker at main', '!admin hello?'], player_name='player')})
+        assert [event for _, event in event_queue.peek(10)] == [make_event('hacker at main')]
+        assert sender.notify.call_count == 1
+        assert exec_command.call_args_list[0][0][0] == f'AdminWarn "id1" {adminping.PING_SENT_MESSAGE}'
+        # The second ping in the same batch was within the dedup window.
+        assert exec_command.call_args_list[1][0][0] == f'AdminWarn "id1" {adminping.PING_DROPPED_MESSAGE}'
+
+        # Case 3: the same player can ping again after the dedup window.
+        with mock.patch('adminping.adminping.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW + 61.0
+            ping.run_once('some map', 'next map', {'id1': MockPlayerChat(['!admin still here'], player_name='player')})
+        assert len(event_queue) == 2
+        assert sender.notify.call_count == 2
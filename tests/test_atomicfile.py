@@ -0,0 +1,45 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+# A testing class to test the atomicfile functionality.
+#
+
+import os
+import stat
+
+from atomicfile import atomicfile
+
+
+def get_mode(filepath):
+    """ Helper that returns the permission bits of the given file. """
+    return stat.S_IMODE(os.stat(filepath).st_mode)
+
+
+class TestAtomicFile:
+    """ Test class (uses pytest) for the atomicfile module. """
+
+    def test_write_file_atomically(self, tmp_path):
+        """ Tests for write_file_atomically. """
+        filepath = tmp_path / 'Admins.cfg'
+
+        # Case 1: a new file gets the default permissions (not the 0600 of the temporary file).
+        atomicfile.write_file_atomically(filepath, 'first')
+        assert filepath.read_text() == 'first'
+        assert get_mode(filepath) == atomicfile.DEFAULT_FILE_MODE
+
+        # Case 2: rewriting a file keeps its permissions and leaves no temporary files behind.
+        os.chmod(filepath, 0o640)
+        atomicfile.write_file_atomically(filepath, 'second')
+        assert filepath.read_text() == 'second'
+        assert get_mode(filepath) == 0o640
+        assert [path.name for path in tmp_path.iterdir()] == ['Admins.cfg']
@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the chat feed functionality.
+#
+
+from unittest import mock
+
+import pytest
+
+from chatfeed import chatfeed
+
+
+class MockPlayerChat(object):
+    def __init__(self, messages, player_name=None):
+        self.player_name = player_name
+        self.messages = messages
+
+
+def make_feed(*drained_chats):
+    """ Helper that returns a feed whose client returns the given chats (one per drain). """
+    client = mock.MagicMock()
+    client.get_player_chat.side_effect = list(drained_chats)
+    return chatfeed.ChatFeed(client)
+
+
+class TestChatFeed:
+    """ Test class (uses pytest) for the chatfeed module. """
+
+    def test_chat_batch(self):
+        """ Tests for ChatBatch. """
+        batch = chatfeed.ChatBatch.from_player_chat(0, {'1': MockPlayerChat(['a', 'b'], 'one')})
+
+        # Case 1: the batch reads like the dict from the RCON client, but cannot be modified.
+        assert dict(batch.items()) == {'1': chatfeed.PlayerChat('one', ('a', 'b'))}
+        assert batch['1'].messages == ('a', 'b')
+        assert batch.get_num_messages() == 2
+        with pytest.raises(TypeError):
+            batch['2'] = None
+
+        # Case 2: merging batches concatenates each player's messages in order, and merging one batch does not copy it.
+        other_batch = chatfeed.ChatBatch.from_player_chat(1, {'1': MockPlayerChat(['c']), '2': MockPlayerChat(['d'])})
+        merged = chatfeed.ChatBatch.merge([batch, other_batch])
+        assert merged.seq == 1
+        assert dict(merged.items()) == {'1': chatfeed.PlayerChat('one', ('a', 'b', 'c')),
+                                        '2': chatfeed.PlayerChat(None, ('d',))}
+        assert chatfeed.ChatBatch.merge([batch]) is batch
+        assert len(chatfeed.ChatBatch.merge([])) == 0
+
+    def test_chat_feed(self):
+        """ Tests for ChatFeed. """
+        feed = make_feed({'1': MockPlayerChat(['a'])}, {'1': MockPlayerChat(['b'])}, {'2': MockPlayerChat(['c'])})
+        first_cursor = feed.subscribe('first')
+        second_cursor = feed.subscribe('second')
+
+        # Case 1: each drain gets and clears the chat once, and every subscriber reads the same (shared) batch.
+        batch = feed.drain()
+        assert feed.squad_rcon_client.clear_player_chat.call_count == 1
+        assert first_cursor.read() is batch
+        assert second_cursor.read() is batch
+        assert len(first_cursor.read()) == 0
+
+        # Case 2: batches are kept until every subscriber read them, and a late reader gets all of them merged.
+        feed.drain()
+        assert first_cursor.read()['1'].messages == ('b',)
+        assert len(feed.batches) == 1
+        feed.drain()
+        assert dict(second_cursor.read().items()) == {'1': chatfeed.PlayerChat(None, ('b',)),
+                                                      '2': chatfeed.PlayerChat(None, ('c',))}
+        assert first_cursor.read()['2'].messages == ('c',)
+        assert len(feed.batches) == 0
+
+        # Case 3: a new subscriber only reads chat drained after it subscribed.
+        feed.squad_rcon_client.get_player_chat.side_effect = [{'3': MockPlayerChat(['d'])}]
+        feed.drain()
+        late_cursor = feed.subscribe('late')
+        assert len(late_cursor.read()) == 0
+        assert first_cursor.read()['3'].messages == ('d',)
+
+        # Case 4: skipping moves past the unread chat, and unsubscribing stops keeping batches for the cursor.
+        second_cursor.skip()
+        feed.unsubscribe(late_cursor)
+        assert len(feed.batches) == 0
+
+    def test_max_batches(self):
+        """ Tests that a subscriber that never reads does not keep batches forever. """
+        feed = chatfeed.ChatFeed(mock.MagicMock(), max_batches=2)
+        feed.squad_rcon_client.get_player_chat.return_value = {}
+        cursor = feed.subscribe('slow')
+
+        # Case 1: only the latest max_batches batches are kept, and the slow subscriber reads what is left.
+        for _ in range(5):
+            feed.drain()
+        assert [batch.seq for batch in feed.batches] == [3, 4]
+        assert cursor.read().seq == 4
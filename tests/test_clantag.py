@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the clan tag registry functionality.
+#
+
+from unittest import mock
+
+import pytest
+
+from clantag import clantag
+from players import players
+
+FP_CLAN = clantag.Clan(name='FP', tags=['[FP]', 'FP |'], team_id=1, is_admin=True)
+ABC_CLAN = clantag.Clan(name='ABC', tags=['[ABC]'], team_id=2, is_admin=False)
+NO_TEAM_CLAN = clantag.Clan(name='FPX', tags=['[FPX]'], team_id=None, is_admin=False)
+
+
+class TestClanTag:
+    """ Test class (uses pytest) for the clantag module. """
+
+    @pytest.fixture
+    def registry(self):
+        """ The fixture function to return a registry with a few clans. """
+        return clantag.ClanTagRegistry([FP_CLAN, ABC_CLAN, NO_TEAM_CLAN])
+
+    def test_aho_corasick(self):
+        """ Tests that the Aho-Corasick matcher finds every occurrence of every pattern (including overlaps). """
+        matcher = clantag.AhoCorasick(['he', 'she', 'his', 'hers', ''])
+        assert sorted(matcher.find_all('ushers')) == [(1, 1), (2, 0), (2, 3)]
+        assert sorted(matcher.find_all('ahishe')) == [(1, 2), (3, 1), (4, 0)]
+        assert list(matcher.find_all('nothing here')) == [(8, 0)]
+        assert list(matcher.find_all('')) == []
+
+    def test_match(self, registry):
+        """ Tests for match. """
+        # Case 1: names with and without tags.
+        assert registry.match('[FP] dude') == FP_CLAN
+        assert registry.match('FP | dude') == FP_CLAN
+        assert registry.match('dude[ABC]') == ABC_CLAN
+        assert registry.match('dude') is None
+        assert registry.match('') is None
+        assert registry.match(None) is None
+
+        # Case 2: the tag that appears first wins, and the longest tag wins ties.
+        assert registry.match('[ABC] [FP] dude') == ABC_CLAN
+        assert registry.match('[FPX] dude') == NO_TEAM_CLAN
+
+        # Case 3: tags are case-sensitive (like the original clan tag check).
+        assert registry.match('[fp] dude') is None
+
+    def test_lookup_is_cached(self, registry):
+        """ Tests that lookups are cached per player until their name changes. """
+        with mock.patch.object(registry, 'match', wraps=registry.match) as mock_match:
+            assert registry.is_clan_member('id1', '[FP] dude')
+            assert registry.is_admin('id1', '[FP] dude')
+            assert mock_match.call_count == 1
+            assert not registry.is_admin('id2', '[ABC] dude')
+            assert not registry.is_clan_member('id1', 'dude left the clan')
+            assert mock_match.call_count == 3
+
+        # Lookups on player records are cached on the record.
+        record = players.PlayerRecord(players.Player(0, '765', '[ABC] dude', 1, None), 0.0)
+        assert registry.lookup_record(record) == ABC_CLAN
+        record.player = record.player._replace(name='renamed')
+        assert registry.lookup_record(record) == ABC_CLAN
+
+    def test_from_tags(self):
+        """ Tests for from_tags. """
+        registry = clantag.ClanTagRegistry.from_tags(['[FP]'])
+        assert registry.is_admin('id1', '[FP]dude')
+        assert not registry.is_admin('id2', 'dude')
+
+    def test_from_filepath(self, tmp_path):
+        """ Tests for from_filepath. """
+        filepath = tmp_path / 'clans.yml'
+
+        # Case 1: a valid file.
+        filepath.write_text('clans:\n'
+                            '  - name: FP\n'
+                            '    tags: ["[FP]", "FP |"]\n'
+                            '    team: 1\n'
+                            '    admin: true\n'
+                            '  - tags: ["[ABC]"]\n'
+                            '    team: 2\n')
+        registry = clantag.ClanTagRegistry.from_filepath(filepath)
+        # The name of a clan defaults to its first tag.
+        assert registry.clans == [FP_CLAN, ABC_CLAN._replace(name='[ABC]')]
+
+        # Case 2: invalid files raise.
+        for invalid_text in ['clans:\n  - name: no tags\n', 'clans:\n  - tags: [""]\n',
+                             'clans:\n  - tags: ["[X]"]\n    team: 3\n']:
+            filepath.write_text(invalid_text)
+            with pytest.raises(ValueError):
+                clantag.ClanTagRegistry.from_filepath(filepath)
+
+    def test_clan_team_assigner(self, registry):
+        """ Tests that joining clan members are moved to their clan's team. """
+        tracker = players.PlayerTracker(mock.MagicMock())
+        dispatcher = mock.MagicMock()
+        assigner = clantag.ClanTeamAssigner(mock.MagicMock(), tracker, registry, dispatcher)
+
+        # Case 1: players already on the server when the bot starts are not moved.
+        tracker.update([players.Player(0, '1000', '[FP] already here', 2, None)])
+        assigner.run_once('current', 'next', {})
+        dispatcher.dispatch.assert_called_with([])
+
+        # Case 2: only joining clan members on the wrong team are moved.
+        tracker.update([
+            players.Player(0, '1000', '[FP] already here', 2, None),
+            players.Player(1, '1001', '[FP] wrong team', 2, None),
+            players.Player(2, '1002', '[ABC] right team', 2, None),
+            players.Player(3, '1003', '[FPX] no team', 1, None),
+            players.Player(4, '1004', 'rando', 1, None),
+        ])
+        assigner.run_once('current', 'next', {})
+        dispatcher.dispatch.assert_called_with(['AdminForceTeamChange 1001'])
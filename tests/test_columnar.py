@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the ColumnarStore functionality.
+#
+
+import array
+import os
+
+import pytest
+
+from columnar import columnar
+
+FAKE_SCHEMA = [('name', columnar.STRING_TYPE), ('value', 'd'), ('count', 'q')]
+
+
+class TestColumnarStore:
+    """ Test class (uses pytest) for the ColumnarStore class. """
+
+    def test_append_and_read(self, tmp_path):
+        """ Tests appending, flushing, and reading back rows. """
+        store = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA)
+
+        # Case 1: an empty store has no rows.
+        assert store.num_rows == 0
+        assert store.read_column('name') == []
+        assert list(store.read_column('value')) == []
+
+        # Case 2: buffered rows are not readable until they are flushed.
+        store.append({'name': 'a', 'value': 1.5, 'count': 1})
+        store.append({'name': 'b\nwith newline', 'value': 2.5, 'count': 2})
+        store.append({'name': 'a', 'value': 3.5, 'count': 3})
+        assert store.num_rows == 3
+        assert store.read_column('name') == []
+        store.flush()
+        assert store.read_column('name') == ['a', 'b\nwith newline', 'a']
+        assert store.read_column('value') == array.array('d', [1.5, 2.5, 3.5])
+        assert store.read_column('count') == array.array('q', [1, 2, 3])
+
+        # Case 3: string columns are dictionary-encoded (repeated values are stored once).
+        assert store.dictionaries['name'] == ['a', 'b\nwith newline']
+
+        # Case 4: reopening the store appends to the existing rows.
+        store = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA)
+        assert store.num_rows == 3
+        store.append({'name': 'c', 'value': 4.5, 'count': 4})
+        store.append({'name': 'a', 'value': 5.5, 'count': 5})
+        store.flush()
+        assert store.read_column('name') == ['a', 'b\nwith newline', 'a', 'c', 'a']
+        assert list(store.read_column('count')) == [1, 2, 3, 4, 5]
+
+    def test_append_bad_row(self, tmp_path):
+        """ Tests that a row with a bad or missing value is rejected without misaligning the columns. """
+        store = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA)
+
+        # Case 1: a value that does not fit its column (or a missing column) raises, and nothing is appended.
+        with pytest.raises(TypeError):
+            store.append({'name': 'bad', 'value': 1.0, 'count': None})
+        with pytest.raises(KeyError):
+            store.append({'name': 'bad', 'value': 1.0})
+        assert store.num_rows == 0
+        assert store.dictionaries['name'] == []
+
+        # Case 2: the next good row lines up in every column.
+        store.append({'name': 'good', 'value': 3.0, 'count': 3})
+        store.flush()
+        assert store.read_column('name') == ['good']
+        assert list(store.read_column('value')) == [3.0]
+        assert list(store.read_column('count')) == [3]
+
+    def test_schema_mismatch(self, tmp_path):
+        """ Tests that opening a store with a different schema raises. """
+        columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA)
+        with pytest.raises(ValueError):
+            columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA[:2])
+
+    def test_repair(self, tmp_path):
+        """ Tests that partially written rows (e.g. the bot died mid-flush) are truncated on open. """
+        store = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA)
+        store.append({'name': 'a', 'value': 1.0, 'count': 1})
+        store.flush()
+        # Simulate a flush that only wrote one of the columns.
+        with open(store.get_column_filepath('value'), 'ab') as f:
+            array.array('d', [2.0]).tofile(f)
+
+        store = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA)
+        assert store.num_rows == 1
+        assert list(store.read_column('value')) == [1.0]
+
+    def test_read_only(self, tmp_path):
+        """ Tests that a read-only store reads up to the shortest column without changing any file. """
+        # Case 1: a store that does not exist is empty, and is not created.
+        store = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA, read_only=True)
+        assert store.num_rows == 0
+        assert not (tmp_path / 'store').exists()
+
+        # Case 2: a flush in progress (one column and a partial dictionary line written) is not read nor truncated.
+        writer = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA)
+        writer.append({'name': 'a', 'value': 1.0, 'count': 1})
+        writer.flush()
+        with open(writer.get_column_filepath('value'), 'ab') as f:
+            array.array('d', [2.0]).tofile(f)
+        with open(writer.get_dictionary_filepath('name'), 'a', encoding='utf-8') as f:
+            f.write('"b')
+        value_size = os.path.getsize(writer.get_column_filepath('value'))
+        store = columnar.ColumnarStore(tmp_path / 'store', FAKE_SCHEMA, read_only=True)
+        assert store.num_rows == 1
+        assert store.read_column('name') == ['a']
+        assert list(store.read_column('value')) == [1.0]
+        assert os.path.getsize(writer.get_column_filepath('value')) == value_size
+
+        # Case 3: rows cannot be appended.
+        with pytest.raises(ValueError):
+            store.append({'name': 'a', 'value': 1.0, 'count': 1})
@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the config reloading functionality.
+#
+
+import os
+from unittest import mock
+
+import pytest
+
+from config import config
+
+FAKE_LAYERS = ['layer1', 'layer2']
+FAKE_LAYERS_URL = 'some fake layers url'
+
+
+class MockVoter(object):
+    def __init__(self):
+        self.map_config = None
+        self.voting_cooldown_s = 10.0
+        self.voting_time_duration_s = 20.0
+
+    def set_map_config(self, config, all_map_layers):
+        self.map_config = (config, all_map_layers)
+
+    def update_settings(self, voting_cooldown_s, voting_time_duration_s):
+        self.voting_cooldown_s = voting_cooldown_s
+        self.voting_time_duration_s = voting_time_duration_s
+
+
+def touch(filepath, text):
+    """ Helper that writes the given text to the filepath and bumps its mtime (so changes are always detected). """
+    filepath.write_text(text)
+    stat = os.stat(filepath)
+    os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+class TestConfig:
+    """ Test class (uses pytest) for the config module. """
+
+    def test_parse_bot_settings(self, tmp_path):
+        """ Tests for parse_bot_settings. """
+        filepath = tmp_path / 'settings.yml'
+
+        # Case 1: a valid file with all settings.
+        filepath.write_text('voting_cooldown_s: 300\nvoting_duration_s: 20.5\n')
+        assert config.parse_bot_settings(filepath) == {'voting_cooldown_s': 300.0, 'voting_duration_s': 20.5}
+
+        # Case 2: an empty file means no settings.
+        filepath.write_text('')
+        assert config.parse_bot_settings(filepath) == {}
+
+        # Case 3: invalid files raise.
+        for invalid_text in ['- not a mapping', 'unknown_key: 1', 'voting_cooldown_s: abc', 'voting_cooldown_s: -1',
+                             'voting_duration_s: 0', 'voting_duration_s: true']:
+            filepath.write_text(invalid_text)
+            with pytest.raises(ValueError):
+                config.parse_bot_settings(filepath)
+
+    def test_file_watcher(self, tmp_path):
+        """ Tests for FileWatcher. """
+        filepath = tmp_path / 'watched.yml'
+        watcher = config.FileWatcher(filepath)
+
+        # Case 1: the first check is always a change (even if the file does not exist), and later ones are not.
+        assert watcher.has_changed()
+        assert not watcher.has_changed()
+
+        # Case 2: creating, modifying, and deleting the file are all changes.
+        touch(filepath, 'a')
+        assert watcher.has_changed()
+        assert not watcher.has_changed()
+        touch(filepath, 'bb')
+        assert watcher.has_changed()
+        filepath.unlink()
+        assert watcher.has_changed()
+        assert not watcher.has_changed()
+
+    def test_config_watcher(self, tmp_path):
+        """ Tests for ConfigWatcher. """
+        rotation_filepath = tmp_path / 'rotation.yml'
+        settings_filepath = tmp_path / 'settings.yml'
+        touch(rotation_filepath, 'rotation 1')
+        touch(settings_filepath, 'voting_cooldown_s: 5')
+        voter = MockVoter()
+        watcher = config.ConfigWatcher(None, voter, rotation_filepath, FAKE_LAYERS_URL,
+                                       settings_filepath=settings_filepath)
+
+        with mock.patch('squad_map_randomizer.get_json_layers') as mock_get_layers, (
+                mock.patch('squad_map_randomizer.parse_config')) as mock_parse_config:
+            mock_get_layers.return_value = FAKE_LAYERS
+            mock_parse_config.side_effect = lambda filepath, layers: filepath.read_text()
+
+            # Case 1: the first load swaps in both configs.
+            assert watcher.reload_if_changed()
+            assert voter.map_config == ('rotation 1', FAKE_LAYERS)
+            assert voter.voting_cooldown_s == 5.0
+            assert voter.voting_time_duration_s == 20.0
+
+            # Case 2: nothing is reloaded when nothing changed.
+            watcher.run_once('current', 'next', {})
+            assert mock_parse_config.call_count == 1
+
+            # Case 3: a changed rotation is swapped in, and the layers are not fetched again.
+            touch(rotation_filepath, 'rotation 2')
+            assert watcher.reload_if_changed()
+            assert voter.map_config == ('rotation 2', FAKE_LAYERS)
+            assert mock_get_layers.call_count == 1
+
+            # Case 4: an invalid rotation keeps the previous config.
+            mock_parse_config.side_effect = ValueError('bad config')
+            touch(rotation_filepath, 'rotation 3')
+            assert not watcher.reload_if_changed()
+            assert voter.map_config == ('rotation 2', FAKE_LAYERS)
+
+            # Case 5: changed settings are swapped in, and invalid settings keep the previous settings.
+            touch(settings_filepath, 'voting_duration_s: 42')
+            assert watcher.reload_if_changed()
+            assert voter.voting_cooldown_s == 5.0
+            assert voter.voting_time_duration_s == 42.0
+            touch(settings_filepath, 'voting_duration_s: -42')
+            assert not watcher.reload_if_changed()
+            assert voter.voting_time_duration_s == 42.0
+
+    def test_config_watcher_initial_load_fails(self, tmp_path):
+        """ Tests that ConfigWatcher raises if the very first map rotation config is invalid. """
+        voter = MockVoter()
+        watcher = config.ConfigWatcher(None, voter, tmp_path / 'rotation.yml', FAKE_LAYERS_URL)
+        with mock.patch('squad_map_randomizer.get_json_layers'), (
+                mock.patch('squad_map_randomizer.parse_config')) as mock_parse_config:
+            mock_parse_config.side_effect = ValueError('bad config')
+            with pytest.raises(ValueError):
+                watcher.reload_if_changed()
+        assert voter.map_config is None
+
+    def test_fetch_map_layers(self, tmp_path):
+        """ Tests for fetch_map_layers (and the layers snapshot). """
+        snapshot_filepath = tmp_path / 'snapshots' / 'map_layers.json'
+        with mock.patch('squad_map_randomizer.get_json_layers') as mock_get_layers:
+            mock_get_layers.return_value = FAKE_LAYERS
+
+            # Case 1: without a snapshot, the layers are fetched and then saved to the snapshot.
+            assert config.load_layers_snapshot(snapshot_filepath, FAKE_LAYERS_URL) is None
+            assert config.fetch_map_layers(FAKE_LAYERS_URL, snapshot_filepath) == FAKE_LAYERS
+            assert config.load_layers_snapshot(snapshot_filepath, FAKE_LAYERS_URL) == FAKE_LAYERS
+            assert mock_get_layers.call_count == 1
+
+            # Case 2: the layers are loaded from the snapshot instead of fetched.
+            assert config.fetch_map_layers(FAKE_LAYERS_URL, snapshot_filepath) == FAKE_LAYERS
+            assert mock_get_layers.call_count == 1
+
+            # Case 3: a snapshot taken from a different URL is ignored.
+            assert config.load_layers_snapshot(snapshot_filepath, 'another url') is None
+
+            # Case 4: an unreadable snapshot is ignored (and replaced by the next fetch).
+            touch(snapshot_filepath, '{not json')
+            assert config.load_layers_snapshot(snapshot_filepath, FAKE_LAYERS_URL) is None
+            assert config.fetch_map_layers(FAKE_LAYERS_URL, snapshot_filepath) == FAKE_LAYERS
+            assert mock_get_layers.call_count == 2
+            assert config.load_layers_snapshot(snapshot_filepath, FAKE_LAYERS_URL) == FAKE_LAYERS
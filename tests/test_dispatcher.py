@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the CommandDispatcher functionality.
+#
+
+import contextlib
+import threading
+import time
+
+import pytest
+
+from healthcheck import healthcheck
+from plugin import dispatcher
+
+# How long each fake RCON command takes (in seconds).
+FAKE_ROUND_TRIP_S = 0.05
+# How long a hung fake RCON command takes (in seconds), well past the deadline of the extra connections.
+FAKE_HANG_S = 2.0
+FAKE_DEADLINE_S = 0.3
+
+
+class FakeRconClient(object):
+    """ A fake RCON connection that takes a round trip per command and fails if used by two threads at once. """
+
+    def __init__(self, sent_commands, hangs=False):
+        self.sent_commands = sent_commands
+        self.in_use = threading.Lock()
+        # Whether the 'hang' command hangs on this connection (like a dead socket).
+        self.hangs = hangs
+
+    def exec_command(self, command):
+        assert self.in_use.acquire(blocking=False), 'Connection used by two threads at once!'
+        try:
+            time.sleep(FAKE_ROUND_TRIP_S)
+            if command == 'hang' and self.hangs:
+                time.sleep(FAKE_HANG_S)
+            if command == 'fail':
+                raise ConnectionError('fake failure')
+            self.sent_commands.append(command)
+            return f'response to {command}'
+        finally:
+            self.in_use.release()
+
+
+class TestDispatcher:
+    """ Test class (uses pytest) for the dispatcher module. """
+
+    @pytest.fixture
+    def sent_commands(self):
+        return []
+
+    @pytest.fixture
+    def opened_clients(self):
+        return []
+
+    @pytest.fixture
+    def connection_factory(self, sent_commands, opened_clients):
+        """ The fixture function to return a factory of fake RCON connections. """
+        @contextlib.contextmanager
+        def factory():
+            client = FakeRconClient(sent_commands)
+            opened_clients.append(client)
+            yield client
+            opened_clients.remove(client)
+        return factory
+
+    def test_rate_limiter(self):
+        """ Tests that the rate limiter allows a burst and then limits the rate. """
+        limiter = dispatcher.RateLimiter(max_per_s=100.0, burst=5)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+        assert time.monotonic() - start < 0.05
+        for _ in range(10):
+            limiter.acquire()
+        assert time.monotonic() - start >= 0.09
+
+    def test_dispatch_concurrently(self, sent_commands, opened_clients, connection_factory):
+        """ Tests that a burst is sent concurrently over several connections. """
+        commands = [f'command {i}' for i in range(16)]
+        with dispatcher.CommandDispatcher(FakeRconClient(sent_commands), connection_factory, num_connections=8,
+                                          max_commands_per_s=1000.0) as command_dispatcher:
+            start = time.monotonic()
+            results = command_dispatcher.dispatch(commands)
+            duration = time.monotonic() - start
+
+            # Case 1: every command is sent once and the results are in the same order as the commands.
+            assert sorted(sent_commands) == sorted(commands)
+            assert results == [f'response to {command}' for command in commands]
+            # Case 2: 16 round trips over 8 connections take about 2 round trips (not 16).
+            assert duration < FAKE_ROUND_TRIP_S * 8
+            assert len(opened_clients) == 7
+
+            # Case 3: failed commands return their exception.
+            results = command_dispatcher.dispatch(['ok', 'fail'])
+            assert results[0] == 'response to ok'
+            assert isinstance(results[1], ConnectionError)
+
+            # Case 4: an empty burst does nothing.
+            assert command_dispatcher.dispatch([]) == []
+        # The extra connections are closed.
+        assert not opened_clients
+
+    def test_dispatch_drops_failed_clients(self, sent_commands, opened_clients):
+        """ Tests that an extra connection that hangs misses its deadline, and is dropped and reopened. """
+        @contextlib.contextmanager
+        def factory():
+            # The first extra connection hangs, the ones opened later do not.
+            client = FakeRconClient(sent_commands, hangs=not opened_clients)
+            opened_clients.append(client)
+            with healthcheck.DeadlineClient(client, deadline_s=FAKE_DEADLINE_S) as deadline_client:
+                yield deadline_client
+
+        with dispatcher.CommandDispatcher(FakeRconClient(sent_commands), factory, num_connections=2,
+                                          max_commands_per_s=1000.0, min_burst_size=2) as command_dispatcher:
+            # Case 1: the hung command fails once its deadline passes (instead of blocking the burst), and the other
+            # commands are still sent over the main connection.
+            start = time.monotonic()
+            results = command_dispatcher.dispatch(['hang'] * 6)
+            assert time.monotonic() - start < FAKE_HANG_S
+            assert sum(isinstance(result, healthcheck.RconDeadlineExceeded) for result in results) == 1
+            assert sent_commands.count('hang') == 5
+
+            # Case 2: the failed connection was dropped, and a new one is opened for the next burst.
+            hung_client = opened_clients[0]
+            command_dispatcher.dispatch(['a', 'b'])
+            assert len(command_dispatcher.extra_clients) == 1
+            assert command_dispatcher.extra_clients[0][0].client is not hung_client
+
+    def test_dispatch_reopen_interval(self, sent_commands):
+        """ Tests that extra connections that fail to open are not retried until the reopen interval passes. """
+        attempts = []
+
+        def failing_factory():
+            attempts.append(1)
+            raise ConnectionError('fake failure')
+
+        command_dispatcher = dispatcher.CommandDispatcher(FakeRconClient(sent_commands), failing_factory,
+                                                          num_connections=4, reopen_interval_s=60.0,
+                                                          min_burst_size=2)
+        assert command_dispatcher.dispatch(['a', 'b']) == ['response to a', 'response to b']
+        assert command_dispatcher.dispatch(['c']) == ['response to c']
+        assert len(attempts) == 1
+
+    def test_dispatch_small_and_idle(self, sent_commands, opened_clients, connection_factory):
+        """ Tests that small bursts do not open extra connections, and that idle extra connections are closed. """
+        with dispatcher.CommandDispatcher(FakeRconClient(sent_commands), connection_factory, num_connections=8,
+                                          max_commands_per_s=1000.0, min_burst_size=4,
+                                          idle_timeout_s=0.2) as command_dispatcher:
+            # Case 1: a small burst only uses the main connection.
+            assert command_dispatcher.dispatch(['a', 'b', 'c']) == ['response to a', 'response to b', 'response to c']
+            assert not opened_clients
+
+            # Case 2: a larger burst only opens as many extra connections as it can use.
+            command_dispatcher.dispatch(['a', 'b', 'c', 'd'])
+            assert len(opened_clients) == 3
+
+            # Case 3: the extra connections stay open until they are idle for idle_timeout_s.
+            command_dispatcher.close_idle_clients()
+            assert len(opened_clients) == 3
+            time.sleep(0.3)
+            command_dispatcher.close_idle_clients()
+            assert not opened_clients
+
+    def test_dispatch_without_factory(self, sent_commands):
+        """ Tests that without a connection factory, only the main connection is used. """
+        command_dispatcher = dispatcher.CommandDispatcher(FakeRconClient(sent_commands))
+        assert command_dispatcher.dispatch(['a', 'b']) == ['response to a', 'response to b']
+        assert sent_commands == ['a', 'b']
@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+# A testing class to test the event log functionality.
+#
+
+import contextlib
+import os
+from unittest import mock
+
+import pytest
+
+from chatfeed import chatfeed
+from eventlog import eventlog
+from plugin import dispatcher
+
+
+class FakeClock:
+    """ A clock that only moves when told to. """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestEventLog:
+    """ Test class (uses pytest) for the eventlog module. """
+
+    def test_record_and_read(self, tmp_path):
+        """ Tests for EventLog.record and read_events. """
+        clock = FakeClock()
+
+        # Case 1: an empty (or missing) directory has no events.
+        assert list(eventlog.read_events(tmp_path / 'missing')) == []
+
+        # Case 2: the events are read back in order, with their fields.
+        with eventlog.EventLog(tmp_path, clock=clock) as event_log:
+            event_log.record(eventlog.MAP_CHANGE_EVENT, previous_map=None, current_map='Narva', next_map='Gorodok')
+            clock.now += 1.0
+            event_log.record(eventlog.CHAT_EVENT, player_id='1', player_name='bob', messages=['hi', 'ünïcode'])
+            event_log.record(eventlog.COMMAND_EVENT, timestamp=5.0, command='AdminBroadcast hi', succeeded=True)
+            with pytest.raises(ValueError):
+                event_log.record('bogus')
+        events = list(eventlog.read_events(tmp_path))
+        assert events == [
+            eventlog.Event(1000.0, eventlog.MAP_CHANGE_EVENT,
+                           {'previous_map': None, 'current_map': 'Narva', 'next_map': 'Gorodok'}),
+            eventlog.Event(1001.0, eventlog.CHAT_EVENT, {'player_id': '1', 'player_name': 'bob',
+                                                         'messages': ['hi', 'ünïcode']}),
+            eventlog.Event(5.0, eventlog.COMMAND_EVENT, {'command': 'AdminBroadcast hi', 'succeeded': True}),
+        ]
+
+        # Case 3: the events can be filtered by type and time.
+        assert [event.event_type for event in eventlog.read_events(tmp_path, event_types={eventlog.CHAT_EVENT})] == [
+            eventlog.CHAT_EVENT]
+        assert [event.timestamp for event in eventlog.read_events(tmp_path, since=1000.5)] == [1001.0]
+
+        # Case 4: a new writer starts a new segment after the existing ones.
+        with eventlog.EventLog(tmp_path, clock=clock) as event_log:
+            event_log.record(eventlog.CHAT_EVENT, player_id='2', player_name='alice', messages=['later'])
+        assert len(eventlog.get_segment_filepaths(tmp_path)) == 2
+        assert list(eventlog.read_events(tmp_path))[-1].fields['player_name'] == 'alice'
+
+    def test_segment_rollover(self, tmp_path):
+        """ Tests that segments roll over by size and by age. """
+        clock = FakeClock()
+
+        # Case 1: a segment rolls over once it is too big.
+        with eventlog.EventLog(tmp_path / 'size', max_segment_bytes=100, clock=clock) as event_log:
+            for index in range(10):
+                event_log.record(eventlog.COMMAND_EVENT, command=f'AdminBroadcast {index}', succeeded=True)
+        filepaths = eventlog.get_segment_filepaths(tmp_path / 'size')
+        assert len(filepaths) == 5
+        assert all(os.path.getsize(filepath) < 200 for filepath in filepaths)
+        assert [event.fields['command'] for event in eventlog.read_events(tmp_path / 'size')] == [
+            f'AdminBroadcast {index}' for index in range(10)]
+
+        # Case 2: a segment rolls over once it is too old (and no empty segments are written while idle).
+        with eventlog.EventLog(tmp_path / 'age', max_segment_age_s=60.0, clock=clock) as event_log:
+            event_log.record(eventlog.COMMAND_EVENT, command='first', succeeded=True)
+            clock.now += 59.0
+            event_log.record(eventlog.COMMAND_EVENT, command='second', succeeded=True)
+            clock.now += 3600.0
+            event_log.record(eventlog.COMMAND_EVENT, command='third', succeeded=True)
+        assert len(eventlog.get_segment_filepaths(tmp_path / 'age')) == 2
+
+    def test_read_corrupt_segment(self, tmp_path):
+        """ Tests that reading stops at a torn or corrupt record. """
+        with eventlog.EventLog(tmp_path) as event_log:
+            for index in range(3):
+                event_log.record(eventlog.COMMAND_EVENT, command=f'command {index}', succeeded=True)
+        filepath = eventlog.get_segment_filepaths(tmp_path)[0]
+        contents = open(filepath, 'rb').read()
+        record_size = (len(contents) - len(eventlog.SEGMENT_MAGIC)) // 3
+
+        # Case 1: a torn last record (e.g. the bot was killed mid-write) is skipped.
+        with open(filepath, 'wb') as f:
+            f.write(contents[:-5])
+        assert [event.fields['command'] for event in eventlog.read_segment(filepath)] == ['command 0', 'command 1']
+
+        # Case 2: reading stops at a corrupt record.
+        corrupt_contents = bytearray(contents)
+        corrupt_contents[len(eventlog.SEGMENT_MAGIC) + record_size + eventlog.RECORD_HEADER.size] ^= 0xFF
+        with open(filepath, 'wb') as f:
+            f.write(corrupt_contents)
+        assert [event.fields['command'] for event in eventlog.read_segment(filepath)] == ['command 0']
+
+        # Case 3: a file that is not a segment is rejected, and an empty one has no events.
+        with open(filepath, 'wb') as f:
+            f.write(b'not a segment')
+        with pytest.raises(ValueError):
+            list(eventlog.read_segment(filepath))
+        with open(filepath, 'wb') as f:
+            pass
+        assert list(eventlog.read_segment(filepath)) == []
+
+    def test_event_log_client(self, tmp_path):
+        """ Tests for EventLogClient. """
+        client = mock.MagicMock()
+        client.exec_command.side_effect = ['ok', OSError('connection lost')]
+        with eventlog.EventLog(tmp_path) as event_log:
+            event_log_client = eventlog.EventLogClient(client, event_log)
+
+            # Case 1: commands are forwarded and recorded, including the ones that fail.
+            assert event_log_client.exec_command('AdminBroadcast hi') == 'ok'
+            with pytest.raises(OSError):
+                event_log_client.exec_command('ShowNextMap')
+
+            # Case 2: everything else is forwarded as is.
+            event_log_client.get_current_and_next_map()
+            client.get_current_and_next_map.assert_called_once_with()
+        assert [event.fields for event in eventlog.read_events(tmp_path)] == [
+            {'command': 'AdminBroadcast hi', 'succeeded': True}, {'command': 'ShowNextMap', 'succeeded': False}]
+
+    def test_event_log_client_dispatcher(self, tmp_path):
+        """ Tests that the commands sent over the dispatcher's extra connections are recorded too. """
+        with eventlog.EventLog(tmp_path) as event_log:
+            @contextlib.contextmanager
+            def factory():
+                yield eventlog.EventLogClient(mock.MagicMock(), event_log)
+
+            command_dispatcher = dispatcher.CommandDispatcher(
+                eventlog.EventLogClient(mock.MagicMock(), event_log), factory, num_connections=4)
+            commands = [f'AdminForceTeamChange {index}' for index in range(20)]
+            command_dispatcher.dispatch(commands)
+            command_dispatcher.close()
+        assert sorted(event.fields['command'] for event in eventlog.read_events(tmp_path)) == sorted(commands)
+
+    def test_event_recorder(self, tmp_path):
+        """ Tests for EventRecorder. """
+        with eventlog.EventLog(tmp_path) as event_log:
+            recorder = eventlog.EventRecorder(mock.MagicMock(), event_log)
+
+            # Case 1: the first map is recorded as a change, and the chat is recorded per player.
+            recorder.run_once('Narva', 'Gorodok', chatfeed.ChatBatch(0, {
+                '1': chatfeed.PlayerChat('bob', ('hi', 'gg'))}))
+            # Case 2: the events are flushed every tick (readable while the log is still open).
+            assert [event.event_type for event in eventlog.read_events(tmp_path)] == [eventlog.MAP_CHANGE_EVENT,
+                                                                                     eventlog.CHAT_EVENT]
+
+            # Case 3: the same map is not recorded again.
+            recorder.run_once('Narva', 'Gorodok', chatfeed.ChatBatch(1, {}))
+            recorder.run_once('Gorodok', 'Narva', chatfeed.ChatBatch(2, {}))
+        events = list(eventlog.read_events(tmp_path))
+        assert len(events) == 3
+        assert events[-1].fields == {'previous_map': 'Narva', 'current_map': 'Gorodok', 'next_map': 'Narva'}
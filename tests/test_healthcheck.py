@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the health check functionality.
+#
+
+import json
+import pathlib
+import socket
+import struct
+import subprocess
+import sys
+import threading
+from unittest import mock
+
+import pytest
+
+from healthcheck import healthcheck
+
+# A script that leaves a DeadlineClient while a call on it is hung forever (on a client without a socket), and exits.
+HUNG_CALL_SCRIPT = """
+import threading
+from unittest import mock
+from healthcheck import healthcheck
+client = mock.MagicMock(spec=['exec_command'])
+client.exec_command.side_effect = lambda command: threading.Event().wait()
+try:
+    with healthcheck.DeadlineClient(client, deadline_s=0.05, max_missed_deadlines=1) as deadline_client:
+        deadline_client.exec_command('ListPlayers')
+except healthcheck.RconStalled:
+    pass
+"""
+
+
+def serve_rcon_auth(server_sock):
+    """ Helper that accepts one RCON connection and accepts its auth packet, and then never replies to anything. """
+    conn, _ = server_sock.accept()
+    size, pkt_id, _ = struct.unpack('<3i', conn.recv(12))
+    conn.recv(size - 8)
+    for pkt_type in (0, 2):
+        conn.sendall(struct.pack('<3i2s', 10, pkt_id, pkt_type, b''))
+    return conn
+
+
+class TestHealthCheck:
+    """ Test class (uses pytest) for the healthcheck module. """
+
+    def test_latency_tracker(self):
+        """ Tests for LatencyTracker. """
+        tracker = healthcheck.LatencyTracker(max_samples=100)
+
+        # Case 1: no samples means no percentiles.
+        assert tracker.get_percentiles() == {}
+
+        # Case 2: nearest-rank percentiles of each operation.
+        for latency_s in range(1, 101):
+            tracker.record('exec_command', latency_s / 1000)
+        tracker.record('get_player_chat', 0.5)
+        assert tracker.get_percentiles((50, 90, 100)) == {
+            'exec_command': {'num_samples': 100, 'p50_s': 0.05, 'p90_s': 0.09, 'p100_s': 0.1},
+            'get_player_chat': {'num_samples': 1, 'p50_s': 0.5, 'p90_s': 0.5, 'p100_s': 0.5},
+        }
+
+        # Case 3: only the latest samples are kept.
+        tracker.record('exec_command', 1.0)
+        assert tracker.get_percentiles((0, 100))['exec_command'] == {'num_samples': 100, 'p0_s': 0.002, 'p100_s': 1.0}
+
+    def test_deadline_client(self):
+        """ Tests for DeadlineClient. """
+        release = threading.Event()
+        client = mock.MagicMock()
+        client.exec_command.return_value = 'ok'
+        client.get_player_chat.side_effect = lambda: release.wait(5)
+        client.address = 'localhost'
+
+        with healthcheck.DeadlineClient(client, deadline_s=0.05, max_missed_deadlines=2) as deadline_client:
+            # Case 1: calls and attributes are forwarded, and the latency of each call is recorded.
+            assert deadline_client.exec_command('ListPlayers') == 'ok'
+            client.exec_command.assert_called_once_with('ListPlayers')
+            assert deadline_client.address == 'localhost'
+            assert deadline_client.latency_tracker.get_percentiles()['exec_command']['num_samples'] == 1
+
+            # Case 2: exceptions raised by the client are raised to the caller.
+            client.clear_player_chat.side_effect = ConnectionError('closed')
+            with pytest.raises(ConnectionError):
+                deadline_client.clear_player_chat()
+
+            # Case 3: a hung call misses its deadline, and so do the calls queued behind it until the client is dead.
+            with pytest.raises(healthcheck.RconDeadlineExceeded):
+                deadline_client.get_player_chat()
+            assert not deadline_client.is_dead()
+            with pytest.raises(healthcheck.RconStalled):
+                deadline_client.exec_command('ListPlayers')
+            assert deadline_client.is_dead()
+
+            # Case 4: a dead client refuses any more calls.
+            release.set()
+            with pytest.raises(healthcheck.RconStalled):
+                deadline_client.exec_command('ListPlayers')
+
+    def test_health_monitor(self, tmp_path):
+        """ Tests for HealthMonitor. """
+        client = mock.MagicMock()
+        deadline_client = healthcheck.DeadlineClient(client)
+        on_stall = mock.MagicMock()
+        export_filepath = tmp_path / 'latency.json'
+        monitor = healthcheck.HealthMonitor(deadline_client, stall_timeout_s=0.2, probe_interval_s=60.0,
+                                            export_interval_s=0.0, export_filepath=export_filepath, on_stall=on_stall)
+
+        with monitor:
+            # Case 1: the first tick probes the latency and exports the percentiles.
+            monitor.run_once('current', 'next', {})
+            client.exec_command.assert_called_once_with(healthcheck.PROBE_COMMAND)
+            with open(export_filepath) as f:
+                percentiles = json.load(f)
+            # The probe is only recorded under PROBE_COMMAND (not as another exec_command).
+            assert percentiles[healthcheck.PROBE_COMMAND]['num_samples'] == 1
+            assert 'exec_command' not in percentiles
+            monitor.check()
+
+            # Case 2: the probe is not sent again until it is due.
+            monitor.run_once('current', 'next', {})
+            client.exec_command.assert_called_once()
+
+            # Case 3: a loop that stops beating is detected as stalled.
+            assert monitor.stalled.wait(2.0)
+            on_stall.assert_called_once()
+            with pytest.raises(healthcheck.RconStalled):
+                monitor.check()
+        deadline_client.close()
+
+    def test_deadline_client_interrupt(self):
+        """ Tests that DeadlineClient.interrupt() unblocks a call hung on the RCON socket. """
+        client_sock, server_sock = socket.socketpair()
+        client = mock.MagicMock()
+        client._sock = client_sock
+        # The server never replies, so the call hangs on recv() until the socket is shut down.
+        client.exec_command.side_effect = lambda command: client_sock.recv(1024)
+        deadline_client = healthcheck.DeadlineClient(client, deadline_s=0.2, max_missed_deadlines=10)
+        try:
+            # Case 1: the hung call misses its deadline, but the client is not dead yet.
+            with pytest.raises(healthcheck.RconDeadlineExceeded):
+                deadline_client.exec_command('ListPlayers')
+            assert not deadline_client.is_dead()
+
+            # Case 2: once interrupted, the hung call returns and the client is dead (so the bot reconnects).
+            deadline_client.interrupt()
+            deadline_client.submit(lambda: None).result(timeout=2.0)
+            assert deadline_client.is_dead()
+            with pytest.raises(healthcheck.RconStalled):
+                deadline_client.exec_command('ListPlayers')
+
+            # Case 3: interrupting a client without a socket only marks it as dead.
+            other_client = healthcheck.DeadlineClient(mock.MagicMock(spec=['exec_command']))
+            other_client.interrupt()
+            assert other_client.is_dead()
+            other_client.close()
+        finally:
+            deadline_client.close()
+            client_sock.close()
+            server_sock.close()
+
+    def test_deadline_client_close(self):
+        """ Tests that closing a DeadlineClient with a hung call ends the call and its worker thread. """
+        client_sock, server_sock = socket.socketpair()
+        client = mock.MagicMock()
+        client._sock = client_sock
+        client.exec_command.side_effect = lambda command: client_sock.recv(1024)
+        try:
+            # Case 1: the hung call ends once the client is closed (instead of leaking the worker thread).
+            with healthcheck.DeadlineClient(client, deadline_s=0.05, max_missed_deadlines=1) as deadline_client:
+                with pytest.raises(healthcheck.RconStalled):
+                    deadline_client.exec_command('ListPlayers')
+            deadline_client.thread.join(2.0)
+            assert not deadline_client.thread.is_alive()
+        finally:
+            client_sock.close()
+            server_sock.close()
+
+        # Case 2: a call that never returns (and cannot be interrupted) does not keep the process from exiting.
+        result = subprocess.run([sys.executable, '-c', HUNG_CALL_SCRIPT], cwd=pathlib.Path(__file__).parent.parent,
+                                timeout=10)
+        assert result.returncode == 0
+
+    def test_rcon_connection_socket(self):
+        """ Tests that RconConnection still keeps its socket where shutdown_socket() expects it. """
+        rcon = pytest.importorskip('srcds.rcon')
+        if not hasattr(rcon, 'RconConnection'):
+            pytest.skip('pysrcds is not installed.')
+        server_sock = socket.socket()
+        server_sock.bind(('127.0.0.1', 0))
+        server_sock.listen(1)
+        conn = None
+        try:
+            accepted = []
+            thread = threading.Thread(target=lambda: accepted.append(serve_rcon_auth(server_sock)))
+            thread.start()
+            raw_client = rcon.RconConnection('127.0.0.1', port=server_sock.getsockname()[1], password='password')
+            thread.join()
+            conn = accepted[0]
+            assert isinstance(getattr(raw_client, healthcheck.RCON_SOCKET_ATTRIBUTE, None), socket.socket)
+
+            # The server never replies to the command, so it only ends once the client is interrupted.
+            deadline_client = healthcheck.DeadlineClient(raw_client, deadline_s=0.2, max_missed_deadlines=10)
+            future = deadline_client.submit(raw_client.exec_command, 'ListPlayers')
+            with pytest.raises(healthcheck.RconDeadlineExceeded):
+                deadline_client.exec_command('ListPlayers')
+            deadline_client.interrupt()
+            with pytest.raises(OSError):
+                future.result(timeout=2.0)
+            deadline_client.close()
+        finally:
+            if conn is not None:
+                conn.close()
+            server_sock.close()
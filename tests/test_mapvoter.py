@@ -19,7 +19,9 @@ import pytest
 import random
 from unittest import mock
 
+from eventlog import eventlog
 from mapvoter import mapvoter
+from mapvoter import votehistory
 
 # Some constants used in mock objects.
 FAKE_ROTATION_FILEPATH = 'some ignored fake filepath'
@@ -72,6 +74,16 @@ class TestMapVoter:
                 mock_get_layers.return_value = RETURNED_LAYERS
                 assert mapvoter.get_map_candidates(CONFIG, ALL_LAYERS) == RETURNED_LAYERS + [mapvoter.REDO_VOTE_OPTION]
 
+        # Excluded layers are avoided by choosing the candidates again, and are only kept when they cannot be avoided.
+        with mock.patch('squad_map_randomizer.get_map_rotation') as _:
+            with mock.patch('squad_map_randomizer.get_layers') as mock_get_layers:
+                mock_get_layers.side_effect = [['1', '2'], ['2', '3']]
+                assert mapvoter.get_map_candidates(CONFIG, ALL_LAYERS, {'1'}) == ['2', '3', mapvoter.REDO_VOTE_OPTION]
+                mock_get_layers.side_effect = None
+                mock_get_layers.return_value = ['1', '2']
+                assert mapvoter.get_map_candidates(CONFIG, ALL_LAYERS, {'1'}) == ['1', '2', mapvoter.REDO_VOTE_OPTION]
+                assert mock_get_layers.call_count == 2 + mapvoter.MAX_CANDIDATE_ATTEMPTS
+
     def test_format_candidate_maps(self):
         """ Tests the format_candidate_maps function. """
         # Case 1: test multiple maps.
@@ -164,6 +176,22 @@ class TestMapVoter:
         assert voter.time_since_map_vote == TIME_NOW
         assert len(voter.players_requesting_map_vote) == 0
 
+    def test_set_map_config(self, voter):
+        """ Tests for set_map_config and update_settings. """
+        # Case 1: no map config is set on construction.
+        assert voter.map_config is None
+
+        # Case 2: setting a map config swaps in both the config and the layers together.
+        voter.set_map_config('config', ['layer1', 'layer2'])
+        assert voter.map_config == ('config', ['layer1', 'layer2'])
+        voter.set_map_config('new config', ['layer3'])
+        assert voter.map_config == ('new config', ['layer3'])
+
+        # Case 3: updating settings changes the cooldown and duration of the running voter.
+        voter.update_settings(voting_cooldown_s=1.0, voting_time_duration_s=2.0)
+        assert voter.voting_cooldown_s == 1.0
+        assert voter.voting_time_duration_s == 2.0
+
     def test_reset_map_vote(self, voter):
         """ Tests for reset_map_vote. """
         # Case 1: When a map vote is reset, the time_since_map_vote should always be later than the original (before
@@ -347,6 +375,47 @@ class TestMapVoter:
         # Check that the redo_requested flag was NOT set.
         assert not voter.redo_requested
 
+    def test_start_map_vote_shares_chat(self, voter):
+        """ Tests that start_map_vote only counts the chat sent during the vote, and leaves all chat for the feed. """
+        other_cursor = voter.chat_feed.subscribe('other')
+        voter.squad_rcon_client.get_player_chat.side_effect = [
+            {'id1': MockPlayerChat(['!mortar A1 B2'])},
+            {'id1': MockPlayerChat(['2']), 'id2': MockPlayerChat(['2'])},
+        ]
+        with mock.patch('mapvoter.mapvoter.time.sleep'):
+            voter.start_map_vote(FAKE_CANDIDATE_MAPS)
+
+        # Case 1: only the chat sent during the vote was counted (the chat before it is not a vote).
+        assert mapvoter.VOTE_RESULT_MESSAGE_TEMPLATE.format(FAKE_CANDIDATE_MAPS[2], 2) in (
+            voter.squad_rcon_client.exec_command.call_args_list[3][0][0])
+
+        # Case 2: the other subscribers still get all the chat drained during the vote.
+        assert other_cursor.read()['id1'].messages == ('!mortar A1 B2', '2')
+        assert len(voter.chat_feed.cursors) == 1
+
+    def test_start_map_vote_records_history(self, voter, tmp_path):
+        """ Tests that start_map_vote records the vote in the vote history and the event log. """
+        voter.vote_history = votehistory.VoteHistory(tmp_path / 'history.sqlite3', 'server')
+        voter.event_log = eventlog.EventLog(tmp_path / 'events')
+        voter.squad_rcon_client.get_player_chat.side_effect = [
+            {}, {'id1': MockPlayerChat(['1']), 'id2': MockPlayerChat(['0']), 'id3': MockPlayerChat(['1'])}]
+        with mock.patch('mapvoter.mapvoter.time.sleep'):
+            voter.start_map_vote(FAKE_CANDIDATE_MAPS)
+
+        # Case 1: the counts, ballots and outcome were recorded, and the losing candidates are now excluded.
+        assert voter.vote_history.get_outcome_counts() == {votehistory.WINNER_OUTCOME: 1}
+        assert voter.vote_history.get_layer_statistics()[FAKE_CANDIDATE_MAPS[1]] == {
+            'num_candidacies': 1, 'num_wins': 1, 'num_votes': 2}
+        assert voter.get_excluded_layers() == {FAKE_CANDIDATE_MAPS[0], FAKE_CANDIDATE_MAPS[2]}
+        voter.vote_history.close()
+
+        # Case 2: the result was recorded in the event log too.
+        voter.event_log.close()
+        events = list(eventlog.read_events(tmp_path / 'events'))
+        assert [event.event_type for event in events] == [eventlog.VOTE_RESULT_EVENT]
+        assert events[0].fields['winner_map'] == FAKE_CANDIDATE_MAPS[1]
+        assert events[0].fields['counts'] == [1, 2, 0]
+
     def test_start_map_vote_redo(self, voter):
         """ Tests for start_map_vote when the vote is for the redo option. """
         # Start a map vote that succeeds. We have to mock get_candidate_maps so we know what we voted for.
@@ -541,25 +610,23 @@ class TestMapVoter:
         MAP_LAYERS_URL = 'some fake layers url'
         MOCK_MAP_LAYERS = ['this is', 'some', 'mock', 'layers', 'this last one should never appear']
 
-        # Case 1: expect errors when some kwargs are missing.
-        # Mock everything inside of the function that reaches outside.
-        with mock.patch('squad_map_randomizer.get_json_layers'), (
-            mock.patch('squad_map_randomizer.parse_config')), (
-            mock.patch.object(voter.squad_rcon_client, 'exec_command')) as mock_exec_command, (
+        MOCK_CONFIG = 'some mock config'
+        kwargs = {'config_filepath': CONFIG_FILEPATH, 'map_layers_url': MAP_LAYERS_URL}
+
+        # Case 1: nothing happens when no map config has been loaded yet.
+        with mock.patch.object(voter.squad_rcon_client, 'exec_command') as mock_exec_command, (
             mock.patch.object(voter, 'start_map_vote')) as mock_start_map_vote, (
-                mock.patch('mapvoter.mapvoter.get_map_candidates')) as mock_get_candidates:
+            mock.patch('mapvoter.mapvoter.get_map_candidates')) as mock_get_candidates, (
+                mock.patch.object(voter, 'should_start_map_vote')) as mock_should_start:
+            mock_should_start.return_value = True
 
-            # Fails if all kwargs are missing.
-            kwargs = {}
-            with pytest.raises(KeyError):
-                voter.run_once(CURRENT_MAP, NEXT_MAP, NO_VOTE_PLAYER_CHAT, **kwargs)
-            # Fails since some kwargs are missing.
-            kwargs.update({'config_filepath': CONFIG_FILEPATH})
-            with pytest.raises(KeyError):
-                voter.run_once(CURRENT_MAP, NEXT_MAP, NO_VOTE_PLAYER_CHAT, **kwargs)
-            # No longer fails when all kwargs included.
-            kwargs.update({'map_layers_url': MAP_LAYERS_URL})
-            voter.run_once(CURRENT_MAP, NEXT_MAP, NO_VOTE_PLAYER_CHAT, **kwargs)
+            voter.run_once(CURRENT_MAP, CURRENT_MAP, HAS_VOTE_PLAYER_CHAT, **kwargs)
+            assert mock_exec_command.call_count == 0
+            assert mock_start_map_vote.call_count == 0
+            assert mock_get_candidates.call_count == 0
+
+        # The config loaded from now on is used by all the remaining cases.
+        voter.set_map_config(MOCK_CONFIG, MOCK_MAP_LAYERS)
 
         # Case 2: Run normally where current and next map are the same.
         with mock.patch('squad_map_randomizer.get_json_layers'), (
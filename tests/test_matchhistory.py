@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the match history recorder and its analysis.
+#
+
+from unittest import mock
+
+import numpy as np
+
+from clantag import clantag
+from columnar import columnar
+from matchhistory import analysis
+from matchhistory import matchhistory
+from players import players
+
+FAKE_PLAYERS = [
+    players.Player(0, '76561198000000000', '[FP] leader', 1, 1),
+    players.Player(1, '76561198000000001', 'rando', 1, None),
+    players.Player(2, '76561198000000002', 'other rando', 2, 2),
+]
+
+
+def append_fake_round(store, layer, duration_s, team1_tickets=matchhistory.UNKNOWN,
+                      team2_tickets=matchhistory.UNKNOWN, winner_team=matchhistory.UNKNOWN, players_per_team=40):
+    store.append({
+        'layer': layer, 'started_at': 0.0, 'ended_at': duration_s, 'duration_s': duration_s,
+        'team1_players': players_per_team, 'team2_players': players_per_team,
+        'team1_clan_members': 5, 'team2_clan_members': 0,
+        'team1_tickets': team1_tickets, 'team2_tickets': team2_tickets, 'winner_team': winner_team,
+    })
+
+
+class TestMatchHistory:
+    """ Test class (uses pytest) for the matchhistory and analysis modules. """
+
+    def test_match_recorder(self, tmp_path):
+        """ Tests for MatchRecorder. """
+        client = mock.MagicMock()
+        tracker = players.PlayerTracker(client)
+        tracker.update(FAKE_PLAYERS)
+        store = columnar.ColumnarStore(tmp_path / 'history', matchhistory.MATCH_HISTORY_SCHEMA)
+        registry = clantag.ClanTagRegistry.from_tags(['[FP]'])
+        recorder = matchhistory.MatchRecorder(client, store, tracker, registry)
+
+        # Case 1: the round that was already running when the bot started is not recorded.
+        with mock.patch('time.time', return_value=100.0):
+            recorder.run_once('first', 'second', {})
+            recorder.run_once('second', 'third', {})
+        assert store.num_rows == 0
+
+        # Case 2: a full round is recorded with the team compositions from before the map changed.
+        with mock.patch('time.time', return_value=4000.0):
+            recorder.run_once('third', 'fourth', {})
+        assert store.read_column('layer') == ['second']
+        assert list(store.read_column('duration_s')) == [3900.0]
+        assert list(store.read_column('team1_players')) == [2]
+        assert list(store.read_column('team2_players')) == [1]
+        assert list(store.read_column('team1_clan_members')) == [1]
+        assert list(store.read_column('team2_clan_members')) == [0]
+        assert list(store.read_column('winner_team')) == [matchhistory.UNKNOWN]
+
+        # Case 3: nothing is recorded while the map stays the same, and no shuffle is suggested after balanced rounds.
+        recorder.run_once('third', 'fourth', {})
+        assert store.num_rows == 1
+        client.exec_command.assert_not_called()
+
+        # Case 4: a shuffle is only suggested to the admins on the server.
+        recorder.on_analysis({'should_shuffle': True, 'num_rounds': 3, 'recent_score': 0.75})
+        client.exec_command.assert_called_once()
+        assert client.exec_command.call_args[0][0].startswith('AdminWarn "76561198000000000" ')
+
+        # Case 5: without a clan registry, the suggestion is only logged.
+        client.reset_mock()
+        matchhistory.MatchRecorder(client, store, tracker).on_analysis(
+            {'should_shuffle': True, 'num_rounds': 3, 'recent_score': 0.75})
+        client.exec_command.assert_not_called()
+
+    def test_lopsidedness_scores(self):
+        """ Tests for get_lopsidedness_scores. """
+        # Case 1: balanced and one-sided tickets, and unknown tickets in a long round.
+        scores = analysis.get_lopsidedness_scores([100, 300, -1], [100, 0, -1], [3600, 3600, 3600], 3600)
+        np.testing.assert_allclose(scores, [0.0, 1.0, 0.0])
+
+        # Case 2: short rounds are lopsided even when the tickets are unknown.
+        scores = analysis.get_lopsidedness_scores([-1, 150], [-1, 50], [900, 3600], 3600)
+        np.testing.assert_allclose(scores, [0.75, 0.5])
+
+    def test_trusted_rounds(self):
+        """ Tests for get_trusted_rounds. """
+        # Case 1: short rounds and rounds with too few players are not trusted.
+        trusted = analysis.get_trusted_rounds([3600, 300, 3600, 900], [40, 40, 5, 20], [40, 40, 5, 20],
+                                              min_duration_s=900, min_players=40)
+        assert list(trusted) == [True, False, False, True]
+
+    def test_analyze_match_history(self, tmp_path):
+        """ Tests for analyze_match_history (and should_shuffle). """
+        store = columnar.ColumnarStore(tmp_path / 'history', matchhistory.MATCH_HISTORY_SCHEMA)
+
+        # Case 1: an empty history never suggests a shuffle.
+        result = analysis.analyze_match_history(str(tmp_path / 'history'))
+        assert result == {'num_rounds': 0, 'recent_score': 0.0, 'should_shuffle': False, 'layers': {}}
+
+        # Case 2: balanced rounds do not suggest a shuffle, and the per-layer statistics are computed.
+        for _ in range(3):
+            append_fake_round(store, 'Narva', 3600)
+        append_fake_round(store, 'Gorodok', 1800)
+        store.flush()
+        result = analysis.analyze_match_history(str(tmp_path / 'history'), window=3, threshold=0.5,
+                                                expected_duration_s=3600)
+        assert not result['should_shuffle']
+        assert result['layers']['Narva'] == {'num_rounds': 3, 'mean_score': 0.0, 'mean_duration_s': 3600.0}
+        assert result['layers']['Gorodok']['mean_score'] == 0.5
+
+        # Case 3: short (e.g. skipped) rounds and seeding rounds are not scored, so they do not suggest a shuffle.
+        append_fake_round(store, 'Narva', 300)
+        append_fake_round(store, 'Narva', 600)
+        append_fake_round(store, 'Gorodok', 1200, players_per_team=10)
+        store.flush()
+        result = analysis.analyze_match_history(str(tmp_path / 'history'), window=3, threshold=0.5,
+                                                expected_duration_s=3600, min_duration_s=900, min_players=40)
+        assert not result['should_shuffle']
+        assert result['recent_score'] == 0.5 / 3
+
+        # Case 4: lopsided latest rounds suggest a shuffle.
+        append_fake_round(store, 'Narva', 1200)
+        append_fake_round(store, 'Narva', 3600, team1_tickets=200, team2_tickets=0, winner_team=1)
+        store.flush()
+        result = analysis.analyze_match_history(str(tmp_path / 'history'), window=3, threshold=0.5,
+                                                expected_duration_s=3600, min_duration_s=900, min_players=40)
+        assert result['should_shuffle']
+        assert result['num_rounds'] == 3
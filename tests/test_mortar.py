@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the MortarCalculator functionality.
+#
+
+import math
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from mortar import mortar
+
+
+class MockPlayerChat(object):
+    def __init__(self, messages, player_name=None):
+        self.player_name = player_name
+        self.messages = messages
+
+
+class TestMortar:
+    """ Test class (uses pytest) for the mortar module. """
+
+    @pytest.fixture
+    def calculator(self):
+        """ The fixture function to return a mortar calculator. """
+        return mortar.MortarCalculator(mock.MagicMock())
+
+    def test_parse_grid_reference(self):
+        """ Tests for parse_grid_reference. """
+        # Case 1: major grid squares (the center of the square).
+        assert mortar.parse_grid_reference('A1') == (150.0, 150.0)
+        assert mortar.parse_grid_reference('c12') == (750.0, 3450.0)
+
+        # Case 2: keypads are laid out like a numpad (7 is top left and 3 is bottom right).
+        assert mortar.parse_grid_reference('A1-7') == (50.0, 50.0)
+        assert mortar.parse_grid_reference('A1-3') == (250.0, 250.0)
+        assert mortar.parse_grid_reference('A1-5') == (150.0, 150.0)
+
+        # Case 3: sub-keypads in all the supported formats.
+        for grid_reference in ['B2-9-1', 'b2k9k1', 'B2 9 1', 'B2-K9-1']:
+            x, y = mortar.parse_grid_reference(grid_reference)
+            # Square B2 starts at (300, 300), keypad 9 is the top right, and sub-keypad 1 is the bottom left of that.
+            assert x == pytest.approx(300.0 + 200.0 + 0.0 + 100.0 / 6)
+            assert y == pytest.approx(300.0 + 0.0 + 200.0 / 3 + 100.0 / 6)
+
+        # Case 4: invalid grid references raise.
+        for grid_reference in ['', '5A', 'A0', 'A1-0', 'A1-10', 'AA1', 'A1-3-', 'A1-x']:
+            with pytest.raises(ValueError):
+                mortar.parse_grid_reference(grid_reference)
+
+    def test_join_keypad_arguments(self):
+        """ Tests for join_keypad_arguments. """
+        # Case 1: keypad-only arguments are joined to the grid reference before them.
+        assert mortar.join_keypad_arguments(['C5', '7', '3', 'D6', '-1']) == ['C5 7 3', 'D6 -1']
+        # Case 2: grid squares (even ones that look like a "k" keypad) and leading keypads are left alone.
+        assert mortar.join_keypad_arguments(['7', 'C5', 'K7', '10']) == ['7', 'C5', 'K7', '10']
+
+    def test_get_bearing_and_range(self):
+        """ Tests for get_bearing_and_range (bearings are clockwise from north, and north is up on the map). """
+        assert mortar.get_bearing_and_range((0.0, 100.0), (0.0, 0.0)) == (0.0, 100.0)
+        assert mortar.get_bearing_and_range((0.0, 0.0), (100.0, 0.0)) == (90.0, 100.0)
+        assert mortar.get_bearing_and_range((0.0, 0.0), (0.0, 100.0)) == (180.0, 100.0)
+        assert mortar.get_bearing_and_range((100.0, 0.0), (0.0, 0.0)) == (270.0, 100.0)
+        bearing, distance = mortar.get_bearing_and_range((0.0, 0.0), (30.0, -40.0))
+        assert bearing == pytest.approx(math.degrees(math.atan2(30.0, 40.0)))
+        assert distance == pytest.approx(50.0)
+
+    def test_ballistic_table(self):
+        """ Tests that the interpolated ballistic table matches the exact solution. """
+        mortar_type = mortar.MORTAR_TYPES['mortar']
+        table = mortar.BallisticTable(mortar_type)
+        velocity = mortar_type.velocity_mps
+
+        # Case 1: the interpolated elevations match the exact high-arc solution to within a mil.
+        ranges = np.linspace(mortar_type.min_range_m, 1200.0, 100)
+        exact = (np.pi - np.arcsin(mortar.GRAVITY_MPS2 * ranges / velocity ** 2)) / 2 * 6400 / (2 * np.pi)
+        assert np.allclose(table.lookup(ranges), exact, atol=1.0)
+
+        # Case 2: the known Squad mortar range table values (50m is ~1579 mil and max range is 800 mil).
+        assert table.lookup(50.0) == pytest.approx(1579, abs=1)
+        assert table.lookup(table.max_range_m) == pytest.approx(800, abs=1)
+
+        # Case 3: ranges outside the mortar's min and max range are NaN.
+        assert np.isnan(table.lookup([0.0, 49.9, table.max_range_m + 1.0])).all()
+
+    def test_get_firing_solution_message(self, calculator):
+        """ Tests for get_firing_solution_message. """
+        # Case 1: a valid request with the default mortar type.
+        message = calculator.get_firing_solution_message('!mortar A1 B1')
+        assert message == 'mortar: bearing 90.0 deg, elevation 1475 mil, range 300m'
+
+        # Case 2: a valid request with another mortar type.
+        message = calculator.get_firing_solution_message('!mortar A1 A2 HellCannon')
+        assert message.startswith('hellcannon: bearing 180.0 deg, elevation ')
+        assert message.endswith(' deg, range 300m')
+
+        # Case 3: a target that is out of range.
+        assert 'out of range' in calculator.get_firing_solution_message('!mortar A1-5 A1-5-3')
+        assert 'out of range' in calculator.get_firing_solution_message('!mortar A1 Z1')
+
+        # Case 4: grid references with spaced keypads are understood.
+        assert (calculator.get_firing_solution_message('!mortar A1 5 A1 5 3') ==
+                calculator.get_firing_solution_message('!mortar A1-5 A1-5-3'))
+        assert (calculator.get_firing_solution_message('!mortar A1 B1 7 hellcannon') ==
+                calculator.get_firing_solution_message('!mortar A1 B1-7 hellcannon'))
+
+        # Case 5: requests that cannot be understood get the usage message.
+        for message in ['!mortar', '!mortar A1', '!mortar A1 B1 C1', '!mortar A1 nowhere', '!mortar A1 B1 artillery']:
+            assert calculator.get_firing_solution_message(message) == mortar.USAGE_MESSAGE
+
+    def test_run_once(self, calculator):
+        """ Tests that run_once only answers the players that used the mortar command. """
+        chat = {
+            'id1': MockPlayerChat(['hello', '!MORTAR A1 B1'], player_name='mortarman'),
+            'id2': MockPlayerChat(['where is the mortar?'], player_name='rando'),
+        }
+        calculator.run_once('current', 'next', chat)
+        assert calculator.squad_rcon_client.exec_command.call_count == 1
+        assert (calculator.squad_rcon_client.exec_command.call_args_list[0][0][0] ==
+                'AdminWarn "id1" mortar: bearing 90.0 deg, elevation 1475 mil, range 300m')
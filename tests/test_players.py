@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the ListPlayers helpers.
+#
+
+from unittest import mock
+
+from players import players
+
+FAKE_LIST_PLAYERS_RESPONSE = (
+    '----- Active Players -----\n'
+    'ID: 0 | SteamID: 76561198000000000 | Name: [FP] leader | Team ID: 1 | Squad ID: 1\n'
+    'ID: 5 | SteamID: 76561198000000001 | Name: rando | with pipe | Team ID: 2 | Squad ID: N/A\n'
+    'ID: 7 | SteamID: 76561198000000002 | Name: new version | Team ID: 2 | Squad ID: 3 | Is Leader: True | Role: SL\n'
+    '----- Recently Disconnected Players [Max of 15] -----\n'
+    'ID: 2 | SteamID: 76561198000000003 | Since Disconnect: 02m.30s | Name: gone\n')
+
+
+class TestPlayers:
+    """ Test class (uses pytest) for the players module. """
+
+    def test_parse_list_players(self):
+        """ Tests for parse_list_players. """
+        # Case 1: only active players are returned.
+        assert players.parse_list_players(FAKE_LIST_PLAYERS_RESPONSE) == [
+            players.Player(0, '76561198000000000', '[FP] leader', 1, 1),
+            players.Player(5, '76561198000000001', 'rando | with pipe', 2, None),
+            players.Player(7, '76561198000000002', 'new version', 2, 3),
+        ]
+
+        # Case 2: empty responses have no players.
+        assert players.parse_list_players('') == []
+        assert players.parse_list_players(None) == []
+
+    def test_list_players(self):
+        """ Tests that list_players sends the ListPlayers command. """
+        client = mock.MagicMock()
+        client.exec_command.return_value = FAKE_LIST_PLAYERS_RESPONSE
+        assert len(players.list_players(client)) == 3
+        client.exec_command.assert_called_once_with('ListPlayers')
+
+    def test_player_tracker(self):
+        """ Tests for PlayerTracker. """
+        client = mock.MagicMock()
+        client.exec_command.return_value = FAKE_LIST_PLAYERS_RESPONSE
+        tracker = players.PlayerTracker(client)
+
+        # Case 1: the players in the first snapshot did not join (they were already there).
+        tracker.run_once('current', 'next', {})
+        assert tracker.get_num_players() == 3
+        assert tracker.joined == []
+
+        # Case 2: new players joined, players that left are dropped, and records of players that stayed are kept.
+        first_record = tracker.records['76561198000000000']
+        first_record.clan_checked = True
+        tracker.update([
+            players.Player(0, '76561198000000000', '[FP] leader', 2, None),
+            players.Player(9, '76561198000000009', 'new player', 1, None),
+        ], now=123.0)
+        assert tracker.get_num_players() == 2
+        assert [record.player.name for record in tracker.joined] == ['new player']
+        assert tracker.joined[0].joined_at == 123.0
+        assert tracker.records['76561198000000000'] is first_record
+        assert first_record.clan_checked
+        assert first_record.player.team_id == 2
+
+        # Case 3: nobody joined since the previous snapshot.
+        tracker.update([players.Player(9, '76561198000000009', 'new player', 1, None)])
+        assert tracker.joined == []
@@ -0,0 +1,191 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the poll engine functionality.
+#
+
+from unittest import mock
+
+import pytest
+
+from columnar import columnar
+from poll import poll
+
+FAKE_OPTIONS = ['yes', 'no', 'maybe']
+TIME_NOW = 1000.0
+
+
+class MockPlayerChat(object):
+    def __init__(self, messages, player_name=None):
+        self.player_name = player_name
+        self.messages = messages
+
+
+class TestPoll:
+    """ Test class (uses pytest) for the Poll and PlayerMetadataIndex classes. """
+
+    @pytest.fixture
+    def metadata_index(self):
+        """ The fixture function to return a metadata index with one regular. """
+        metadata_index = poll.PlayerMetadataIndex()
+        metadata_index.update('regular1', hours_played=poll.REGULAR_HOURS_THRESHOLD)
+        metadata_index.update('random1', hours_played=1.0)
+        return metadata_index
+
+    def test_metadata_index(self, metadata_index):
+        """ Tests for PlayerMetadataIndex. """
+        assert metadata_index.get_segment('regular1') == poll.REGULAR_SEGMENT
+        assert metadata_index.get_segment('random1') == poll.RANDOM_SEGMENT
+        assert metadata_index.get_segment('unknown') == poll.RANDOM_SEGMENT
+
+        # Updating metadata keeps the other keys and recomputes the segment.
+        metadata_index.update('random1', country='JO')
+        metadata_index.update('random1', hours_played=100.0)
+        assert metadata_index.get('random1') == {'hours_played': 100.0, 'country': 'JO'}
+        assert metadata_index.get_segment('random1') == poll.REGULAR_SEGMENT
+
+        # The metadata of unknown players is loaded once with the loader (e.g. from the hours store).
+        hours_played = {'regular2': 500.0}
+        loader = mock.MagicMock(side_effect=lambda player_id: {'hours_played': hours_played.get(player_id, 0.0)})
+        loading_index = poll.PlayerMetadataIndex(loader=loader)
+        assert loading_index.get_segment('regular2') == poll.REGULAR_SEGMENT
+        assert loading_index.get_segment('regular2') == poll.REGULAR_SEGMENT
+        assert loading_index.get('random2') == {'hours_played': 0.0}
+        assert loading_index.get_segment('random2') == poll.RANDOM_SEGMENT
+        assert loader.call_count == 2
+
+        # Once expired, the metadata is loaded again (e.g. a random player became a regular since).
+        hours_played['random2'] = 500.0
+        loading_index.expire_loaded()
+        assert loading_index.get_segment('random2') == poll.REGULAR_SEGMENT
+        assert loader.call_count == 3
+
+    def test_ballots(self, metadata_index):
+        """ Tests that ballots are aggregated as they come in. """
+        test_poll = poll.Poll('Question?', FAKE_OPTIONS, metadata_index, started_at=TIME_NOW)
+
+        # Case 1: no ballots means no winner.
+        assert test_poll.get_winner() is None
+
+        # Case 2: invalid ballots are not counted.
+        assert not test_poll.add_ballot('random1', 3)
+        assert not test_poll.add_ballot('random1', -1)
+        assert test_poll.get_counts() == [0, 0, 0]
+
+        # Case 3: valid ballots are counted overall and per segment.
+        assert test_poll.add_ballot('random1', 1)
+        assert test_poll.add_ballot('regular1', 2)
+        assert test_poll.add_ballot('random2', 2)
+        assert test_poll.get_counts() == [0, 1, 2]
+        assert test_poll.get_counts(poll.REGULAR_SEGMENT) == [0, 0, 1]
+        assert test_poll.get_counts(poll.RANDOM_SEGMENT) == [0, 1, 1]
+        assert test_poll.get_counts('unknown segment') == [0, 0, 0]
+        assert test_poll.get_winner() == ('maybe', 2)
+
+        # Case 4: a new ballot from the same player replaces their previous one.
+        assert test_poll.add_ballot('regular1', 1)
+        assert test_poll.get_counts() == [0, 2, 1]
+        assert test_poll.get_counts(poll.REGULAR_SEGMENT) == [0, 1, 0]
+        assert test_poll.get_winner() == ('no', 2)
+
+        # Case 5: ties are broken by the option that was voted for first.
+        assert test_poll.add_ballot('random3', 2)
+        assert test_poll.get_winner() == ('no', 2)
+
+    def test_format_results_and_rows(self, metadata_index):
+        """ Tests for format_results and get_rows. """
+        test_poll = poll.Poll('Question?', FAKE_OPTIONS, metadata_index, started_at=TIME_NOW)
+        test_poll.add_ballot('regular1', 0, TIME_NOW + 1.0)
+        test_poll.add_ballot('random1', 0, TIME_NOW + 2.0)
+        assert test_poll.format_results() == ('0) yes: 2 (random: 1, regular: 1)\n'
+                                              '1) no: 0 (random: 0, regular: 0)\n'
+                                              '2) maybe: 0 (random: 0, regular: 0)')
+        assert list(test_poll.get_rows())[0] == {
+            'poll_started_at': TIME_NOW, 'question': 'Question?', 'option_index': 0, 'option': 'yes',
+            'player_id': 'regular1', 'segment': poll.REGULAR_SEGMENT,
+            'hours_played': poll.REGULAR_HOURS_THRESHOLD, 'timestamp': TIME_NOW + 1.0}
+
+    def test_parse_poll_command(self):
+        """ Tests for parse_poll_command. """
+        assert poll.parse_poll_command('!poll More invasion? | yes | no ') == ('More invasion?', ['yes', 'no'])
+        assert poll.parse_poll_command('!poll More invasion?') is None
+        assert poll.parse_poll_command('!poll More invasion? | yes') is None
+        assert poll.parse_poll_command('!poll More invasion? | yes | ') is None
+
+
+class TestPollEngine:
+    """ Test class (uses pytest) for the PollEngine class. """
+
+    @pytest.fixture
+    def engine(self, tmp_path):
+        """ The fixture function to return a poll engine where only admins can start polls. """
+        store = columnar.ColumnarStore(tmp_path / 'polls', poll.POLL_STORE_SCHEMA)
+        return poll.PollEngine(mock.MagicMock(), lambda player_id, player_name: player_name == 'admin', store=store,
+                               poll_duration_s=60.0)
+
+    def run_once(self, engine, chat, time_now):
+        """ Helper that runs the engine once at the given time. """
+        with mock.patch('poll.poll.time.time') as fake_time:
+            fake_time.return_value = time_now
+            engine.run_once('current', 'next', chat)
+
+    def test_run_once(self, engine):
+        """ Tests starting, voting in, and closing concurrent polls. """
+        # Case 1: only allowed players can start polls.
+        self.run_once(engine, {'id1': MockPlayerChat(['!poll Q1? | a | b'], player_name='rando')}, TIME_NOW)
+        assert not engine.polls
+        self.run_once(engine, {'id1': MockPlayerChat(['!poll Q1? | a | b'], player_name='admin')}, TIME_NOW)
+        assert list(engine.polls) == ['A']
+        assert 'Poll A: Q1?' in engine.squad_rcon_client.exec_command.call_args_list[-1][0][0]
+
+        # Case 2: with one open poll, bare numbers are ballots.
+        self.run_once(engine, {'id2': MockPlayerChat(['I say 1'], player_name='rando')}, TIME_NOW + 1.0)
+        assert engine.polls['A'].get_counts() == [0, 1]
+
+        # Case 3: with several open polls, ballots need the poll id (and bare numbers are ignored).
+        self.run_once(engine, {'id1': MockPlayerChat(['!poll Q2? | c | d | e'], player_name='admin')}, TIME_NOW + 30.0)
+        self.run_once(engine, {'id2': MockPlayerChat(['b2', 'A 0'], player_name='rando'),
+                               'id3': MockPlayerChat(['1', 'c 1'], player_name='rando')}, TIME_NOW + 31.0)
+        assert engine.polls['A'].get_counts() == [1, 0]
+        assert engine.polls['B'].get_counts() == [0, 0, 1]
+
+        # Case 4: polls close (and are stored) once their duration is over.
+        self.run_once(engine, {}, TIME_NOW + 60.0)
+        assert list(engine.polls) == ['B']
+        assert 'Poll A results: Q1?' in engine.squad_rcon_client.exec_command.call_args_list[-1][0][0]
+        assert engine.store.read_column('option') == ['a']
+        assert engine.store.read_column('player_id') == ['id2']
+
+        # Case 5: the closed poll's id is reused.
+        self.run_once(engine, {'id1': MockPlayerChat(['!poll Q3? | f | g'], player_name='admin')}, TIME_NOW + 61.0)
+        assert sorted(engine.polls) == ['A', 'B']
+
+    def test_start_poll_reloads_metadata(self, tmp_path):
+        """ Tests that every new poll reloads the player metadata (so segments do not drift out of date). """
+        hours_played = {'id1': 0.0}
+        metadata_index = poll.PlayerMetadataIndex(
+            loader=lambda player_id: {'hours_played': hours_played.get(player_id, 0.0)})
+        engine = poll.PollEngine(mock.MagicMock(), lambda player_id, player_name: True, metadata_index=metadata_index)
+
+        # Case 1: the player is a random in the first poll, and stays one in it after becoming a regular.
+        first_poll = engine.start_poll('Q1?', ['a', 'b'])
+        first_poll.add_ballot('id1', 0)
+        hours_played['id1'] = 500.0
+        first_poll.add_ballot('id1', 1)
+        assert first_poll.get_counts(poll.RANDOM_SEGMENT) == [0, 1]
+
+        # Case 2: the next poll counts them as a regular.
+        second_poll = engine.start_poll('Q2?', ['a', 'b'])
+        second_poll.add_ballot('id1', 0)
+        assert second_poll.get_counts(poll.REGULAR_SEGMENT) == [1, 0]
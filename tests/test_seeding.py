@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+# A testing class to test the seeding functionality.
+#
+
+from unittest import mock
+
+import pytest
+
+from players import players
+from plugin import timerwheel
+from seeding import seeding
+
+
+def get_fake_players(num_players):
+    """ Helper that returns the given number of fake players. """
+    return [players.Player(index, f'7656119800000{index:04d}', f'player{index}', 1, None)
+            for index in range(num_players)]
+
+
+class FakeClock:
+    """ A clock that only moves when told to. """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSeeding:
+    """ Test class (uses pytest) for the seeding module. """
+
+    def test_load_broadcasts(self, tmp_path):
+        """ Tests for load_broadcasts. """
+        filepath = tmp_path / 'broadcasts.yml'
+
+        # Case 1: broadcasts are seeding only unless told otherwise.
+        filepath.write_text('broadcasts:\n'
+                            '  - message: Rule 1\n'
+                            '    interval_minutes: 10\n'
+                            '  - message: Join our discord\n'
+                            '    interval_minutes: 0.5\n'
+                            '    seeding_only: false\n')
+        assert seeding.load_broadcasts(filepath) == [seeding.Broadcast('Rule 1', 600.0, True),
+                                                     seeding.Broadcast('Join our discord', 30.0, False)]
+
+        # Case 2: a broadcast without a message or a positive interval is invalid.
+        filepath.write_text('broadcasts:\n  - interval_minutes: 10\n')
+        with pytest.raises(ValueError):
+            seeding.load_broadcasts(filepath)
+        filepath.write_text('broadcasts:\n  - message: Rule 1\n    interval_minutes: 0\n')
+        with pytest.raises(ValueError):
+            seeding.load_broadcasts(filepath)
+
+    def test_threshold_detector(self):
+        """ Tests for ThresholdDetector. """
+        # Case 1: the thresholds must leave room for hysteresis.
+        with pytest.raises(ValueError):
+            seeding.ThresholdDetector(10, 10)
+
+        # Case 2: the first value only sets the state.
+        detector = seeding.ThresholdDetector(10, 5)
+        assert detector.update(20) is None
+        assert detector.is_above
+
+        # Case 3: each crossing is reported exactly once, and values between the thresholds cross nothing.
+        detector = seeding.ThresholdDetector(10, 5)
+        events = [detector.update(value) for value in [0, 9, 10, 11, 9, 6, 10, 5, 4, 9, 10]]
+        assert events == [None, None, seeding.LIVE_EVENT, None, None, None, None, seeding.SEEDING_EVENT, None, None,
+                          seeding.LIVE_EVENT]
+
+    def test_seeding_announcer(self):
+        """ Tests for SeedingAnnouncer. """
+        client = mock.MagicMock()
+        tracker = players.PlayerTracker(client)
+        clock = FakeClock()
+        broadcasts = [seeding.Broadcast('Rule 1', 60.0, True), seeding.Broadcast('Discord', 90.0, False)]
+        announcer = seeding.SeedingAnnouncer(client, tracker, broadcasts, live_player_threshold=3,
+                                             live_player_hysteresis=1,
+                                             timer_wheel=timerwheel.TimerWheel(clock=clock))
+
+        def run_once(num_players, elapsed_s):
+            client.reset_mock()
+            clock.now += elapsed_s
+            tracker.update(get_fake_players(num_players), now=clock.now)
+            announcer.run_once('current', 'next', {})
+            return [call[0][0] for call in client.exec_command.call_args_list]
+
+        # Case 1: nothing is broadcast before the first interval.
+        assert run_once(1, 30.0) == []
+        assert not announcer.is_live()
+
+        # Case 2: the seeding broadcasts are sent while seeding.
+        assert run_once(2, 30.0) == ['AdminBroadcast Rule 1']
+        assert run_once(2, 30.0) == ['AdminBroadcast Discord']
+
+        # Case 3: going live is announced once, and the seeding only broadcasts stop.
+        assert run_once(3, 30.0) == [f'AdminBroadcast {seeding.LIVE_MESSAGE}']
+        assert announcer.is_live()
+        assert run_once(4, 60.0) == ['AdminBroadcast Discord']
+        assert run_once(3, 60.0) == []
+
+        # Case 4: the same snapshot is only checked once.
+        client.reset_mock()
+        announcer.run_once('current', 'next', {})
+        client.exec_command.assert_not_called()
+
+        # Case 5: after dropping below the hysteresis, the server can be announced live again.
+        assert run_once(2, 1.0) == []
+        assert not announcer.is_live()
+        assert run_once(3, 1.0) == [f'AdminBroadcast {seeding.LIVE_MESSAGE}']
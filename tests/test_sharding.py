@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the sharding functionality.
+#
+
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from sharding import sharding
+
+FAKE_SERVER_NAMES = ['eu1', 'eu2', 'us1', 'us2', 'au1']
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def get_owners(lease_dirpath, now=None):
+    """ Helper that returns the owner of every server (read from the lease files). """
+    reader = sharding.LeaseManager(lease_dirpath, 'reader', FAKE_SERVER_NAMES)
+    now = now if now is not None else time.time()
+    return {server_name: reader.read_owner(server_name, now) for server_name in FAKE_SERVER_NAMES}
+
+
+def run_fake_node(lease_dirpath, node_id):
+    """ Runs a node (in its own process) whose server tasks just wait to be stopped. """
+    lease_manager = sharding.LeaseManager(lease_dirpath, node_id, FAKE_SERVER_NAMES, lease_timeout_s=1.0)
+    node = sharding.ShardNode(lease_manager, [sharding.ServerSpec(name, {}) for name in FAKE_SERVER_NAMES],
+                              lambda server, stop_event: stop_event.wait(), heartbeat_interval_s=0.1)
+    node.run()
+
+
+def wait_for(condition, timeout_s=10.0):
+    """ Helper that waits until the condition is True (or the timeout passes) and returns the condition. """
+    deadline = time.time() + timeout_s
+    while not condition() and time.time() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+class TestSharding:
+    """ Test class (uses pytest) for the sharding module. """
+
+    def test_load_manifest(self, tmp_path):
+        """ Tests for load_manifest. """
+        filepath = tmp_path / 'manifest.yml'
+
+        # Case 1: each server has a name and its settings.
+        filepath.write_text('servers:\n'
+                            '  - name: eu1\n'
+                            '    rcon_address: 127.0.0.1\n'
+                            '    rcon_port: 21114\n'
+                            '  - name: us1\n')
+        assert sharding.load_manifest(filepath) == [
+            sharding.ServerSpec('eu1', {'rcon_address': '127.0.0.1', 'rcon_port': 21114}),
+            sharding.ServerSpec('us1', {})]
+
+        # Case 2: every server must have a unique name.
+        filepath.write_text('servers:\n  - rcon_address: 127.0.0.1\n')
+        with pytest.raises(ValueError):
+            sharding.load_manifest(filepath)
+        filepath.write_text('servers:\n  - name: eu1\n  - name: eu1\n')
+        with pytest.raises(ValueError):
+            sharding.load_manifest(filepath)
+
+    def test_lease_manager(self, tmp_path):
+        """ Tests for LeaseManager. """
+        clock = FakeClock()
+        first = sharding.LeaseManager(tmp_path, 'first', FAKE_SERVER_NAMES, lease_timeout_s=10.0, clock=clock)
+        second = sharding.LeaseManager(tmp_path, 'second', FAKE_SERVER_NAMES, lease_timeout_s=10.0, clock=clock)
+
+        # Case 1: a lone node takes every server.
+        assert first.rebalance() == set(FAKE_SERVER_NAMES)
+
+        # Case 2: a new node gets the servers the first node gives up (its fair share), and nothing is owned twice.
+        assert second.rebalance() == set()
+        assert len(first.rebalance()) == 3
+        assert len(second.rebalance()) == 2
+        owners = get_owners(tmp_path, clock.now)
+        assert sorted(owners.values()) == ['first'] * 3 + ['second'] * 2
+
+        # Case 3: servers that cannot be given up yet are kept (and given up on a later rebalance).
+        third = sharding.LeaseManager(tmp_path, 'third', FAKE_SERVER_NAMES, lease_timeout_s=10.0, clock=clock)
+        third.rebalance()
+        assert first.rebalance(releasable=lambda server_name: False) == first.owned
+        assert len(first.owned) == 3
+        assert len(first.rebalance()) == 2
+
+        # Case 4: the servers of a dead node are taken over once its leases expire.
+        clock.now += 5.0
+        first.rebalance()
+        second.rebalance()
+        clock.now += 6.0
+        assert third.owned <= get_owners(tmp_path, clock.now).keys()
+        first_owned = first.rebalance()
+        second_owned = second.rebalance()
+        assert first_owned | second_owned == set(FAKE_SERVER_NAMES)
+        assert not first_owned & second_owned
+
+        # Case 5: releasing all leases lets the other node take them right away.
+        first.release_all()
+        assert second.rebalance() == set(FAKE_SERVER_NAMES)
+
+    def test_shard_node(self, tmp_path):
+        """ Tests for ShardNode (run one rebalance at a time). """
+        started = []
+        lease_manager = sharding.LeaseManager(tmp_path, 'node', FAKE_SERVER_NAMES[:2])
+
+        def run_server(server, stop_event):
+            started.append(server.name)
+            if server.name == 'eu2' and started.count('eu2') == 1:
+                return  # The first task of eu2 dies right away.
+            stop_event.wait()
+
+        node = sharding.ShardNode(lease_manager, [sharding.ServerSpec(name, {}) for name in FAKE_SERVER_NAMES[:2]],
+                                  run_server)
+
+        # Case 1: a task is started for every owned server.
+        assert node.run_once() == {'eu1', 'eu2'}
+        assert wait_for(lambda: sorted(started) == ['eu1', 'eu2'])
+
+        # Case 2: a task that died is restarted, and a running task is not.
+        node.tasks['eu2'][0].join()
+        node.run_once()
+        assert wait_for(lambda: sorted(started) == ['eu1', 'eu2', 'eu2'])
+
+        # Case 3: stopping the node stops every task and releases every lease.
+        tasks = list(node.tasks.values())
+        node.stop()
+        node.run()
+        assert all(not thread.is_alive() for thread, _ in tasks)
+        assert get_owners(tmp_path) == {name: None for name in FAKE_SERVER_NAMES}
+
+    def test_multiple_processes(self, tmp_path):
+        """ Tests that several node processes divide the servers, and take over the servers of a node that died. """
+        processes = [multiprocessing.Process(target=run_fake_node, args=(str(tmp_path), f'node{i}'), daemon=True)
+                     for i in range(3)]
+        for process in processes:
+            process.start()
+        try:
+            # Case 1: every server is owned by exactly one node, and the servers are balanced.
+            def is_balanced():
+                owners = list(get_owners(tmp_path).values())
+                return None not in owners and sorted(owners.count(f'node{i}') for i in range(3)) == [1, 2, 2]
+            assert wait_for(is_balanced)
+
+            # Case 2: the servers of a killed node are taken over by the others within a few seconds.
+            os.kill(processes[0].pid, 9)
+            processes[0].join()
+
+            def is_taken_over():
+                owners = list(get_owners(tmp_path).values())
+                return None not in owners and 'node0' not in owners and sorted(
+                    owners.count(f'node{i}') for i in (1, 2)) == [2, 3]
+            assert wait_for(is_taken_over)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the TeamShuffler functionality.
+#
+
+import collections
+import threading
+from unittest import mock
+
+from players import players
+from plugin import dispatcher
+from teamshuffle import teamshuffle
+
+
+class MockPlayerChat(object):
+    def __init__(self, messages, player_name=None):
+        self.player_name = player_name
+        self.messages = messages
+
+
+class FakeSquadServer(object):
+    """ A fake server that answers ListPlayers and AdminForceTeamChange (and ignores other commands). """
+
+    def __init__(self, active_players, unmovable_steam_ids=()):
+        self.players = {player.steam_id: player for player in active_players}
+        self.unmovable_steam_ids = set(unmovable_steam_ids)
+        self.lock = threading.Lock()
+        self.num_list_players = 0
+
+    def exec_command(self, command):
+        with self.lock:
+            if command == 'ListPlayers':
+                self.num_list_players += 1
+                return '----- Active Players -----\n' + '\n'.join(
+                    f'ID: {p.player_id} | SteamID: {p.steam_id} | Name: {p.name} | Team ID: {p.team_id} | '
+                    f'Squad ID: {p.squad_id if p.squad_id is not None else "N/A"}' for p in self.players.values())
+            if command.startswith('AdminForceTeamChange '):
+                steam_id = command.split()[1]
+                if steam_id not in self.unmovable_steam_ids:
+                    player = self.players[steam_id]
+                    self.players[steam_id] = player._replace(team_id=3 - player.team_id, squad_id=None)
+            return ''
+
+
+def make_players(num_players):
+    """ Helper that returns players split between both teams, with squads of 3 and some players without a squad. """
+    return [players.Player(i, str(76561198000000000 + i), f'player{i}', 1 + i % 2, (i // 6) + 1 if i % 4 else None)
+            for i in range(num_players)]
+
+
+class TestTeamShuffle:
+    """ Test class (uses pytest) for the teamshuffle module. """
+
+    def test_get_shuffled_teams(self):
+        """ Tests that shuffled teams are even and keep squads together. """
+        active_players = make_players(100)
+        assignments = teamshuffle.get_shuffled_teams(active_players)
+        assert set(assignments) == {player.steam_id for player in active_players}
+
+        # Case 1: the teams are as even as possible (off by at most the size of a squad).
+        team_sizes = collections.Counter(assignments.values())
+        assert abs(team_sizes[1] - team_sizes[2]) <= 3
+
+        # Case 2: squads stay together.
+        squad_teams = collections.defaultdict(set)
+        for player in active_players:
+            if player.squad_id is not None:
+                squad_teams[(player.team_id, player.squad_id)].add(assignments[player.steam_id])
+        assert all(len(teams) == 1 for teams in squad_teams.values())
+
+    def test_get_swapped_teams(self):
+        """ Tests that swapped teams move every player. """
+        active_players = make_players(10)
+        assignments = teamshuffle.get_swapped_teams(active_players)
+        assert teamshuffle.get_moves(active_players, assignments) == [p.steam_id for p in active_players]
+
+    def test_get_failed_moves(self):
+        """ Tests for get_failed_moves. """
+        active_players = make_players(4)
+        assignments = {player.steam_id: 1 for player in active_players}
+        moves = teamshuffle.get_moves(active_players, assignments)
+        # Player 0 was not moved but switched teams on their own, player 1 could not be moved, and player 3 left.
+        final_players = [active_players[0]._replace(team_id=2), active_players[1],
+                         active_players[2]._replace(team_id=1)]
+
+        # Case 1: only the moved players that are still on the wrong team failed.
+        assert teamshuffle.get_failed_moves(final_players, assignments, moves) == [active_players[1].steam_id]
+
+    def test_change_teams(self):
+        """ Tests that team changes are sent as one burst and checked with a final ListPlayers. """
+        active_players = make_players(20)
+        unmovable_steam_id = active_players[3].steam_id
+        server = FakeSquadServer(active_players, unmovable_steam_ids=[unmovable_steam_id])
+        command_dispatcher = dispatcher.CommandDispatcher(server)
+        shuffler = teamshuffle.TeamShuffler(server, command_dispatcher, lambda player_id, player_name: True)
+
+        with mock.patch.object(command_dispatcher, 'dispatch', wraps=command_dispatcher.dispatch) as mock_dispatch:
+            assert shuffler.change_teams(teamshuffle.get_swapped_teams, teamshuffle.SWAP_MESSAGE) == (19, 1)
+
+        # Exactly one burst and two ListPlayers (before and after) were sent.
+        assert mock_dispatch.call_count == 1
+        assert len(mock_dispatch.call_args[0][0]) == 20
+        assert server.num_list_players == 2
+        for player in active_players:
+            expected_team_id = player.team_id if player.steam_id == unmovable_steam_id else 3 - player.team_id
+            assert server.players[player.steam_id].team_id == expected_team_id
+
+    def test_run_once(self):
+        """ Tests that only allowed players can shuffle or swap the teams. """
+        shuffler = teamshuffle.TeamShuffler(mock.MagicMock(), mock.MagicMock(),
+                                            lambda player_id, player_name: player_name == 'admin')
+        with mock.patch.object(shuffler, 'change_teams') as mock_change_teams:
+            # Case 1: players that are not allowed are ignored.
+            shuffler.run_once('current', 'next', {'id1': MockPlayerChat(['!shuffle'], player_name='rando')})
+            assert mock_change_teams.call_count == 0
+
+            # Case 2: allowed players can shuffle or swap (only once per batch).
+            shuffler.run_once('current', 'next', {'id1': MockPlayerChat(['!SHUFFLE', '!swap'], player_name='admin')})
+            assert mock_change_teams.call_count == 1
+            assert mock_change_teams.call_args[0][0] == teamshuffle.get_shuffled_teams
+            shuffler.run_once('current', 'next', {'id1': MockPlayerChat(['!swap'], player_name='admin')})
+            assert mock_change_teams.call_args[0][0] == teamshuffle.get_swapped_teams
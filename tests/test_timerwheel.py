@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+# A testing class to test the TimerWheel functionality.
+#
+
+from plugin import timerwheel
+
+
+class FakeClock:
+    """ A clock that only moves when told to. """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimerWheel:
+    """ Test class (uses pytest) for the TimerWheel class. """
+
+    def test_schedule(self):
+        """ Tests for schedule and advance. """
+        clock = FakeClock()
+        wheel = timerwheel.TimerWheel(tick_s=1.0, num_slots=8, clock=clock)
+
+        # Case 1: nothing fires before its delay.
+        wheel.schedule('once', 2.0)
+        wheel.schedule('every 3', 3.0, interval_s=3.0)
+        assert len(wheel) == 2
+        clock.now += 1.5
+        assert wheel.advance() == []
+
+        # Case 2: a one-shot timer fires once, and is then dropped.
+        clock.now += 0.5
+        assert wheel.advance() == ['once']
+        assert len(wheel) == 1
+        clock.now += 1.0
+        assert wheel.advance() == ['every 3']
+
+        # Case 3: a recurring timer keeps firing every interval.
+        fired = []
+        for _ in range(9):
+            clock.now += 1.0
+            fired.extend(wheel.advance())
+        assert fired == ['every 3'] * 3
+        assert len(wheel) == 1
+
+        # Case 4: timers further out than one turn of the wheel wait for their round.
+        wheel.schedule('far', 20.0)
+        fired = []
+        for _ in range(19):
+            clock.now += 1.0
+            fired.extend(payload for payload in wheel.advance() if payload == 'far')
+        assert fired == []
+        clock.now += 1.0
+        assert 'far' in wheel.advance()
+
+    def test_advance_late(self):
+        """ Tests for advance when the wheel fell behind. """
+        clock = FakeClock()
+        wheel = timerwheel.TimerWheel(tick_s=1.0, num_slots=8, clock=clock)
+        wheel.schedule('every 2', 2.0, interval_s=2.0)
+        wheel.schedule('once', 5.0)
+
+        # Case 1: every due timer fires (a recurring timer only once, the missed firings are skipped).
+        clock.now += 11.0
+        assert sorted(wheel.advance()) == ['every 2', 'once']
+
+        # Case 2: the recurring timer keeps its phase afterwards.
+        clock.now += 0.5
+        assert wheel.advance() == []
+        clock.now += 0.5
+        assert wheel.advance() == ['every 2']
+
+    def test_cancel(self):
+        """ Tests for cancel. """
+        clock = FakeClock()
+        wheel = timerwheel.TimerWheel(tick_s=1.0, num_slots=8, clock=clock)
+        timer = wheel.schedule('every 1', 1.0, interval_s=1.0)
+
+        # Case 1: a cancelled timer never fires again (cancelling twice is harmless).
+        clock.now += 1.0
+        assert wheel.advance() == ['every 1']
+        wheel.cancel(timer)
+        wheel.cancel(timer)
+        assert len(wheel) == 0
+        clock.now += 5.0
+        assert wheel.advance() == []
@@ -0,0 +1,201 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the Trivia functionality.
+#
+
+from unittest import mock
+
+import pytest
+
+from trivia import trivia
+
+FAKE_QUESTION_BANK = (
+    '# A comment line that is ignored.\n'
+    'What is the capital of France?|Paris\n'
+    '\n'
+    'A question without answers is ignored|\n'
+    'Who painted the Mona Lisa?|Leonardo da Vinci|da Vinci|Leonardo\n'
+    'How many players fit on a Squad server?|100|one hundred')
+TIME_NOW = 1000.0
+
+
+class MockPlayerChat(object):
+    def __init__(self, messages, player_name=None):
+        self.player_name = player_name
+        self.messages = messages
+
+
+class TestTrivia:
+    """ Test class (uses pytest) for the trivia module. """
+
+    @pytest.fixture
+    def question_bank(self, tmp_path):
+        """ The fixture function to return a question bank. """
+        filepath = tmp_path / 'questions.txt'
+        filepath.write_text(FAKE_QUESTION_BANK)
+        return trivia.QuestionBank(filepath)
+
+    @pytest.fixture
+    def game(self, question_bank):
+        """ The fixture function to return a trivia plugin. """
+        with mock.patch('trivia.trivia.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW
+            return trivia.Trivia(mock.MagicMock(), question_bank, question_interval_s=10.0, answer_time_s=5.0)
+
+    def test_normalize(self):
+        """ Tests for normalize. """
+        assert trivia.normalize('  The Mona-Lisa!! ') == 'mona lisa'
+        assert trivia.normalize('Café') == 'cafe'
+        assert trivia.normalize('an a the') == ''
+
+    def test_question_bank(self, question_bank):
+        """ Tests for QuestionBank. """
+        # Case 1: comments, blank lines, and questions without answers are skipped.
+        assert len(question_bank) == 3
+        assert question_bank[0] == trivia.Question('What is the capital of France?', ['Paris'])
+        assert question_bank[1] == trivia.Question('Who painted the Mona Lisa?',
+                                                   ['Leonardo da Vinci', 'da Vinci', 'Leonardo'])
+        assert question_bank[2] == trivia.Question('How many players fit on a Squad server?', ['100', 'one hundred'])
+
+        # Case 2: a random question is one of the questions.
+        assert question_bank.get_random_question() in [question_bank[i] for i in range(len(question_bank))]
+
+        # Case 3: the saved index is reused (the bank is not scanned again).
+        with mock.patch.object(trivia.QuestionBank, 'build_index') as mock_build_index:
+            reloaded_bank = trivia.QuestionBank(question_bank.filepath)
+            assert mock_build_index.call_count == 0
+            assert list(reloaded_bank.offsets) == list(question_bank.offsets)
+
+        # Case 4: the index is rebuilt when the bank changes.
+        question_bank.filepath.write_text('Only question?|Only answer\n')
+        changed_bank = trivia.QuestionBank(question_bank.filepath)
+        assert len(changed_bank) == 1
+        assert changed_bank[0] == trivia.Question('Only question?', ['Only answer'])
+
+        # Case 5: lines that are not valid UTF-8 are skipped (instead of failing when they are asked).
+        question_bank.filepath.write_bytes(b'Bad question \xff?|answer\nGood question?|answer\n')
+        with trivia.QuestionBank(question_bank.filepath) as bad_bank:
+            assert len(bad_bank) == 1
+            assert bad_bank[0] == trivia.Question('Good question?', ['answer'])
+        assert bad_bank.data.closed
+
+    def test_empty_question_bank(self, tmp_path):
+        """ Tests that an empty question bank has no questions. """
+        filepath = tmp_path / 'empty.txt'
+        filepath.write_text('')
+        assert len(trivia.QuestionBank(filepath)) == 0
+
+    def test_answer_matcher(self):
+        """ Tests for AnswerMatcher. """
+        matcher = trivia.AnswerMatcher(['Leonardo da Vinci', 'da Vinci'])
+
+        # Case 1: exact matches (after normalizing), anywhere in the message.
+        assert matcher.matches('leonardo DA vinci')
+        assert matcher.matches('Da Vinci!')
+        assert matcher.matches('is it da vinci?')
+
+        # Case 2: small typos still match.
+        assert matcher.matches('leonardo da vinchi')
+        assert matcher.matches('da vincii')
+
+        # Case 3: wrong answers do not match.
+        assert not matcher.matches('michelangelo')
+        assert not matcher.matches('vinci')
+        assert not matcher.matches('')
+
+        # Case 4: short numeric answers need to match exactly.
+        matcher = trivia.AnswerMatcher(['100'])
+        assert matcher.matches('100')
+        assert matcher.matches('i think 100')
+        assert not matcher.matches('1000')
+        assert not matcher.matches('10')
+
+    def test_run_once(self, game):
+        """ Tests the trivia rounds through run_once. """
+        exec_command = game.squad_rcon_client.exec_command
+
+        # Case 1: nothing happens before the first question is due.
+        with mock.patch('trivia.trivia.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW + 5.0
+            game.run_once('current', 'next', {})
+        assert exec_command.call_count == 0
+        assert game.question is None
+
+        # Case 2: a question is asked once it is due.
+        with mock.patch('trivia.trivia.time.time') as fake_time, (
+                mock.patch.object(game.question_bank, 'get_random_question')) as mock_get_question:
+            fake_time.return_value = TIME_NOW + 10.0
+            mock_get_question.return_value = trivia.Question('What is the capital of France?', ['Paris'])
+            game.run_once('current', 'next', {})
+        assert exec_command.call_args_list[-1][0][0] == 'AdminBroadcast Trivia time! What is the capital of France?'
+
+        # Case 3: wrong answers do not end the round.
+        with mock.patch('trivia.trivia.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW + 11.0
+            game.run_once('current', 'next', {'id1': MockPlayerChat(['london'], player_name='player1')})
+        assert game.question is not None
+
+        # Case 4: the first correct answer wins a point and ends the round.
+        with mock.patch('trivia.trivia.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW + 12.0
+            game.run_once('current', 'next', {'id1': MockPlayerChat(['paris?'], player_name='player1'),
+                                              'id2': MockPlayerChat(['PARIS'], player_name='player2')})
+        assert game.question is None
+        assert game.scores.get_score('id1') == 1
+        assert 'player1 got it!' in exec_command.call_args_list[-1][0][0]
+
+        # Case 5: a round that nobody answers ends after the answer time.
+        with mock.patch('trivia.trivia.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW + 30.0
+            game.run_once('current', 'next', {})
+            fake_time.return_value = TIME_NOW + 40.0
+            game.run_once('current', 'next', {})
+        assert game.question is None
+        assert 'Nobody got it!' in exec_command.call_args_list[-1][0][0]
+        assert game.scores.get_score('id1') == 1
+
+        # Case 6: players can ask for their score.
+        with mock.patch('trivia.trivia.time.time') as fake_time:
+            fake_time.return_value = TIME_NOW + 41.0
+            game.run_once('current', 'next', {'id2': MockPlayerChat(['!score'], player_name='player2')})
+            assert (exec_command.call_args_list[-1][0][0] ==
+                    'AdminWarn "id2" Your trivia score is 0 (rank 2 of 2).')
+            game.run_once('current', 'next', {'id1': MockPlayerChat(['!SCORE'], player_name='player1')})
+            assert (exec_command.call_args_list[-1][0][0] ==
+                    'AdminWarn "id1" Your trivia score is 1 (rank 1 of 1).')
+
+    def test_score_store(self, tmp_path):
+        """ Tests for ScoreStore. """
+        filepath = tmp_path / 'trivia_scores.sqlite3'
+        store = trivia.ScoreStore(filepath)
+
+        # Case 1: players that never scored have no points and are ranked after everyone else.
+        assert store.get_score('id1') == 0
+        assert store.get_rank('id1') == (1, 1)
+
+        # Case 2: points add up, and players are ranked by score.
+        assert store.add_point('id1') == 1
+        assert store.add_point('id1') == 2
+        assert store.add_point('id2') == 1
+        assert store.get_rank('id1') == (1, 2)
+        assert store.get_rank('id2') == (2, 2)
+        assert store.get_rank('id3') == (3, 3)
+        store.close()
+
+        # Case 3: the scores survive reopening the store (e.g. after a reconnect).
+        store = trivia.ScoreStore(filepath)
+        assert store.get_score('id1') == 2
+        assert store.get_rank('id2') == (2, 2)
+        store.close()
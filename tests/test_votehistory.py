@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the VoteHistory functionality.
+#
+
+from mapvoter import votehistory
+
+FAKE_CANDIDATES = ['Narva', 'Gorodok', 'Redo']
+
+
+class TestVoteHistory:
+    """ Test class (uses pytest) for the VoteHistory class. """
+
+    def test_record_vote(self, tmp_path):
+        """ Tests for record_vote, and the aggregate queries. """
+        history = votehistory.VoteHistory(tmp_path / 'history.sqlite3', 'server1')
+
+        # Case 1: an empty history has no statistics.
+        assert history.get_layer_statistics() == {}
+        assert history.get_outcome_counts() == {}
+
+        # Case 2: the options, counts, ballots and outcome of each vote are recorded.
+        vote_id = history.record_vote(FAKE_CANDIDATES, [2, 1, 0], {'a': 0, 'b': 0, 'c': 1}, votehistory.WINNER_OUTCOME,
+                                      winner_map='Narva', started_at=10.0, ended_at=40.0)
+        history.record_vote(FAKE_CANDIDATES, [0, 0, 0], {}, votehistory.FAILED_OUTCOME, ended_at=50.0)
+        ballots = history.connection.execute(
+            'SELECT player_id, option_index FROM ballots WHERE vote_id = ? ORDER BY player_id', (vote_id,)).fetchall()
+        assert ballots == [('a', 0), ('b', 0), ('c', 1)]
+        assert history.get_outcome_counts() == {votehistory.WINNER_OUTCOME: 1, votehistory.FAILED_OUTCOME: 1}
+        assert history.get_outcome_counts(since=45.0) == {votehistory.FAILED_OUTCOME: 1}
+        assert history.get_layer_statistics()['Narva'] == {'num_candidacies': 2, 'num_wins': 1, 'num_votes': 2}
+        assert history.get_layer_statistics()['Gorodok'] == {'num_candidacies': 2, 'num_wins': 0, 'num_votes': 1}
+
+        # Case 3: other servers sharing the same file have their own history.
+        other_history = votehistory.VoteHistory(tmp_path / 'history.sqlite3', 'server2')
+        assert other_history.get_outcome_counts() == {}
+        other_history.close()
+        history.close()
+
+    def test_get_excluded_layers(self, tmp_path):
+        """ Tests for get_excluded_layers (and the recently played and rejected layers). """
+        history = votehistory.VoteHistory(tmp_path / 'history.sqlite3', 'server1', recently_played_window_s=100.0,
+                                          recently_rejected_window_s=50.0)
+
+        # Case 1: layers played within the window are excluded.
+        history.record_layer_played('Old', started_at=800.0)
+        history.record_layer_played('Recent', started_at=950.0)
+        assert history.get_recently_played_layers(since=900.0) == {'Recent'}
+        assert history.get_excluded_layers(now=1000.0) == {'Recent'}
+
+        # Case 2: candidates that lost a successful vote within the window are excluded (but not after failed votes).
+        history.record_vote(FAKE_CANDIDATES, [3, 1, 0], {}, votehistory.WINNER_OUTCOME, winner_map='Narva',
+                            ended_at=990.0)
+        history.record_vote(['Failed'], [0], {}, votehistory.FAILED_OUTCOME, ended_at=990.0)
+        assert history.get_recently_rejected_layers(since=960.0) == {'Gorodok', 'Redo'}
+        assert history.get_excluded_layers(now=1000.0) == {'Recent', 'Gorodok', 'Redo'}
+
+        # Case 3: everything is available again once the windows pass.
+        assert history.get_excluded_layers(now=2000.0) == set()
+
+        # Case 4: the recent layer queries only read the indexes.
+        plan = history.connection.execute('EXPLAIN QUERY PLAN SELECT DISTINCT layer FROM layers_played '
+                                          'WHERE server = ? AND started_at >= ?', ('server1', 0.0)).fetchall()
+        assert 'COVERING INDEX layers_played_server_started_at' in str(plan)
+        history.close()
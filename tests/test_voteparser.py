@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+# A testing class to test the VoteParser functionality.
+#
+
+import logging
+
+from mapvoter import voteparser
+
+
+class TestVoteParser:
+    """ Test class (uses pytest) for the VoteParser class. """
+
+    def test_parse(self):
+        """ Tests for parse. """
+        parser = voteparser.VoteParser(3)
+
+        # Case 1: a message that is just a valid number (with or without whitespace) is a ballot.
+        assert parser.parse('0') == 0
+        assert parser.parse('  2 \n') == 2
+
+        # Case 2: the last word of a message is the ballot.
+        assert parser.parse('I vote 1') == 1
+        assert parser.parse('option:2') == 2
+        assert parser.parse('-1') == 1
+
+        # Case 3: messages that do not end in a number are not ballots (and do not raise).
+        assert parser.parse('') is None
+        assert parser.parse('   ') is None
+        assert parser.parse('not a vote') is None
+        assert parser.parse('map2') is None
+        assert parser.parse('1 please') is None
+        assert parser.invalid_counts[voteparser.NOT_A_NUMBER] == 5
+
+        # Case 4: numbers that are not one of the options are out of range (even huge ones).
+        assert parser.parse('3') is None
+        assert parser.parse('I vote 10000') is None
+        assert parser.parse('9' * 5000) is None
+        assert parser.invalid_counts[voteparser.OUT_OF_RANGE] == 3
+
+        # Case 5: the counters add up.
+        assert parser.num_ballots == 5
+        assert parser.get_num_invalid() == 8
+
+        # Case 6: a vote with many options accepts multi-digit ballots.
+        parser = voteparser.VoteParser(12)
+        assert parser.parse('11') == 11
+        assert parser.parse('011') == 11
+        assert parser.parse('0' * 5000) == 0
+        assert parser.parse('12') is None
+
+    def test_log_invalid_summary(self, caplog):
+        """ Tests for log_invalid_summary. """
+        parser = voteparser.VoteParser(3)
+
+        # Case 1: nothing is logged when every message was a ballot.
+        parser.parse('1')
+        with caplog.at_level(logging.WARNING):
+            parser.log_invalid_summary('mapvote')
+        assert not caplog.records
+
+        # Case 2: the invalid messages are logged once, with the count of each reason.
+        for message in ['hello', 'gg', '7']:
+            parser.parse(message)
+        with caplog.at_level(logging.WARNING):
+            parser.log_invalid_summary('mapvote')
+        assert len(caplog.records) == 1
+        assert 'Skipped 3 invalid mapvote messages (2 not a number, 1 out of range)' in caplog.records[0].getMessage()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the whitelist functionality.
+#
+
+from unittest import mock
+
+from atomicfile import atomicfile
+from players import players
+from whitelist import whitelist
+
+REGULAR = players.Player(0, '76561198000000000', 'regular', 1, 1)
+SEEDER = players.Player(1, '76561198000000001', 'seeder', 1, None)
+RANDO = players.Player(2, '76561198000000002', 'rando', 2, None)
+
+
+class TestWhitelist:
+    """ Test class (uses pytest) for the whitelist module. """
+
+    def test_hours_store(self, tmp_path):
+        """ Tests for HoursStore. """
+        store = whitelist.HoursStore(tmp_path / 'hours.sqlite3')
+
+        # Case 1: unknown players have no hours.
+        assert store.get_hours(REGULAR.steam_id) == (0.0, 0.0)
+        assert store.get_qualifying_players(1.0, 2.0) == {}
+
+        # Case 2: seeding time counts towards both the seeding and total hours.
+        store.add_time([REGULAR, SEEDER], 3600.0, seeding=True)
+        store.add_time([REGULAR], 3600.0, seeding=False)
+        assert store.get_hours(REGULAR.steam_id) == (1.0, 2.0)
+        assert store.get_hours(SEEDER.steam_id) == (1.0, 1.0)
+
+        # Case 3: players qualify with either threshold, and the check can be limited to some players.
+        assert store.get_qualifying_players(1.0, 10.0) == {REGULAR.steam_id: 'regular', SEEDER.steam_id: 'seeder'}
+        assert store.get_qualifying_players(5.0, 2.0) == {REGULAR.steam_id: 'regular'}
+        assert store.get_qualifying_players(1.0, 10.0, steam_ids=[SEEDER.steam_id, RANDO.steam_id]) == {
+            SEEDER.steam_id: 'seeder'}
+
+        # Case 4: the hours persist.
+        store.close()
+        store = whitelist.HoursStore(tmp_path / 'hours.sqlite3')
+        assert store.get_hours(REGULAR.steam_id) == (1.0, 2.0)
+        store.close()
+
+    def test_admins_file(self, tmp_path):
+        """ Tests for format_admins_file and read_admins_file_members. """
+        filepath = tmp_path / 'Admins.cfg'
+
+        # Case 1: a missing file has no members.
+        assert whitelist.read_admins_file_members(filepath) == set()
+
+        # Case 2: the written file is sorted and can be read back (names with whitespace are kept on one line).
+        contents = whitelist.format_admins_file({'2': 'b', '1': 'a\nnewline'})
+        assert contents == 'Group=Whitelist:reserve\n\nAdmin=1:Whitelist // a newline\nAdmin=2:Whitelist // b\n'
+        atomicfile.write_file_atomically(filepath, contents)
+        assert whitelist.read_admins_file_members(filepath) == {'1', '2'}
+
+        # Case 3: rewriting the file replaces it and leaves no temporary files behind.
+        atomicfile.write_file_atomically(filepath, whitelist.format_admins_file({}))
+        assert whitelist.read_admins_file_members(filepath) == set()
+        assert [path.name for path in tmp_path.iterdir()] == ['Admins.cfg']
+
+    def test_whitelister(self, tmp_path):
+        """ Tests for Whitelister. """
+        client = mock.MagicMock()
+        tracker = players.PlayerTracker(client)
+        store = whitelist.HoursStore(tmp_path / 'hours.sqlite3')
+        store.add_time([REGULAR], 3600.0 * 2, seeding=False)
+        filepath = tmp_path / 'Admins.cfg'
+
+        # Case 1: players that already qualify are written on startup.
+        whitelister = whitelist.Whitelister(client, tracker, store, filepath, seeding_hours_threshold=1.0,
+                                            total_hours_threshold=2.0, seeding_player_threshold=3)
+        assert whitelist.read_admins_file_members(filepath) == {REGULAR.steam_id}
+        client.exec_command.assert_called_once_with(whitelist.RELOAD_ADMINS_COMMAND)
+
+        # Case 2: the first snapshot is not credited, and an up to date file is not rewritten on startup.
+        client.reset_mock()
+        whitelister = whitelist.Whitelister(client, tracker, store, filepath, seeding_hours_threshold=1.0,
+                                            total_hours_threshold=2.0, seeding_player_threshold=3)
+        tracker.update([REGULAR, SEEDER], now=0.0)
+        whitelister.run_once('current', 'next', {})
+        assert store.get_hours(SEEDER.steam_id) == (0.0, 0.0)
+        client.exec_command.assert_not_called()
+
+        # Case 3: credited time is capped, and the file is not rewritten while nobody new qualifies.
+        tracker.update([REGULAR, SEEDER], now=whitelist.MAX_CREDITED_INTERVAL_S * 2)
+        whitelister.run_once('current', 'next', {})
+        assert store.get_hours(SEEDER.steam_id) == (whitelist.MAX_CREDITED_INTERVAL_S / 3600,) * 2
+        client.exec_command.assert_not_called()
+
+        # Case 4: the same snapshot is not credited twice.
+        whitelister.run_once('current', 'next', {})
+        assert store.get_hours(SEEDER.steam_id) == (whitelist.MAX_CREDITED_INTERVAL_S / 3600,) * 2
+
+        # Case 5: a player that qualifies is whitelisted and the server reloads its admins.
+        store.add_time([SEEDER], 3600.0, seeding=True)
+        tracker.update([REGULAR, SEEDER], now=whitelist.MAX_CREDITED_INTERVAL_S * 2 + 1)
+        whitelister.run_once('current', 'next', {})
+        assert whitelist.read_admins_file_members(filepath) == {REGULAR.steam_id, SEEDER.steam_id}
+        client.exec_command.assert_called_once_with(whitelist.RELOAD_ADMINS_COMMAND)
+
+        # Case 6: time played on a full server does not count as seeding.
+        tracker.update([REGULAR, SEEDER, RANDO], now=whitelist.MAX_CREDITED_INTERVAL_S * 2 + 101)
+        whitelister.run_once('current', 'next', {})
+        assert store.get_hours(RANDO.steam_id) == (0.0, 100.0 / 3600)
+
+        # Case 7: without an admins file, the hours are still credited but nobody is whitelisted.
+        client.reset_mock()
+        hours_only = whitelist.Whitelister(client, tracker, store, None, seeding_hours_threshold=1.0,
+                                           total_hours_threshold=2.0, seeding_player_threshold=3)
+        hours_only.run_once('current', 'next', {})
+        tracker.update([RANDO], now=whitelist.MAX_CREDITED_INTERVAL_S * 2 + 201)
+        hours_only.run_once('current', 'next', {})
+        assert store.get_hours(RANDO.steam_id) == (100.0 / 3600, 200.0 / 3600)
+        assert hours_only.members == {}
+        client.exec_command.assert_not_called()
+        store.close()
@@ -0,0 +1,204 @@
+#! /usr/bin/env python3
+
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A testing class to test the WorkerPool and Plugin functionality.
+#
+
+from concurrent import futures
+import threading
+import time
+
+import pytest
+
+from plugin import plugin
+from plugin import workerpool
+
+# How long to wait for the pool to finish a task in the tests.
+WAIT_TIMEOUT_S = 5.0
+
+
+def square(value):
+    """ A picklable function to run in the process pool. """
+    return value * value
+
+
+def poll_until_delivered(pool, num_tasks=1):
+    """ Helper that polls the given pool until the given number of tasks are delivered (or the wait times out). """
+    num_delivered = 0
+    end_time = time.monotonic() + WAIT_TIMEOUT_S
+    while num_delivered < num_tasks and time.monotonic() < end_time:
+        num_delivered += pool.poll()
+        time.sleep(0.01)
+    return num_delivered
+
+
+class FakePlugin(plugin.Plugin):
+    """ A plugin that does nothing (Plugin itself is abstract). """
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        pass
+
+
+class TestWorkerPool:
+    """ Test class (uses pytest) for the WorkerPool class. """
+
+    @pytest.fixture
+    def pool(self):
+        """ The fixture function to return a thread worker pool. """
+        with workerpool.WorkerPool(workerpool.THREAD_MODE, 2) as pool:
+            yield pool
+
+    def test_invalid_mode(self):
+        """ Tests that an invalid mode raises. """
+        with pytest.raises(ValueError):
+            workerpool.WorkerPool('not a mode')
+
+    def test_results_delivered_on_poll(self, pool):
+        """ Tests that results are only delivered by poll(), and only once. """
+        results = []
+        pool.submit(square, 3, on_result=results.append)
+        # Case 1: the callback is never called before poll() (even if the task is done).
+        pool.pending_tasks[0].future.result(timeout=WAIT_TIMEOUT_S)
+        assert results == []
+
+        # Case 2: poll() delivers the result exactly once.
+        assert poll_until_delivered(pool) == 1
+        assert results == [9]
+        assert pool.poll() == 0
+        assert results == [9]
+        assert not pool.pending_tasks
+
+    def test_errors_delivered(self, pool):
+        """ Tests that exceptions in tasks are delivered to on_error. """
+        errors = []
+        pool.submit(square, 'not a number', on_error=errors.append)
+        assert poll_until_delivered(pool) == 1
+        assert len(errors) == 1
+        assert isinstance(errors[0], TypeError)
+
+    def test_deadline_exceeded(self, pool):
+        """ Tests that tasks that miss their deadline are cancelled and their results thrown away. """
+        release = threading.Event()
+        results = []
+        errors = []
+
+        def slow_task(cancel_event):
+            release.wait(WAIT_TIMEOUT_S)
+            return cancel_event.is_set()
+
+        task = pool.submit(slow_task, deadline_s=0.0, on_result=results.append, on_error=errors.append,
+                           cancellable=True)
+        assert poll_until_delivered(pool) == 1
+        assert results == []
+        assert len(errors) == 1
+        assert isinstance(errors[0], workerpool.TaskDeadlineExceeded)
+        # The task was told to cancel, and finishing it late does not deliver anything.
+        assert task.cancel_event.is_set()
+        release.set()
+        assert task.future.result(timeout=WAIT_TIMEOUT_S)
+        assert pool.poll() == 0
+        assert results == []
+
+    def test_cancel(self, pool):
+        """ Tests cancelling tasks. """
+        release = threading.Event()
+        errors = []
+        # Fill up both workers so the third task is never started.
+        running_tasks = [pool.submit(release.wait, WAIT_TIMEOUT_S, deadline_s=None) for _ in range(2)]
+        queued_task = pool.submit(square, 2, on_error=errors.append)
+
+        pool.cancel(queued_task)
+        assert len(errors) == 1
+        assert isinstance(errors[0], futures.CancelledError)
+        assert queued_task.future.cancelled()
+
+        # Cancelling twice does nothing.
+        pool.cancel(queued_task)
+        assert len(errors) == 1
+
+        release.set()
+        assert poll_until_delivered(pool, len(running_tasks)) == len(running_tasks)
+
+    def test_abandoned_tasks(self, pool):
+        """ Tests that tasks are refused while every worker is stuck on a cancelled task. """
+        release = threading.Event()
+        results = []
+        errors = []
+        hung_tasks = [pool.submit(release.wait, WAIT_TIMEOUT_S, deadline_s=0.0) for _ in range(2)]
+        while not all(task.future.running() for task in hung_tasks):
+            time.sleep(0.01)
+
+        # Case 1: the hung tasks miss their deadline, but still hold on to both workers.
+        assert poll_until_delivered(pool, len(hung_tasks)) == len(hung_tasks)
+        assert pool.get_num_abandoned_tasks() == 2
+
+        # Case 2: new tasks are refused (instead of waiting forever for a worker).
+        pool.submit(square, 3, on_result=results.append, on_error=errors.append)
+        assert poll_until_delivered(pool) == 1
+        assert results == []
+        assert len(errors) == 1
+        assert isinstance(errors[0], workerpool.WorkerPoolSaturated)
+
+        # Case 3: once the hung tasks finish, new tasks run again.
+        release.set()
+        for task in hung_tasks:
+            task.future.result(timeout=WAIT_TIMEOUT_S)
+        assert pool.get_num_abandoned_tasks() == 0
+        pool.submit(square, 3, on_result=results.append, on_error=errors.append)
+        assert poll_until_delivered(pool) == 1
+        assert results == [9]
+
+    def test_cancellable_only_in_thread_mode(self):
+        """ Tests that cancellable tasks are rejected in process mode. """
+        with workerpool.WorkerPool(workerpool.PROCESS_MODE, 1) as pool:
+            with pytest.raises(ValueError):
+                pool.submit(square, 2, cancellable=True)
+
+    def test_process_mode(self):
+        """ Tests that the process pool delivers results too. """
+        results = []
+        with workerpool.WorkerPool(workerpool.PROCESS_MODE, 1) as pool:
+            pool.submit(square, 4, deadline_s=WAIT_TIMEOUT_S, on_result=results.append)
+            assert poll_until_delivered(pool) == 1
+        assert results == [16]
+
+
+class TestPlugin:
+    """ Test class (uses pytest) for the Plugin base class. """
+
+    def test_run_in_worker_inline(self):
+        """ Tests that run_in_worker runs the work inline when there is no pool. """
+        test_plugin = FakePlugin(None)
+        results = []
+        errors = []
+        assert test_plugin.run_in_worker(square, 5, on_result=results.append, on_error=errors.append) is None
+        assert results == [25]
+        assert test_plugin.run_in_worker(square, None, on_result=results.append, on_error=errors.append) is None
+        assert results == [25]
+        assert len(errors) == 1
+
+    def test_run_in_worker_pool(self):
+        """ Tests that run_in_worker submits the work to the pool when there is one. """
+        results = []
+        with workerpool.WorkerPool(workerpool.THREAD_MODE, 1) as pool:
+            test_plugin = FakePlugin(None, worker_pool=pool)
+            assert test_plugin.run_in_worker(square, 6, on_result=results.append) is not None
+            assert results == []
+            assert poll_until_delivered(pool) == 1
+        assert results == [36]
+
+    def test_run_once_abstract(self):
+        """ Tests that plugins must override run_once. """
+        with pytest.raises(TypeError):
+            plugin.Plugin(None)
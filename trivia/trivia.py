@@ -0,0 +1,369 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A plugin that runs trivia rounds in chat (meant to keep seeding servers interesting).
+#
+
+import array
+import collections
+import logging
+import mmap
+import os
+import random
+import re
+import sqlite3
+import struct
+import time
+import unicodedata
+
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# The separator between the question and its accepted answers on each line of the question bank file, e.g.:
+# What is the capital of France?|Paris
+QUESTION_BANK_SEPARATOR = b'|'
+
+# Lines in the question bank that start with this are ignored.
+QUESTION_BANK_COMMENT = b'#'
+
+# The extension of the index file saved next to the question bank (so the bank is only scanned when it changes).
+INDEX_FILE_SUFFIX = '.idx'
+
+# The header of the index file: the size and mtime (in ns) of the question bank the index was built from.
+INDEX_HEADER = struct.Struct('<QQ')
+
+# How long to wait (in seconds) in between trivia questions.
+DEFAULT_QUESTION_INTERVAL_S = 60.0 * 3
+
+# How long players have to answer a question (in seconds).
+DEFAULT_ANSWER_TIME_S = 45.0
+
+# The minimum trigram similarity (Dice coefficient) between a message and an answer to count as correct.
+DEFAULT_MATCH_THRESHOLD = 0.8
+
+# Answers shorter than this (or with any digits in them) must be matched exactly (a typo changes their meaning).
+MIN_FUZZY_ANSWER_LENGTH = 4
+
+# Words that are ignored when comparing answers.
+IGNORED_WORDS = frozenset(['a', 'an', 'the'])
+
+# The chat command players use to see their trivia score.
+SCORE_COMMAND = '!score'
+
+# The strings to be formatted and sent to the server during a trivia round.
+QUESTION_MESSAGE_TEMPLATE = 'Trivia time! {question}'
+CORRECT_ANSWER_MESSAGE_TEMPLATE = '{player_name} got it! The answer was: {answer}. They now have {score} points.'
+NO_ANSWER_MESSAGE_TEMPLATE = 'Nobody got it! The answer was: {answer}.'
+SCORE_MESSAGE_TEMPLATE = 'Your trivia score is {score} (rank {rank} of {num_players}).'
+
+Question = collections.namedtuple('Question', ['text', 'answers'])
+
+
+def normalize(text):
+    """ Returns the given text lowercased with accents, punctuation, extra whitespace, and IGNORED_WORDS removed. """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(word for word in re.findall(r'\w+', text) if word not in IGNORED_WORDS)
+
+
+def get_trigrams(normalized_text):
+    """ Returns the set of character trigrams of the given normalized text (padded so short words have trigrams). """
+    padded = f' {normalized_text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class QuestionBank:
+    """
+    A large bank of trivia questions that is not loaded into memory. The bank file is memory-mapped, and only a compact
+    array of line offsets is kept (and saved in an index file next to the bank so it is only rebuilt when the bank
+    changes). Questions are decoded one at a time when they are asked.
+    """
+
+    def __init__(self, filepath):
+        """
+        The constructor for QuestionBank.
+
+        :param filepath: Path The filepath to the question bank. Each line is a question followed by its accepted
+                         answers, separated by QUESTION_BANK_SEPARATOR.
+        """
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            # mmap cannot map empty files.
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        self.offsets = self.load_index(stat)
+        if self.offsets is None:
+            self.offsets = self.build_index()
+            self.save_index(stat)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Unmaps the question bank file. """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def get_index_filepath(self):
+        return f'{self.filepath}{INDEX_FILE_SUFFIX}'
+
+    def load_index(self, stat):
+        """ Returns the offsets from the saved index file if it matches the bank, and None otherwise. """
+        try:
+            with open(self.get_index_filepath(), 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size or INDEX_HEADER.unpack(header) != (stat.st_size,
+                                                                                        stat.st_mtime_ns):
+                    return None
+                offsets = array.array('Q')
+                offsets.frombytes(f.read())
+                return offsets
+        except (OSError, ValueError):
+            return None
+
+    def save_index(self, stat):
+        """ Saves the offsets to the index file (failing to save is not fatal, the index is just rebuilt next time). """
+        try:
+            with open(self.get_index_filepath(), 'wb') as f:
+                f.write(INDEX_HEADER.pack(stat.st_size, stat.st_mtime_ns))
+                self.offsets.tofile(f)
+        except OSError as e:
+            logger.warning(f'Could not save trivia question bank index: {e}')
+
+    def build_index(self):
+        """ Scans the bank once and returns the offsets of every valid question line. """
+        offsets = array.array('Q')
+        start = 0
+        size = len(self.data)
+        while start < size:
+            end = self.data.find(b'\n', start)
+            if end == -1:
+                end = size
+            line = self.data[start:end].strip()
+            fields = line.split(QUESTION_BANK_SEPARATOR)
+            # Skip blank lines, comments, and questions without any answers.
+            if (fields[0] and not fields[0].startswith(QUESTION_BANK_COMMENT) and
+                    any(field.strip() for field in fields[1:])):
+                # Questions are only decoded when they are asked, so a line that cannot be decoded is skipped now.
+                try:
+                    line.decode('utf-8')
+                except UnicodeDecodeError as e:
+                    logger.warning(f'Skipping trivia question at byte {start} of {self.filepath} (not UTF-8): {e}')
+                else:
+                    offsets.append(start)
+            start = end + 1
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        """ Returns the Question at the given index. """
+        start = self.offsets[index]
+        end = self.data.find(b'\n', start)
+        line = self.data[start:end if end != -1 else len(self.data)].decode('utf-8').strip()
+        fields = [field.strip() for field in line.split(QUESTION_BANK_SEPARATOR.decode())]
+        return Question(fields[0], [answer for answer in fields[1:] if answer])
+
+    def get_random_question(self):
+        """ Returns a random Question from the bank. """
+        return self[random.randrange(len(self))]
+
+
+class AnswerMatcher:
+    """
+    Checks chat messages against the accepted answers of one question. Exact (normalized) matches are a single set
+    lookup, and near misses (typos) are found using a trigram index of the answers instead of comparing the message to
+    every answer. Answers can appear anywhere in a message (e.g. "is it paris?").
+    """
+
+    def __init__(self, answers, threshold=DEFAULT_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.normalized_answers = [normalize(answer) for answer in answers]
+        self.exact_answers = {answer for answer in self.normalized_answers if answer}
+
+        # The number of words in each answer (we only compare message windows with the same number of words).
+        self.answer_word_counts = {len(answer.split()) for answer in self.exact_answers}
+
+        # The trigrams of each answer, and an index of which (fuzzy matchable) answers contain each trigram.
+        self.answer_trigrams = [get_trigrams(answer) for answer in self.normalized_answers]
+        self.trigram_index = collections.defaultdict(list)
+        for answer_id, trigrams in enumerate(self.answer_trigrams):
+            answer = self.normalized_answers[answer_id]
+            if len(answer) >= MIN_FUZZY_ANSWER_LENGTH and not any(c.isdigit() for c in answer):
+                for trigram in trigrams:
+                    self.trigram_index[trigram].append(answer_id)
+
+    def get_windows(self, normalized_message):
+        """ Returns all runs of consecutive words in the message that have as many words as some answer. """
+        words = normalized_message.split()
+        for word_count in self.answer_word_counts:
+            for start in range(len(words) - word_count + 1):
+                yield ' '.join(words[start:start + word_count])
+
+    def is_fuzzy_match(self, window):
+        """ Returns True if the given window is similar enough to any of the answers, and False otherwise. """
+        window_trigrams = get_trigrams(window)
+        overlaps = collections.Counter()
+        for trigram in window_trigrams:
+            overlaps.update(self.trigram_index.get(trigram, ()))
+        for answer_id, overlap in overlaps.items():
+            dice = 2.0 * overlap / (len(window_trigrams) + len(self.answer_trigrams[answer_id]))
+            if dice >= self.threshold:
+                return True
+        return False
+
+    def matches(self, message):
+        """ Returns True if the message contains one of the answers (or something very close to it). """
+        normalized_message = normalize(message)
+        if normalized_message in self.exact_answers:
+            return True
+        windows = list(self.get_windows(normalized_message))
+        return (any(window in self.exact_answers for window in windows) or
+                any(self.is_fuzzy_match(window) for window in windows))
+
+
+class ScoreStore:
+    """ A persistent store (backed by SQLite) of the trivia points of every player, so they survive reconnects. """
+
+    def __init__(self, filepath=':memory:'):
+        """
+        The constructor for ScoreStore.
+
+        :param filepath: Path The filepath to the SQLite database. Defaults to an in-memory database (not persisted).
+        """
+        self.connection = sqlite3.connect(str(filepath))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS trivia_scores (player_id TEXT PRIMARY KEY, '
+                                    'score INTEGER NOT NULL DEFAULT 0)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS trivia_scores_score ON trivia_scores (score)')
+
+    def add_point(self, player_id):
+        """ Awards a point to the given player, and returns their new score. """
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO trivia_scores (player_id) VALUES (?)', (player_id,))
+            self.connection.execute('UPDATE trivia_scores SET score = score + 1 WHERE player_id = ?', (player_id,))
+        return self.get_score(player_id)
+
+    def get_score(self, player_id):
+        """ Returns the points of the given player (0 if they never scored). """
+        row = self.connection.execute('SELECT score FROM trivia_scores WHERE player_id = ?', (player_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get_rank(self, player_id):
+        """ Returns the rank (starting at 1) of the given player by score, and the number of ranked players. """
+        score = self.get_score(player_id)
+        num_higher = self.connection.execute('SELECT COUNT(*) FROM trivia_scores WHERE score > ?',
+                                             (score,)).fetchone()[0]
+        num_players, has_player = self.connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(player_id = ?), 0) FROM trivia_scores', (player_id,)).fetchone()
+        return 1 + num_higher, num_players + (not has_player)
+
+    def close(self):
+        self.connection.close()
+
+
+class Trivia(plugin.Plugin):
+    """
+    A plugin that asks a trivia question from the question bank every so often, and awards a point to the first player
+    that answers it correctly in chat. Players can type SCORE_COMMAND to see their score.
+    """
+
+    def __init__(self, squad_rcon_client, question_bank, question_interval_s=DEFAULT_QUESTION_INTERVAL_S,
+                 answer_time_s=DEFAULT_ANSWER_TIME_S, score_store=None, worker_pool=None):
+        """
+        The constructor for Trivia.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param question_bank: QuestionBank The questions to ask.
+        :param question_interval_s: float How long to wait in between questions (in seconds).
+        :param answer_time_s: float How long players have to answer each question (in seconds).
+        :param score_store: ScoreStore Where the points of each player are kept. None to keep them in memory only.
+        :param worker_pool: WorkerPool The pool to run heavy work in (see Plugin).
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.question_bank = question_bank
+        self.question_interval_s = question_interval_s
+        self.answer_time_s = answer_time_s
+
+        # The current question and its answer matcher (both None when no round is running).
+        self.question = None
+        self.matcher = None
+        # The time (since the epoch) when the current round ends, or when the next round starts.
+        self.round_end_time = None
+        self.next_round_time = time.time() + question_interval_s
+
+        # The points for each player (keyed by player_id).
+        self.scores = score_store if score_store is not None else ScoreStore()
+
+    def start_round(self):
+        """ Asks a new random question. """
+        self.question = self.question_bank.get_random_question()
+        self.matcher = AnswerMatcher(self.question.answers)
+        self.round_end_time = time.time() + self.answer_time_s
+        logger.info(f'Starting trivia round with question: {self.question}')
+        self.squad_rcon_client.exec_command(
+            f'AdminBroadcast {QUESTION_MESSAGE_TEMPLATE.format(question=self.question.text)}')
+
+    def end_round(self, message):
+        """ Ends the current round by broadcasting the given message, and schedules the next round. """
+        self.squad_rcon_client.exec_command(f'AdminBroadcast {message}')
+        logger.info(message)
+        self.question = None
+        self.matcher = None
+        self.next_round_time = time.time() + self.question_interval_s
+
+    def find_winner(self, recent_player_chat):
+        """
+        Returns the (player_id, player_name) of the first player with a correct answer, or None if nobody has one.
+
+        RCON reports the chat grouped by player and without timestamps, so the order of the answers within one tick is
+        unknown. When several players answer correctly in the same tick, the winner is the one listed first in the chat
+        (i.e. whose first message of the tick came first), even if their answer was sent later.
+        """
+        for player_id, player_chat in recent_player_chat.items():
+            for message in player_chat.messages:
+                if self.matcher.matches(message):
+                    return (player_id, player_chat.player_name)
+        return None
+
+    def answer_score_requests(self, recent_player_chat):
+        """ Sends every player that used the score command their score (as an admin warning). """
+        for player_id, player_chat in recent_player_chat.items():
+            if any(message.strip().lower().startswith(SCORE_COMMAND) for message in player_chat.messages):
+                rank, num_players = self.scores.get_rank(player_id)
+                score_message = SCORE_MESSAGE_TEMPLATE.format(
+                    score=self.scores.get_score(player_id), rank=rank, num_players=num_players)
+                self.squad_rcon_client.exec_command(f'AdminWarn "{player_id}" {score_message}')
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Checks the recent chat for answers to the current question, and starts or ends rounds when it is time. """
+        self.answer_score_requests(recent_player_chat)
+
+        if self.question is None:
+            if time.time() >= self.next_round_time and len(self.question_bank):
+                self.start_round()
+            return
+
+        winner = self.find_winner(recent_player_chat)
+        if winner:
+            player_id, player_name = winner
+            score = self.scores.add_point(player_id)
+            self.end_round(CORRECT_ANSWER_MESSAGE_TEMPLATE.format(
+                player_name=player_name, answer=self.question.answers[0], score=score))
+        elif time.time() >= self.round_end_time:
+            self.end_round(NO_ANSWER_MESSAGE_TEMPLATE.format(answer=self.question.answers[0]))
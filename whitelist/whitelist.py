@@ -0,0 +1,218 @@
+# Copyright (C) 2020 Basheer Subei
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <http://www.gnu.org/licenses/>.
+#
+# A plugin that automatically whitelists seeders and regulars based on the hours they have played on the server.
+#
+
+import logging
+import sqlite3
+
+from atomicfile import atomicfile
+from plugin import plugin
+
+logger = logging.getLogger(__name__)
+
+# Players that played at least this many hours while the server was seeding are whitelisted.
+DEFAULT_SEEDING_HOURS_THRESHOLD = 10.0
+# Players that played at least this many hours in total are whitelisted.
+DEFAULT_TOTAL_HOURS_THRESHOLD = 100.0
+
+# The server is seeding while it has fewer than this many players.
+DEFAULT_SEEDING_PLAYER_THRESHOLD = 50
+
+# The most seconds credited to the players between two snapshots (so time the bot was not running is not credited).
+MAX_CREDITED_INTERVAL_S = 5.0 * 60
+
+# The admin group given to whitelisted players, and its permissions (reserve is a reserved slot, i.e. whitelist).
+WHITELIST_GROUP = 'Whitelist'
+WHITELIST_PERMISSIONS = ['reserve']
+
+# The RCON command that makes the server reload its admins (and whitelist) file.
+RELOAD_ADMINS_COMMAND = 'AdminReloadServerConfig'
+
+
+class HoursStore:
+    """
+    A persistent store (backed by SQLite) of the seconds each player has played, in total and while the server was
+    seeding. Both are indexed so the qualifying players can be queried without scanning every player.
+    """
+
+    def __init__(self, filepath):
+        self.connection = sqlite3.connect(str(filepath))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS player_hours (steam_id TEXT PRIMARY KEY, name TEXT NOT NULL, '
+                'seeding_s REAL NOT NULL DEFAULT 0, total_s REAL NOT NULL DEFAULT 0)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS player_hours_seeding_s ON player_hours (seeding_s)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS player_hours_total_s ON player_hours (total_s)')
+
+    def add_time(self, players, played_s, seeding):
+        """
+        Credits the given players with played_s seconds (in one transaction).
+
+        :param players: list(Player) The players to credit.
+        :param played_s: float The seconds to credit each player with.
+        :param seeding: bool Whether the server was seeding (the seconds also count as seeding time).
+        """
+        seeding_s = played_s if seeding else 0.0
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO player_hours (steam_id, name) VALUES (?, ?)',
+                                        [(player.steam_id, player.name) for player in players])
+            self.connection.executemany(
+                'UPDATE player_hours SET name = ?, seeding_s = seeding_s + ?, total_s = total_s + ? WHERE steam_id = ?',
+                [(player.name, seeding_s, played_s, player.steam_id) for player in players])
+
+    def get_hours(self, steam_id):
+        """ Returns the (seeding, total) hours played by the given player. """
+        row = self.connection.execute('SELECT seeding_s, total_s FROM player_hours WHERE steam_id = ?',
+                                      (steam_id,)).fetchone()
+        return (row[0] / 3600, row[1] / 3600) if row else (0.0, 0.0)
+
+    def get_qualifying_players(self, seeding_hours_threshold, total_hours_threshold, steam_ids=None):
+        """
+        Returns a dict of steam id to name of the players that meet either threshold.
+
+        :param steam_ids: list(str) Only check these players (e.g. the ones credited since the last check). None to
+                          check every player (uses the indexes).
+        """
+        thresholds = (seeding_hours_threshold * 3600, total_hours_threshold * 3600)
+        if steam_ids is None:
+            rows = self.connection.execute(
+                'SELECT steam_id, name FROM player_hours WHERE seeding_s >= ? '
+                'UNION SELECT steam_id, name FROM player_hours WHERE total_s >= ?', thresholds).fetchall()
+            return dict(rows)
+        qualifying = {}
+        for steam_id in steam_ids:
+            row = self.connection.execute(
+                'SELECT steam_id, name FROM player_hours WHERE steam_id = ? AND (seeding_s >= ? OR total_s >= ?)',
+                (steam_id,) + thresholds).fetchone()
+            if row:
+                qualifying[row[0]] = row[1]
+        return qualifying
+
+    def close(self):
+        self.connection.close()
+
+
+def format_admins_file(members):
+    """
+    Returns the contents of a Squad admins file (Admins.cfg) that whitelists the given players.
+
+    :param members: dict(str->str) The steam id and name of every whitelisted player.
+    :return: str The contents of the file (sorted by steam id so the same members always give the same file).
+    """
+    lines = [f'Group={WHITELIST_GROUP}:{",".join(WHITELIST_PERMISSIONS)}', '']
+    lines.extend(f'Admin={steam_id}:{WHITELIST_GROUP} // {" ".join(members[steam_id].split())}'
+                 for steam_id in sorted(members))
+    return '\n'.join(lines) + '\n'
+
+
+def read_admins_file_members(filepath):
+    """ Returns the steam ids given the whitelist group in the given admins file (empty if it does not exist). """
+    members = set()
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = line.split('//', 1)[0].strip()
+                if entry.startswith('Admin=') and entry.endswith(f':{WHITELIST_GROUP}'):
+                    members.add(entry[len('Admin='):-len(f':{WHITELIST_GROUP}')])
+    except FileNotFoundError:
+        pass
+    return members
+
+
+class Whitelister(plugin.Plugin):
+    """
+    A plugin that credits the players on the server with the time they play (using the PlayerTracker snapshots), and
+    whitelists them once they have played enough hours. The whitelist is only rewritten (and the server's admins only
+    reloaded) when a player qualifies, which is checked only for the players credited since the previous tick.
+    """
+
+    def __init__(self, squad_rcon_client, player_tracker, hours_store, admins_filepath,
+                 seeding_hours_threshold=DEFAULT_SEEDING_HOURS_THRESHOLD,
+                 total_hours_threshold=DEFAULT_TOTAL_HOURS_THRESHOLD,
+                 seeding_player_threshold=DEFAULT_SEEDING_PLAYER_THRESHOLD, worker_pool=None):
+        """
+        The constructor for Whitelister.
+
+        :param squad_rcon_client: RconConnection The handle to the rcon client.
+        :param player_tracker: PlayerTracker The tracker of the players on the server (must run before this plugin).
+        :param hours_store: HoursStore Where the hours played by every player are kept.
+        :param admins_filepath: Path The admins file (Admins.cfg format) the whitelist is written to. This file should
+                                only be used for the whitelist (include it from the server's admins config). None to
+                                only credit the hours played (e.g. for the poll segments) without whitelisting.
+        :param seeding_hours_threshold: float The seeding hours a player needs to be whitelisted.
+        :param total_hours_threshold: float The total hours a player needs to be whitelisted.
+        :param seeding_player_threshold: int The server is seeding while it has fewer players than this.
+        :param worker_pool: WorkerPool See Plugin.
+        """
+        super().__init__(squad_rcon_client, worker_pool)
+        self.player_tracker = player_tracker
+        self.hours_store = hours_store
+        self.admins_filepath = admins_filepath
+        self.seeding_hours_threshold = seeding_hours_threshold
+        self.total_hours_threshold = total_hours_threshold
+        self.seeding_player_threshold = seeding_player_threshold
+
+        # The time of the latest snapshot that was credited (None until the first one).
+        self.credited_snapshot_time = None
+        # The whitelisted players (steam id to name), starting with everyone that already qualifies.
+        self.members = {}
+        if self.admins_filepath is not None:
+            self.members = self.hours_store.get_qualifying_players(seeding_hours_threshold, total_hours_threshold)
+            # Bring the file up to date in case the thresholds changed or the file was edited while the bot was down.
+            if read_admins_file_members(self.admins_filepath) != set(self.members):
+                self.write_whitelist()
+
+    def write_whitelist(self):
+        """ Rewrites the admins file with the current members and makes the server reload it. """
+        atomicfile.write_file_atomically(self.admins_filepath, format_admins_file(self.members))
+        logger.info(f'Wrote {len(self.members)} whitelisted players to {self.admins_filepath}.')
+        self.squad_rcon_client.exec_command(RELOAD_ADMINS_COMMAND)
+
+    def credit_players(self):
+        """
+        Credits the players in the latest snapshot with the time since the previous snapshot.
+
+        :return: list(Player) The credited players.
+        """
+        snapshot_time = self.player_tracker.snapshot_time
+        if snapshot_time is None or snapshot_time == self.credited_snapshot_time:
+            return []
+        previous_snapshot_time = self.credited_snapshot_time
+        self.credited_snapshot_time = snapshot_time
+        if previous_snapshot_time is None:
+            return []
+        played_s = min(snapshot_time - previous_snapshot_time, MAX_CREDITED_INTERVAL_S)
+        active_players = [record.player for record in self.player_tracker.records.values()]
+        if not active_players or played_s <= 0:
+            return []
+        seeding = len(active_players) < self.seeding_player_threshold
+        self.hours_store.add_time(active_players, played_s, seeding)
+        return active_players
+
+    def run_once(self, current_map, next_map, recent_player_chat, **kwargs):
+        """ Credits the players on the server, and whitelists any that now qualify. """
+        credited_players = self.credit_players()
+        if self.admins_filepath is None:
+            return
+        candidates = [player.steam_id for player in credited_players if player.steam_id not in self.members]
+        if not candidates:
+            return
+        new_members = self.hours_store.get_qualifying_players(self.seeding_hours_threshold, self.total_hours_threshold,
+                                                              steam_ids=candidates)
+        if new_members:
+            logger.info(f'Whitelisting players: {list(new_members.values())}')
+            self.members.update(new_members)
+            self.write_whitelist()